@@ -26,10 +26,34 @@ def make_app(config_file):
 
 def make_initdb(config='config.yaml'):
     def initdb(config=('c', config)):
-        make_app(config).db.init_database()
+        """create DB tables (latest schema version)"""
+        from websod import migrate
+        db = make_app(config).db
+        db.init_database()
+        migrate.stamp(db.engine)
     return initdb
 
 
+def make_migrate(config='config.yaml'):
+    def migrate_db(config=('c', config)):
+        """upgrade DB schema to latest version"""
+        from websod import migrate
+        executed = migrate.migrate(make_app(config).db.engine)
+        if not executed:
+            print "DB schema is up-to-date (version %s)" % migrate.LATEST_VERSION
+    return migrate_db
+
+
+def make_recalculate(config='config.yaml'):
+    def recalculate(config=('c', config)):
+        """calculate result of finished integrations not calculated yet"""
+        make_app(config)
+        from websod.integration import calculate_pending
+        for integration in calculate_pending():
+            print "%s: %s" % (integration.version, integration.result)
+    return recalculate
+
+
 def make_shell(init_func=None, config='config.yaml', banner=None,
                use_ipython=True):
     """Returns an action callback that spawns a new interactive
@@ -134,6 +158,8 @@ def make_flaskserver(config='config.yaml'):
 if __name__ == "__main__":
     # initdb
     action_initdb = make_initdb()
+    action_migrate = make_migrate()
+    action_recalculate = make_recalculate()
 
     # dev shell
     action_shell = make_shell(app_namespace)
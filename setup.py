@@ -4,6 +4,7 @@ setup(name='ServerOnDuty',
       packages=['sodd', 'websod'],
       scripts=['bin/sod'],
       install_requires=['Flask',
+                        'Werkzeug>=0.7',
                         'CherryPy==3.1.2',
                         'SQLAlchemy==0.5.8',
                         'doit',
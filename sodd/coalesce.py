@@ -0,0 +1,91 @@
+"""choose which new revisions are integrated
+
+After a burst of commits integrating every revision would take hours to
+get a result for the newest one. A coalescing policy integrates only some
+of the new revisions, the skipped revisions are "covered" by the next
+integrated revision (its result includes their changes).
+
+policies:
+ * all: integrate every revision (default)
+ * tip: integrate only the newest revision
+ * every: integrate one of every N revisions (and the newest)
+
+With bisect enabled, when an integration fails (and its parent did not)
+the revisions it covers are integrated (bisection) to find the first
+failing revision.
+"""
+
+
+class Coalesce(object):
+    """coalescing policy
+
+    @ivar policy (str): 'all', 'tip' or 'every'
+    @ivar every (int): integrate one of every N revisions ('every' policy)
+    @ivar bisect (bool): integrate skipped revisions to find first failure
+    @ivar results (dict): revision (str) => result ('success' or 'fail')
+                          of integrations executed by this process
+    """
+    POLICIES = ('all', 'tip', 'every')
+
+    def __init__(self, policy='all', every=1, bisect=False):
+        if policy not in self.POLICIES:
+            raise Exception("Invalid coalesce policy: %s" % policy)
+        if every < 1:
+            raise Exception("Invalid coalesce every: %s" % every)
+        self.policy = policy
+        self.every = every
+        self.bisect = bisect
+        self.results = {}
+
+
+    def select(self, revs):
+        """select revisions to be integrated
+
+        @param revs (list - dict): new revisions in order (see vcs.py)
+        @return (list - tuple): (revision, skipped) for every revision to be
+                 integrated, skipped is the list of revisions (dict) covered
+                 by it
+        """
+        if self.policy == 'tip':
+            step = len(revs)
+        elif self.policy == 'every':
+            step = self.every
+        else:
+            step = 1
+        selected = []
+        skipped = []
+        for index, rev in enumerate(revs):
+            # newest revision is always integrated
+            if (index + 1) % step == 0 or index == len(revs) - 1:
+                selected.append((rev, skipped))
+                skipped = []
+            else:
+                skipped.append(rev)
+        return selected
+
+
+    def selects_from_all(self):
+        """check if select must be called with all new revisions at once
+        ('all' policy selects revisions independently of each other)
+        """
+        return self.policy != 'all'
+
+
+    def set_result(self, revision, result):
+        # revisions come from VCS (str) or from DB (int)
+        self.results[str(revision)] = result
+
+
+    def must_bisect(self, result, parent_revision, skipped):
+        """check if revisions covered by an integration must be bisected"""
+        return (self.bisect and result == 'fail' and bool(skipped) and
+                self.results.get(str(parent_revision)) != 'fail')
+
+
+def bisect(revs):
+    """split list of revisions on the middle one
+    @return tuple(dict, list, list): middle revision, revisions before it,
+                                     revisions after it
+    """
+    middle = len(revs) // 2
+    return revs[middle], revs[:middle], revs[middle + 1:]
@@ -0,0 +1,129 @@
+"""execute DB writes on a dedicated thread
+
+A slow DB would block the scheduler loop (and every other task, including
+process watchdogs) if queries were executed directly by tasks.
+Tasks create a DbTask instead, it puts the write in a bounded queue and
+pauses until the writer thread executes it.
+"""
+
+import Queue
+import threading
+import logging
+
+from scheduler import Task, TaskPause, TaskSleep
+
+
+class DbWriter(object):
+    """thread that executes DbTask's writes
+
+    All writes available on the queue (up to max_batch) are executed in a
+    single transaction.
+
+    @ivar sched (Scheduler): DbTask's are put back on its ready queue
+    @ivar connect (callable): returns a new DB connection. connection is
+                              created and used only by the writer thread
+    @ivar queue (Queue): DbTask's waiting to be executed
+    @ivar max_batch (int): max number of writes in a transaction
+    """
+    def __init__(self, sched, connect, max_queue=1000, max_batch=100):
+        self.sched = sched
+        self.connect = connect
+        self.queue = Queue.Queue(max_queue)
+        self.max_batch = max_batch
+        self.thread = None
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="dbwriter")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+
+    def stop(self):
+        """execute pending writes and stop thread"""
+        self.queue.put(None)
+        self.thread.join()
+
+
+    def _get_batch(self):
+        """block until there is something to write
+        @return (list - DbTask): None indicates the thread must stop
+        """
+        batch = [self.queue.get()]
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+
+    def _run(self):
+        conn = self.connect()
+        while True:
+            batch = self._get_batch()
+            if batch[-1] is None:
+                self.write(conn, batch[:-1])
+                break
+            self.write(conn, batch)
+        conn.close()
+
+
+    def _execute(self, conn, batch):
+        cursor = conn.cursor()
+        for db_task in batch:
+            db_task.result = db_task.func(cursor, commit=False,
+                                          *db_task.args)
+        conn.commit()
+
+
+    def write(self, conn, batch):
+        """execute DbTask's writes and put them back on scheduler"""
+        try:
+            self._execute(conn, batch)
+        except Exception:
+            conn.rollback()
+            # execute one by one, so only the failing write is lost
+            for db_task in batch:
+                try:
+                    self._execute(conn, [db_task])
+                except Exception, exception:
+                    logging.error("DB write %s failed: %s" %
+                                  (db_task, exception))
+                    conn.rollback()
+                    db_task.error = exception
+        for db_task in batch:
+            self.sched.ready_threadsafe(db_task)
+
+
+class DbTask(Task):
+    """execute a DB write on the DbWriter thread
+
+    @ivar func (callable): litemodel function, called with a cursor, args
+                           and commit=False (DbWriter commits)
+    @ivar result: value returned by func
+    @ivar error (Exception): exception raised by func, re-raised by the task
+    """
+    # seconds to wait before trying again when writer queue is full
+    RETRY_DELAY = 0.1
+
+    def __init__(self, writer, func, *args):
+        Task.__init__(self, name=func.__name__)
+        self.writer = writer
+        self.func = func
+        self.args = args
+        self.result = None
+        self.error = None
+
+    def run(self):
+        # back pressure: DB is too slow, wait without blocking the loop
+        while True:
+            try:
+                self.writer.queue.put_nowait(self)
+                break
+            except Queue.Full:
+                yield TaskSleep(self.RETRY_DELAY)
+        # resumed by writer
+        yield TaskPause()
+        if self.error:
+            raise self.error
@@ -1,9 +1,23 @@
 """DB operation using SQLite"""
 
-from dbapiext import execute_f
+import zlib
+import hashlib
+import itertools
+
+from dbapiext import execute_f, qcompile
 
 # FIXME this code is so boring...
 
+# max number of rows in a multi-row INSERT
+INSERT_CHUNK_SIZE = 500
+# max number of values in a "IN" clause
+MAX_IN_VALUES = 500
+
+
+def is_postgres(cursor):
+    """check if cursor is from psycopg2"""
+    return cursor.__class__.__module__.startswith('psycopg2')
+
 
 def get_last_id(cursor):
     # sqlite
@@ -13,81 +27,241 @@ def get_last_id(cursor):
     cursor.execute('select lastval();')
     return cursor.fetchone()[0]
 
+
+def insert_f(cursor, query, *args):
+    """execute an INSERT query and return the id of inserted row"""
+    # postgres: get id in same round trip
+    if is_postgres(cursor):
+        execute_f(cursor, query + ' RETURNING id', *args)
+        return cursor.fetchone()[0]
+    execute_f(cursor, query, *args)
+    return get_last_id(cursor)
+
+
+def insert_many(cursor, query, values, rows, ignore_duplicates=False):
+    """INSERT many rows
+
+    sqlite: executemany on a compiled query.
+    postgres: multi-row VALUES, each query inserts up to INSERT_CHUNK_SIZE rows
+    @param query (str): INSERT query without VALUES
+    @param values (str): placeholders for one row, i.e. "(%X,%X)"
+    @param rows (list - tuple): values for each row
+    @param ignore_duplicates (bool): skip rows that violate a unique
+                                     constraint instead of failing
+    """
+    if not rows:
+        return
+    if not is_postgres(cursor):
+        if ignore_duplicates:
+            query = query.replace('INSERT', 'INSERT OR IGNORE', 1)
+        compiled = qcompile(query + ' VALUES ' + values)
+        params = [compiled.apply(*row) for row in rows]
+        cursor.executemany(params[0][0], [p[1] for p in params])
+        return
+    # postgres >= 9.5
+    conflict = ' ON CONFLICT DO NOTHING' if ignore_duplicates else ''
+    for start in xrange(0, len(rows), INSERT_CHUNK_SIZE):
+        chunk = rows[start:start + INSERT_CHUNK_SIZE]
+        rows_values = ','.join([values] * len(chunk))
+        execute_f(cursor, query + ' VALUES ' + rows_values + conflict,
+                  *itertools.chain(*chunk))
+
+
 #
 # integration
 #
+def revision_number(version):
+    """@return (int): revision as number, None if it is not numeric
+                     (i.e. working copy identifier)
+    """
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        return None
+
+
 def save_integration(cursor, version, state, result, owner, comment,
-                     source_tree_root_id):
-    execute_f(cursor, '''
-        INSERT INTO integration (version, state, result, owner, comment,
-                          source_tree_root_id) VALUES (%X,%X,%X,%X,%X,%X)''',
-              version, state, result, owner, comment, source_tree_root_id)
-    cursor.connection.commit()
-    return get_last_id(cursor)
+                     source_tree_root_id, parent_revision=None, commit=True):
+    id_ = insert_f(cursor, '''
+        INSERT INTO integration (version, revision, parent_revision, state,
+                          result, owner, comment, source_tree_root_id)
+                          VALUES (%X,%X,%X,%X,%X,%X,%X,%X)''',
+              version, revision_number(version),
+              revision_number(parent_revision), state, result, owner,
+              comment, source_tree_root_id)
+    if commit:
+        cursor.connection.commit()
+    return id_
 
 
 def get_last_revision_id(cursor):
-    cursor.execute('''
-        SELECT version FROM integration order by version desc''')
-    res = cursor.fetchone()
-    if res:
-        return int(res[0])
-    else:
-        # if integration table have no rows, return 0 as default
-        return 0
+    cursor.execute('''SELECT MAX(revision) FROM integration''')
+    res = cursor.fetchone()[0]
+    # if integration table have no rows, return 0 as default
+    return res or 0
 
 
 #
 # source_tree_root
 #
-def save_source_tree_root(cursor, source_location):
-    execute_f(cursor, '''
+def save_source_tree_root(cursor, source_location, commit=True):
+    id_ = insert_f(cursor, '''
         INSERT INTO source_tree_root (source_location) VALUES (%X)''',
               source_location)
-    cursor.connection.commit()
-    return get_last_id(cursor)
+    if commit:
+        cursor.connection.commit()
+    return id_
 
 
 #
 # sodd_instance
 #
-def save_sodd_instance(cursor, name, machine):
-    execute_f(cursor, '''
+def save_sodd_instance(cursor, name, machine, commit=True):
+    id_ = insert_f(cursor, '''
         INSERT INTO sodd_instance (name, machine) VALUES (%X,%X)''',
               name, machine)
-    cursor.connection.commit()
-    return get_last_id(cursor)
+    if commit:
+        cursor.connection.commit()
+    return id_
 
 #
 # job_group
 #
 def db_job_group_start(cursor, started, elapsed, state, result, log,
-                       integration_id, sodd_instance_id):
-    execute_f(cursor, '''
+                       integration_id, sodd_instance_id, commit=True):
+    id_ = insert_f(cursor, '''
         INSERT INTO job_group (started, elapsed, state, result,
                      log, integration_id, sodd_instance_id) VALUES
                      (%X,%X,%X,%X,%X,%X,%X)''',
                    started, elapsed, state, result, log, integration_id,
                    sodd_instance_id)
-    cursor.connection.commit()
-    return get_last_id(cursor)
+    if commit:
+        cursor.connection.commit()
+    return id_
 
-def db_job_group_finish(cursor, id_, elapsed, result, log, state='finished'):
+def db_job_group_finish(cursor, id_, elapsed, result, log, state='finished',
+                        commit=True):
     execute_f(cursor, '''
         UPDATE job_group SET elapsed=%X, state=%X, result=%X, log=%X WHERE
                         id=%X''', elapsed, state, result, log, id_)
-    cursor.connection.commit()
+    if commit:
+        cursor.connection.commit()
+
+def db_job_group_save_result(cursor, id_, jobs, type_, elapsed, result, log,
+                             log_files=None, commit=True):
+    """save jobs and update (finished) job_group in a single transaction"""
+    save_job(cursor, jobs, type_, id_, log_files, commit=False)
+    db_job_group_finish(cursor, id_, elapsed, result, log, commit=commit)
 
 
 #
-# job
+# skipped_revision
 #
-def save_job(cursor, result, type_, id_):
-    for row in result:
+def save_skipped_revisions(cursor, source_tree_root_id, revisions,
+                           commit=True):
+    """save revisions not integrated (coalesced)
+    @param revisions (list - tuple): (revision, covered_by), covered_by is
+                     the integrated revision that includes its changes
+    """
+    rows = [(int(revision), int(covered_by), source_tree_root_id)
+            for revision, covered_by in revisions]
+    insert_many(cursor, '''
+        INSERT INTO skipped_revision (revision, covered_by,
+                                      source_tree_root_id)''',
+                '(%X,%X,%X)', rows)
+    if commit:
+        cursor.connection.commit()
+
+
+def integrate_skipped_revision(cursor, source_tree_root_id, revision,
+                               covered, commit=True):
+    """skipped revision is being integrated (bisect)
+    @param covered (list): skipped revisions now covered by this revision
+    """
+    execute_f(cursor, '''
+        DELETE FROM skipped_revision WHERE revision=%X AND
+                                           source_tree_root_id=%X''',
+              int(revision), source_tree_root_id)
+    covered = [int(rev) for rev in covered]
+    for start in xrange(0, len(covered), MAX_IN_VALUES):
         execute_f(cursor, '''
-            INSERT INTO job (name, type, state, result, log, started, elapsed,
-                             job_group_id)
-            VALUES (%X,%X,%X,%X,%X,%X,%X,%X)''',
-                       row['name'], type_, 'finished', row['result'],
-                       row['err']+row['out'],row['started'],row['elapsed'], id_)
-    cursor.connection.commit()
+            UPDATE skipped_revision SET covered_by=%X
+            WHERE source_tree_root_id=%X AND revision IN (%X)''',
+                  int(revision), source_tree_root_id,
+                  covered[start:start + MAX_IN_VALUES])
+    if commit:
+        cursor.connection.commit()
+
+
+#
+# log_store
+#
+def get_log_hash(log):
+    """@return (str): sha1 of log, used as key on log_store"""
+    if isinstance(log, unicode):
+        log = log.encode('utf-8')
+    return hashlib.sha1(log).hexdigest()
+
+
+def save_logs(cursor, logs, log_files=None, commit=True):
+    """save logs on log_store table, keyed by hash of its content.
+
+    Jobs usually have the same log on every integration,
+    each distinct log is saved (compressed) only once.
+    @param logs (list - str)
+    @param log_files (LogFiles): big logs are saved on files, data is NULL
+    @return (list - str): hash of each log
+    """
+    hashes = []
+    new_logs = {}
+    for log in logs:
+        if isinstance(log, unicode):
+            log = log.encode('utf-8')
+        log_hash = get_log_hash(log)
+        hashes.append(log_hash)
+        new_logs[log_hash] = log
+    # skip logs already saved
+    new_hashes = new_logs.keys()
+    for start in xrange(0, len(new_hashes), MAX_IN_VALUES):
+        execute_f(cursor, 'SELECT hash FROM log_store WHERE hash IN (%X)',
+                  new_hashes[start:start + MAX_IN_VALUES])
+        for (log_hash,) in cursor.fetchall():
+            del new_logs[log_hash]
+    rows = []
+    for log_hash, log in new_logs.iteritems():
+        if log_files and log_files.put(log_hash, log):
+            data = None
+        else:
+            data = buffer(zlib.compress(log, 9))
+        rows.append((log_hash, len(log), data))
+    # same log might have been saved by another sodd after the SELECT
+    insert_many(cursor, 'INSERT INTO log_store (hash, size, data)',
+                '(%X,%X,%X)', rows, ignore_duplicates=True)
+    if commit:
+        cursor.connection.commit()
+    return hashes
+
+
+#
+# job
+#
+def save_job(cursor, result, type_, id_, log_files=None, commit=True):
+    """
+    @param log_files (LogFiles): big logs are saved on files (optional)
+    """
+    logs = [row['err'] + row['out'] for row in result]
+    # empty logs are not saved on log_store
+    non_empty = [log for log in logs if log]
+    hashes = dict(zip(non_empty, save_logs(cursor, non_empty, log_files,
+                                           commit=False)))
+    rows = []
+    for row, log in zip(result, logs):
+        log_hash = hashes.get(log)
+        rows.append((row['name'], type_, 'finished', row['result'], '',
+                     log_hash, row['started'], row['elapsed'], id_))
+    insert_many(cursor, '''
+        INSERT INTO job (name, type, state, result, log, log_hash, started,
+                         elapsed, job_group_id)''',
+                '(%X,%X,%X,%X,%X,%X,%X,%X,%X)', rows)
+    if commit:
+        cursor.connection.commit()
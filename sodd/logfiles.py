@@ -0,0 +1,57 @@
+"""save big job logs as compressed files outside the DB
+
+Logs are saved on the log_store table (see litemodel.save_logs), logs
+bigger than min_size are saved (gzip) on a directory instead.
+The file name is the hash (sha1) of the log content.
+
+websod reads the files from the same path, see websod/joblog.py
+"""
+
+import os
+import gzip
+import itertools
+
+
+def log_file_path(path, log_hash):
+    """@return (str): path of compressed log file"""
+    return os.path.join(path, log_hash[:2], log_hash + '.gz')
+
+
+class LogFiles(object):
+    """directory where big logs are saved
+
+    @ivar path (str): directory path
+    @ivar min_size (int): logs smaller than this are saved on DB
+    """
+    def __init__(self, path, min_size=100000):
+        self.path = os.path.abspath(path)
+        self.min_size = min_size
+        self._tmp_counter = itertools.count()
+
+
+    def put(self, log_hash, log):
+        """save log on a file if it is big
+
+        @param log_hash (str): sha1 of log
+        @param log (str)
+        @return (bool): True if log was saved on file,
+                        False if log must be saved on DB
+        """
+        if len(log) < self.min_size:
+            return False
+        file_path = log_file_path(self.path, log_hash)
+        if os.path.exists(file_path):
+            return True
+        dir_path = os.path.dirname(file_path)
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+        # write to a temporary file first so websod never reads partial logs
+        tmp_path = "%s.%s.%s.tmp" % (file_path, os.getpid(),
+                                     self._tmp_counter.next())
+        log_file = gzip.open(tmp_path, 'wb')
+        try:
+            log_file.write(log)
+        finally:
+            log_file.close()
+        os.rename(tmp_path, file_path)
+        return True
@@ -8,57 +8,136 @@ import logging
 import urllib2
 
 from sodd import vcs
+from sodd.snapshot import Snapshot
+from sodd.pool import Pool
+from sodd.logfiles import LogFiles
+from sodd.coalesce import Coalesce, bisect
+from sodd.dbwriter import DbWriter, DbTask
 from sodd.scheduler import Task, PeriodicTask, TaskPause, Scheduler
+from sodd.scheduler import PoolTask
 from sodd.taskdoit import DoitUnstable
 from sodd.litemodel import save_sodd_instance, save_source_tree_root
 from sodd.litemodel import save_integration, get_last_revision_id
-from sodd.litemodel import db_job_group_start, db_job_group_finish, save_job
+from sodd.litemodel import db_job_group_start, db_job_group_save_result
+from sodd.litemodel import save_skipped_revisions, integrate_skipped_revision
 
 TASK_TIMEOUT = 60 * 60
+# folder (relative to integration path) where processes output are saved
+LOG_DIR = '.sodd-log'
+# max number of revisions read from VCS log at once
+REVISIONS_PAGE_SIZE = 100
 
 class VcsTask(Task):
     """check for new revisions on a repository (polling)
     and create integration tasks
 
-    @ivar conn: a DB connection
+    @ivar db (DbWriter): DB writes are executed by DbTask's
     @ivar vcs_info (dict): info from source-code repository. items:
          * project (dict): project cofing
          * code: a repository instance (see vcs.py)
+         * pool: Pool where integration directories are created
+         * snapshot (optional): Snapshot instance used to create source trees
+         * log_files (optional): LogFiles where big job logs are saved
+         * coalesce (optional): Coalesce policy, select revisions to be
+                                integrated (default: all)
          * source_tree_id (int): internal DB id for repository
                                  (source_tree_root_table)
          * instance_id (int): id for sodd instance (sodd_instance_table)
     """
-    def __init__(self, conn, vcs_info):
+    def __init__(self, db, vcs_info):
         Task.__init__(self)
-        self.conn = conn
+        self.db = db
         self.vcs_info = vcs_info
 
     def run(self):
-        # poll
-        revs = self.vcs_info['code'].get_new_revisions(self.parent.last_rev)
+        code = self.vcs_info['code']
+        page_size = self.vcs_info['project'].get('revisions_page_size',
+                                                 REVISIONS_PAGE_SIZE)
+        coalesce = self.vcs_info.get('coalesce') or Coalesce()
+        # poll, new revisions are read one page at a time.
+        # a page is completely read before reading the next one, VCS output
+        # is not kept open for long. integration tasks for a page are
+        # created before reading the next one, unless the coalesce policy
+        # selects revisions looking at all new revisions.
+        revs = []
+        page = code.get_new_revisions(self.parent.last_rev, page_size)
+        while page:
+            revs.extend(page)
+            if not coalesce.selects_from_all():
+                for item in self.create_integrations(coalesce, revs):
+                    yield item
+                revs = []
+            if len(page) < page_size:
+                break
+            page = list(code.iter_revisions(page[-1]['revision'], page_size))
+        if revs:
+            for item in self.create_integrations(coalesce, revs):
+                yield item
+
+
+    def create_integrations(self, coalesce, revs):
+        """create integration tasks for the revisions selected from revs
+        @param revs (list - dict): new revisions, after parent.last_rev
+        """
+        selected = coalesce.select(revs)
+        # save skipped revisions and which revision covers them
+        skipped_rows = []
+        for a_rev, skipped in selected:
+            skipped_rows.extend((rev['revision'], a_rev['revision'])
+                                for rev in skipped)
+        if skipped_rows:
+            save = DbTask(self.db, save_skipped_revisions,
+                          self.vcs_info['source_tree_id'], skipped_rows)
+            (yield (save, TaskPause(save.tid)))
         # create integration tasks
-        for a_rev in revs:
+        parent_rev = self.parent.last_rev
+        for a_rev, skipped in selected:
             logging.info("*** VcsTask got rev: %s" % a_rev['revision'])
-            yield IntegrationTask(self.conn, self.vcs_info, a_rev['revision'],
-                      a_rev['committer'], a_rev['comment'], lock="integration")
+            if skipped:
+                logging.info("*** VcsTask skipped revs: %s" %
+                             [rev['revision'] for rev in skipped])
+            yield IntegrationTask(self.db, self.vcs_info,
+                      a_rev['revision'], a_rev['committer'],
+                      a_rev['comment'], lock="integration",
+                      parent_revision=parent_rev, skipped=skipped)
+            parent_rev = a_rev['revision']
         # update parent Task last_rev attribute
-        if(revs):
-            self.parent.last_rev = revs[-1]['revision']
+        self.parent.last_rev = revs[-1]['revision']
 
 
 class IntegrationTask(Task):
-    def __init__(self, conn, vcs_info, revision, committer, comment, lock=None):
+    """integrate a revision
+
+    @ivar skipped (list - dict): revisions between parent_revision and
+                                 this one that were not integrated
+    @ivar after (list - dict): (bisect) revisions between this one and
+                               a failed integration
+    @ivar bisecting (bool): revision was skipped, integrated by bisection
+    """
+    def __init__(self, db, vcs_info, revision, committer, comment, lock=None,
+                 parent_revision=None, skipped=None, after=None,
+                 bisecting=False):
         name = "r%s" % revision
         Task.__init__(self, lock=lock, name=name)
-        self.conn = conn
+        self.db = db
+        self.vcs_info = vcs_info
         self.project = vcs_info['project']
         self.code = vcs_info['code']
+        self.snapshot = vcs_info.get('snapshot')
+        self.pool = vcs_info['pool']
+        self.log_files = vcs_info.get('log_files')
+        self.coalesce = vcs_info.get('coalesce')
         self.source_tree_id = vcs_info['source_tree_id']
         self.instance_id = vcs_info['instance_id']
 
         self.revision = revision
+        # revision from previous integration
+        self.parent_revision = parent_revision
         self.committer = committer
         self.comment = comment
+        self.skipped = skipped or []
+        self.after = after or []
+        self.bisecting = bisecting
 
 
     def execute_pre_integration(self, integration_path, pre_list):
@@ -77,25 +156,55 @@ class IntegrationTask(Task):
             function(integration_path, self)
 
 
+    def bisect_task(self, revs, parent_revision):
+        """create task to integrate the middle revision from revs"""
+        rev, skipped, after = bisect(revs)
+        logging.info("*** IntegrationTask bisect: %s" % rev['revision'])
+        return IntegrationTask(self.db, self.vcs_info, rev['revision'],
+                               rev['committer'], rev['comment'],
+                               lock=self.lock,
+                               parent_revision=parent_revision,
+                               skipped=skipped, after=after, bisecting=True)
+
+
     def run(self):
+        # revision is not skipped anymore,
+        # skipped revisions before it are now covered by it
+        if self.bisecting:
+            update = DbTask(self.db, integrate_skipped_revision,
+                            self.source_tree_id, self.revision,
+                            [rev['revision'] for rev in self.skipped])
+            (yield (update, TaskPause(update.tid)))
+
         # save integration started on DB
-        integration_id = save_integration(
-            self.conn.cursor(), self.revision, 'running', 'unknown',
-            self.committer, self.comment, self.source_tree_id)
+        save = DbTask(self.db, save_integration, self.revision, 'running',
+                      'unknown', self.committer, self.comment,
+                      self.source_tree_id, self.parent_revision)
+        (yield (save, TaskPause(save.tid)))
+        integration_id = save.result
 
         # export source-code on revision to be tested
-        integration_path = os.path.join(self.project['_pool_path'],
-                                        self.revision)
-        self.code.archive(self.revision, integration_path)
-
-        self.execute_pre_integration(integration_path,
-                                     self.project['pre-integration'])
-
-        # execute integrations
-        for task in self.project['tasks']:
-            job_task = JobGroupTask(self.conn, task, integration_id,
-                        integration_path, self.instance_id, self.name)
-            (yield (job_task, TaskPause(job_task.tid)))
+        integration_path = self.pool.acquire(self.revision)
+        try:
+            if self.snapshot:
+                self.snapshot.create(self.revision, integration_path)
+            else:
+                self.code.archive(self.revision, integration_path)
+
+            self.execute_pre_integration(integration_path,
+                                         self.project['pre-integration'])
+
+            # execute integrations, job groups might run in parallel
+            job_tasks = []
+            for task in self.project['tasks']:
+                job_tasks.append(JobGroupTask(self.db, task, integration_id,
+                            integration_path, self.instance_id, self.name,
+                            self.log_files))
+            pool = PoolTask(job_tasks, self.project['_concurrency'])
+            (yield (pool, TaskPause(pool.tid)))
+        finally:
+            # integration directory might be evicted from now on
+            self.pool.release(self.revision)
 
         # log
         logging.info("*** IntegrationTask %s finished" % self.revision)
@@ -110,21 +219,49 @@ class IntegrationTask(Task):
                 msg = "Error notifying websod (%s). %s"
                 logging.warning(msg % (websod_url, str(exception)))
 
+        # find first failing revision
+        if self.coalesce:
+            result = 'success'
+            for job_task in job_tasks:
+                if job_task.group_result != 'success':
+                    result = 'fail'
+            self.coalesce.set_result(self.revision, result)
+            if self.coalesce.must_bisect(result, self.parent_revision,
+                                         self.skipped):
+                # failure introduced by this or a skipped revision
+                yield self.bisect_task(self.skipped, self.parent_revision)
+            elif result == 'success' and self.after:
+                # failure introduced after this revision
+                yield self.bisect_task(self.after, self.revision)
+
 
 
 class JobGroupTask(Task):
     """JobGroup is a task as specified in a config (yaml) file.
     The group is composed of different jobs (each job is "task" from doit.
+
+    A task in the config is the doit task name or a dict with the items:
+     * name (str): doit task name
+     * num_process (int): number of processes used by doit (default 1)
+
+    @ivar log_files (LogFiles): big job logs are saved on files (optional)
     """
-    def __init__(self, conn, task_name, integration_id, integration_path,
-                 instance_id, rev_str):
+    def __init__(self, db, task, integration_id, integration_path,
+                 instance_id, rev_str, log_files=None):
+        if isinstance(task, dict):
+            task_name = task['name']
+            self.num_process = task.get('num_process', 1)
+        else:
+            task_name = task
+            self.num_process = 1
         name = "%s.%s" % (rev_str, task_name)
         Task.__init__(self, name=name)
-        self.conn = conn
+        self.db = db
         self.task_name = task_name
         self.integration_id = integration_id
         self.integration_path = integration_path
         self.instance_id = instance_id
+        self.log_files = log_files
         self.group_result = None
 
     def get_result(self, jobs_result):
@@ -147,27 +284,32 @@ class JobGroupTask(Task):
         # save job_group in DB
         started_on = time.time()
         started = datetime.datetime.utcfromtimestamp(started_on)
-        group_id = db_job_group_start(self.conn.cursor(), started, None,
-                                  'running', 'unknown', '',
-                                  self.integration_id, self.instance_id)
+        start = DbTask(self.db, db_job_group_start, started, None,
+                       'running', 'unknown', '',
+                       self.integration_id, self.instance_id)
+        (yield (start, TaskPause(start.tid)))
+        group_id = start.result
 
         # excute
         dodo_path = os.path.join(self.integration_path, 'dodo.py')
+        log_dir = os.path.join(self.integration_path, LOG_DIR)
         doit_task = DoitUnstable(dodo_path, self.task_name,
-                                 timeout=TASK_TIMEOUT)
+                                 timeout=TASK_TIMEOUT, log_dir=log_dir,
+                                 num_process=self.num_process)
         doit_task.name = self.name
         (yield (doit_task, TaskPause(doit_task.tid)))
 
-        # save jobs result on DB
+        # save jobs result and update (finished) job_group on DB
+        # in a single transaction
         jobs_result = doit_task.final_result.values()
-        save_job(self.conn.cursor(), jobs_result, self.task_name, group_id)
-
-        # update (finished) job_group on DB
         group_result = self.get_result(jobs_result)
         self.group_result = group_result # FIXME remove this
         elapsed = time.time() - started_on
-        db_job_group_finish(self.conn.cursor(), group_id, elapsed,
-                         group_result, '') # FIXME log always empty!
+        finish = DbTask(self.db, db_job_group_save_result, group_id,
+                        jobs_result, self.task_name, elapsed,
+                        group_result, '', # FIXME log always empty!
+                        self.log_files)
+        (yield (finish, TaskPause(finish.tid)))
 
 
 
@@ -198,6 +340,19 @@ def get_db_conn(driver='', username='', password='', host='', port='', database=
     return conn
 
 
+def get_concurrency(value):
+    """number of job groups executed at the same time
+    @param value (int): as in config. 0 => one per CPU core.
+    @return (int): value limited to number of CPU cores
+    """
+    if value and value < 0:
+        raise Exception("Invalid concurrency: %s" % value)
+    cores = os.sysconf('SC_NPROCESSORS_ONLN')
+    if not value or value > cores:
+        return cores
+    return value
+
+
 def run_ci(base_path, project):
     """ Run Continuous Integration System
      * A periodic task will poll a VCS to get new revisions
@@ -216,21 +371,26 @@ def run_ci(base_path, project):
     # pre-integration item must be "<module-name>:<function-name>"
     if 'pre-integration' not in project:
         project['pre-integration'] = []
+    # number of job groups (tasks) from an integration executed in parallel
+    project['_concurrency'] = get_concurrency(project.get('concurrency', 1))
     # other optional config:
     #  * email_to, email_from
     #  * websod URL to websod instance
+    #  * snapshot: 'hardlink' or 'reflink' reuse files from previous
+    #              integration instead of exporting the whole revision
+    #  * pool (dict): quota for integration directories (0 => no limit)
+    #                 max_bytes, max_inodes
+    #  * log_files (dict): save big job logs as compressed files
+    #                      path, min_size
+    #  * cmdserver (bool): execute hg commands on a command server
+    #  * revisions_page_size (int): max number of revisions read at once
+    #  * coalesce (dict): policy, every, bisect (see coalesce.py)
 
     # TODO: configuration entry for this
     # base pool path where revision will be saved and integration be executed
     project['_pool_path'] = os.path.join(base_path, 'pool')
-
-
-    # if pool is an existing file, that is an error
-    if os.path.isfile(project['_pool_path']):
-        raise Exception("pool exists and is a file")
-    # if the directory does not exist create it
-    if not os.path.isdir(project['_pool_path']):
-        os.mkdir(project['_pool_path'])
+    pool = Pool(project['_pool_path'], **project.get('pool', {}))
+    pool.start()
 
 
     ## register self in sodd_instance table
@@ -245,17 +405,30 @@ def run_ci(base_path, project):
     logging.info("*** Cloning source-code from: %s" % project['url'])
     if os.path.exists('trunk'):
         shutil.rmtree('trunk')
-    code = vcs.get_vcs(project['vcs'], project['url'], 'trunk')
+    code = vcs.get_vcs(project['vcs'], project['url'], 'trunk',
+                       project.get('cmdserver', False))
     code.clone()
     logging.info("*** Cloning completed")
 
 
+    # DB writes are executed in a separate thread
+    sched = Scheduler(use_select=True)
+    db_writer = DbWriter(sched, lambda: get_db_conn(**project['db']))
+    db_writer.start()
+
     # VCS polling
     vcs_info = {'project':project,
                 'code':code,
+                'pool':pool,
                 'source_tree_id':source_tree_id,
                 'instance_id':instance_id}
-    loop_vcs = PeriodicTask(5 * 60, VcsTask, [conn, vcs_info], name="Check trunk")
+    if 'snapshot' in project:
+        vcs_info['snapshot'] = Snapshot(code, project['snapshot'])
+    if 'log_files' in project:
+        vcs_info['log_files'] = LogFiles(**project['log_files'])
+    vcs_info['coalesce'] = Coalesce(**project.get('coalesce', {}))
+    loop_vcs = PeriodicTask(5 * 60, VcsTask, [db_writer, vcs_info],
+                            name="Check trunk")
 
     # set revisions to execute integrations from
     # the latest of revision specified on config file or latest executed
@@ -266,6 +439,5 @@ def run_ci(base_path, project):
         loop_vcs.last_rev = project['start_rev']
 
     # read to start
-    sched = Scheduler()
     sched.add_task(loop_vcs)
     sched.loop()
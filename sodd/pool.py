@@ -0,0 +1,220 @@
+"""manage the pool of integration directories
+
+Every integration creates a directory (one per revision) on the pool path.
+The Pool keeps track of them and removes the least recently used ones when
+the pool uses more disk space (bytes or inodes) than the configured quota.
+
+Measuring and removing directory trees is slow for big trees, this is done
+by a background thread so the scheduler loop is never blocked. Directories
+are first (atomically) renamed into a trash folder and removed later.
+"""
+
+import os
+import shutil
+import itertools
+import threading
+import Queue
+import logging
+
+
+class PoolEntry(object):
+    """a directory on the pool
+    @ivar name (str): directory name (revision)
+    @ivar last_used (int): sequence number from last time it was released
+    @ivar pinned (bool): entry is being used and must not be removed
+    @ivar size (float): bytes used on disk (None if not measured yet)
+    @ivar inodes (float): number of inodes used
+    """
+    def __init__(self, name, last_used):
+        self.name = name
+        self.last_used = last_used
+        self.pinned = False
+        self.size = None
+        self.inodes = None
+
+
+def measure(path):
+    """disk usage of a directory tree
+
+    hardlinked files are shared by many trees, so each tree is accounted
+    only for its share of the file (size / number of links).
+    @return tuple(float, float): bytes, inodes
+    """
+    size = inodes = 0.0
+    for dirpath, dirnames, filenames in os.walk(path):
+        stat = os.lstat(dirpath)
+        size += stat.st_blocks * 512.0
+        inodes += 1
+        for name in filenames:
+            try:
+                stat = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            size += stat.st_blocks * 512.0 / stat.st_nlink
+            inodes += 1.0 / stat.st_nlink
+    return size, inodes
+
+
+class Pool(object):
+    """directories where integrations are executed
+
+    @ivar path (str): pool path
+    @ivar max_bytes (int): disk space quota. 0 => no limit
+    @ivar max_inodes (int): number of inodes quota. 0 => no limit
+    @ivar entries (dict): name => PoolEntry
+    @ivar jobs (Queue): work for background thread
+                        ('measure', <entry-name>), ('delete', <path>)
+    """
+    TRASH = '.trash'
+
+    def __init__(self, path, max_bytes=0, max_inodes=0):
+        self.path = path
+        self.trash_path = os.path.join(path, self.TRASH)
+        self.max_bytes = max_bytes
+        self.max_inodes = max_inodes
+        self.entries = {}
+        self.jobs = Queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        # LRU order (time.time() resolution is not good enough)
+        self._counter = itertools.count()
+        self._trash_counter = itertools.count()
+
+
+    def start(self):
+        """create pool, register existing directories and start thread"""
+        if os.path.isfile(self.path):
+            raise Exception("pool exists and is a file")
+        if not os.path.isdir(self.trash_path):
+            os.makedirs(self.trash_path)
+        # remove left-overs from previous execution
+        for name in os.listdir(self.trash_path):
+            self.jobs.put(('delete', os.path.join(self.trash_path, name)))
+        # existing directories, oldest are evicted first
+        existing = []
+        for name in os.listdir(self.path):
+            full_path = os.path.join(self.path, name)
+            if name != self.TRASH and os.path.isdir(full_path):
+                existing.append((os.path.getmtime(full_path), name))
+        for mtime, name in sorted(existing):
+            self.entries[name] = PoolEntry(name, self._counter.next())
+            self.jobs.put(('measure', name))
+
+        self.thread = threading.Thread(target=self._worker, name="pool")
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+
+    def stop(self):
+        """finish pending jobs and stop background thread"""
+        self.jobs.put(None)
+        self.thread.join()
+
+
+    def acquire(self, name):
+        """get path for a new directory, it will not be evicted until released.
+        if the directory already exists its content is removed.
+        @return (str): path of directory
+        """
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(name)
+            if entry and entry.pinned:
+                raise Exception("Pool directory %s is already in use" % name)
+            self._discard(name)
+            entry = PoolEntry(name, self._counter.next())
+            entry.pinned = True
+            self.entries[name] = entry
+        finally:
+            self.lock.release()
+        return os.path.join(self.path, name)
+
+
+    def release(self, name):
+        """directory is not used anymore, it can be evicted"""
+        self.lock.acquire()
+        try:
+            entry = self.entries[name]
+            entry.pinned = False
+            entry.last_used = self._counter.next()
+        finally:
+            self.lock.release()
+        self.jobs.put(('measure', name))
+
+
+    def _discard(self, name):
+        """move directory into trash and schedule its removal
+        must be called with self.lock held
+        """
+        self.entries.pop(name, None)
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path):
+            return
+        trash = os.path.join(self.trash_path,
+                             "%s.%s" % (name, self._trash_counter.next()))
+        os.rename(path, trash)
+        self.jobs.put(('delete', trash))
+
+
+    def usage(self):
+        """@return tuple(float, float): bytes, inodes used by measured entries
+        """
+        size = inodes = 0.0
+        for entry in self.entries.itervalues():
+            if entry.size is not None:
+                size += entry.size
+                inodes += entry.inodes
+        return size, inodes
+
+
+    def _over_quota(self):
+        size, inodes = self.usage()
+        return ((self.max_bytes and size > self.max_bytes) or
+                (self.max_inodes and inodes > self.max_inodes))
+
+
+    def evict(self):
+        """remove least recently used directories while over quota"""
+        self.lock.acquire()
+        try:
+            candidates = sorted((e for e in self.entries.itervalues()
+                                 if not e.pinned),
+                                key=lambda e: e.last_used, reverse=True)
+            while candidates and self._over_quota():
+                entry = candidates.pop()
+                logging.info("Pool: evict %s" % entry.name)
+                self._discard(entry.name)
+        finally:
+            self.lock.release()
+
+
+    def _measure(self, name):
+        size, inodes = measure(os.path.join(self.path, name))
+        self.lock.acquire()
+        try:
+            entry = self.entries.get(name)
+            # entry might have been acquired again in the mean time
+            if entry is None or entry.pinned:
+                return
+            entry.size, entry.inodes = size, inodes
+        finally:
+            self.lock.release()
+        self.evict()
+
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                action, arg = job
+                if action == 'measure':
+                    self._measure(arg)
+                else:
+                    shutil.rmtree(arg, ignore_errors=True)
+            except Exception, exception:
+                logging.error("Pool %s %s failed: %s" %
+                              (job[0], job[1], exception))
+            finally:
+                self.jobs.task_done()
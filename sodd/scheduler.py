@@ -5,10 +5,12 @@ import os
 import subprocess
 import time
 import signal
+import select
+import errno
+import fcntl
 from collections import deque
 import heapq
 import logging
-import StringIO
 from inspect import isfunction, ismethod
 
 
@@ -29,9 +31,12 @@ class TaskSleep(object):
 
 #TODO: merge sleep/pause
 class TaskPause(object):
-    """Pause current task until given task terminates """
-    def __init__(self, tid=None):
+    """Pause current task until given task terminates
+    or one of the file descriptors is ready for reading
+    """
+    def __init__(self, tid=None, fds=None):
         self.tid = tid
+        self.fds = fds
 
 class TaskCancel(object):
     """Cancel task"""
@@ -77,6 +82,7 @@ class Task(object):
             self._coroutine = self.run()
 
         self._started = False # started running
+        self._finished = False # set by scheduler when task is removed
         self.cancelled = False
 
 
@@ -152,30 +158,116 @@ class PeriodicTask(Task):
 
 
 
+# max number of bytes of process output kept in memory (per stream)
+OUTPUT_TAIL_SIZE = 256 * 1024
+# max number of bytes of process output saved to a log file (per stream)
+OUTPUT_FILE_SIZE = 64 * 1024 * 1024
+
+class OutputBuffer(object):
+    """Collect output from a process
+
+    Only the last `tail_size` bytes are kept in memory. If a `path` is given
+    the output is also saved to a file, up to `max_size` bytes.
+
+    @ivar size (int): total number of bytes written
+    """
+    def __init__(self, path=None, tail_size=OUTPUT_TAIL_SIZE,
+                 max_size=OUTPUT_FILE_SIZE):
+        self.path = path
+        self.tail_size = tail_size
+        self.max_size = max_size
+        self.size = 0
+        self._tail = deque()
+        self._tail_len = 0
+        self._file = open(path, 'wb') if path else None
+
+    def write(self, data):
+        self.size += len(data)
+        # keep tail, drop chunks that are not part of the tail anymore
+        self._tail.append(data)
+        self._tail_len += len(data)
+        while (self._tail_len - len(self._tail[0])) >= self.tail_size:
+            self._tail_len -= len(self._tail.popleft())
+        # save on file
+        if self._file:
+            written = self.size - len(data)
+            if written < self.max_size:
+                self._file.write(data[:self.max_size - written])
+
+    def getvalue(self):
+        """@return (str): output, if larger than tail_size only its tail"""
+        value = "".join(self._tail)
+        if len(value) > self.tail_size:
+            value = value[-self.tail_size:]
+        self._tail = deque([value])
+        self._tail_len = len(value)
+        if self.size > len(value):
+            msg = "[... %d bytes truncated" % (self.size - len(value))
+            if self.path:
+                msg += ", see %s" % self.path
+            value = msg + " ...]\n" + value
+        return value
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
 class ProcessTask(Task):
-    """A task that executes a shell command"""
-    def __init__(self, cmd, timeout=None, lock=None):
+    """A task that executes a shell command
+
+    The output is read while the process is running.
+    """
+    # max number of reads on each stream before giving control back to
+    # the scheduler.
+    MAX_READS = 16
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, cmd, timeout=None, lock=None, log_dir=None):
         """
         @param cmd (list): list of strings for Popen
         @param timeout (float): time in seconds for terminating the process
+        @param log_dir (str): path to directory where output is saved,
+                       files are named <tid>.out and <tid>.err
         """
         Task.__init__(self, lock=lock)
         self.cmd = cmd
         self.proc = None
-        self.outdata = StringIO.StringIO()
-        self.errdata = StringIO.StringIO()
+        self.log_dir = log_dir
+        self.outdata = None
+        self.errdata = None
+        self._create_buffers()
         self.timeout = timeout
         self._force_killed = False
 
     def __str__(self):
         return Task.__str__(self) + "(%s)" % " ".join(self.cmd)
 
+    def _create_buffers(self):
+        if not self.log_dir:
+            self.outdata = OutputBuffer()
+            self.errdata = OutputBuffer()
+            return
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        base = os.path.join(self.log_dir, str(self.tid))
+        self.outdata = OutputBuffer(base + '.out')
+        self.errdata = OutputBuffer(base + '.err')
+
     def run(self):
         self.proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE,
                                      stderr=subprocess.PIPE)
-
-        # wait for self.proc to finish
-        sched_operations = [TaskPause()]
+        # fd => buffer. a stream is removed when it is closed.
+        streams = {}
+        for pipe, buff in ((self.proc.stdout, self.outdata),
+                           (self.proc.stderr, self.errdata)):
+            fd = pipe.fileno()
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            streams[fd] = buff
+
+        # wait for output or self.proc to finish
+        sched_operations = [TaskPause(fds=streams.keys())]
         timeout_task = None
         if self.timeout:
             now = time.time()
@@ -183,38 +275,50 @@ class ProcessTask(Task):
             timeout_task = Task(self._watchdog, name, now + self.timeout)
             sched_operations.append(timeout_task)
         yield sched_operations
+
+        while True:
+            # returncode is set (by PidTask) when process terminates.
+            # check it before reading so all its output is read.
+            terminated = self.proc.returncode is not None
+            self._read_output(streams, None if terminated else self.MAX_READS)
+            if terminated:
+                break
+            yield TaskPause(fds=(streams.keys() or None))
+
         # cancel timeout task
         if timeout_task:
             yield TaskCancel(timeout_task.tid)
 
         if self._force_killed:
             logging.warn("force killed task:%s" % self)
-            # GIVE UP everything... it might hang again if you try to
-            # read its output...
-            return
+        self.proc.stdout.close()
+        self.proc.stderr.close()
+        self.outdata.close()
+        self.errdata.close()
 
-        # TODO this is getting tricky... and ugly see:
-        # http://groups.google.com/group/comp.lang.python/browse_thread/thread/9e19f3a79449f536/
-        # try some king of polling? or turn-on / turn-off signal handling...
-        # stdout
-        while True:
-            try:
-                buff = self.proc.stdout.read(1024)
-                if not buff:
-                    break
-                self.outdata.write(buff)
-            # in case a signal is received while reading proc.stdout
-            except IOError:
-                pass
-        # stderr
-        while True:
-            try:
-                buff = self.proc.stderr.read(1024)
-                if not buff:
+
+    def _read_output(self, streams, max_reads=None):
+        """read available data from non-blocking pipes
+        @param streams (dict): fd => OutputBuffer. closed streams are removed
+        @param max_reads (int): max number of reads on each stream,
+                                None => read until there is no more data
+        """
+        for fd, buff in streams.items():
+            reads = 0
+            while (max_reads is None) or (reads < max_reads):
+                try:
+                    data = os.read(fd, self.READ_SIZE)
+                except OSError, exception:
+                    if exception.errno == errno.EINTR:
+                        continue
+                    if exception.errno == errno.EAGAIN:
+                        break
+                    raise
+                reads += 1
+                if not data: # EOF
+                    del streams[fd]
                     break
-                self.errdata.write(buff)
-            except IOError:
-                pass
+                buff.write(data)
 
 
     def _signal(self, sig_name):
@@ -294,7 +398,8 @@ class PidTask(Task):
             if not isinstance(t, ProcessTask):
                 continue
             returncode = t.get_returncode()
-            if returncode is not None:
+            # task might be already ready to read output
+            if returncode is not None and t not in self.sched.ready:
                 self.sched.ready_task(t)
 
 
@@ -311,22 +416,134 @@ class GroupTask(Task):
             (yield (task, TaskPause(task.tid)))
 
 
+class ReadyQueue(object):
+    """FIFO of tasks ready to be executed.
+
+    Keeps a set of task ids so membership test is O(1).
+    """
+    def __init__(self):
+        self._queue = deque()
+        self._tids = set()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def __iter__(self):
+        return iter(self._queue)
+
+    def __getitem__(self, index):
+        return self._queue[index]
+
+    def __contains__(self, task):
+        return task.tid in self._tids
+
+    def append(self, task):
+        """add task to end of queue
+        @return (bool): False if task was already in the queue
+        """
+        if task.tid in self._tids:
+            return False
+        self._tids.add(task.tid)
+        self._queue.append(task)
+        return True
+
+    def popleft(self):
+        task = self._queue.popleft()
+        self._tids.discard(task.tid)
+        return task
+
+
+
+class PoolTask(Task):
+    """Execute group of tasks, at most max_tasks at the same time"""
+    def __init__(self, task_list, max_tasks):
+        Task.__init__(self)
+        self.task_list = task_list[::-1] #reverse list
+        self.max_tasks = max_tasks
+
+    def run(self):
+        running = []
+        while self.task_list or running:
+            operations = []
+            while self.task_list and len(running) < self.max_tasks:
+                task = self.task_list.pop()
+                running.append(task)
+                operations.extend((task, TaskPause(task.tid)))
+            # wait until one of running tasks finish
+            if not operations:
+                operations.append(TaskPause())
+            yield operations
+            running = [t for t in running if not t._finished]
+
+
+
 class Scheduler(object):
-    def __init__(self, use_sigchld=True):
+    """execute tasks
+
+    @ivar use_select (bool): wait for events with select() on a self-pipe
+          instead of time.sleep(). The loop wakes up as soon as a child
+          process terminates, a timer expires or a new task is added.
+    """
+    def __init__(self, use_sigchld=True, use_select=False):
         self.tasks = {}
         # TODO use Queue (thread-safe)
-        self.ready = deque() # ready to execute tasks
-        self.waiting = [] # scheduled to be executed in the future
+        self.ready = ReadyQueue() # ready to execute tasks
+        # scheduled to be executed in the future (heap)
+        # entries of cancelled tasks are removed lazily
+        self.waiting = []
+        self._sleeping = set() # tid of tasks with a live entry on waiting
+        self._cancelled_timers = 0 # number of dead entries on waiting
         self.locks = {}
+        # tasks waiting for a file descriptor to be ready for reading
+        self.readers = {} # fd => task
+        self._task_fds = {} # tid => list of fd
+        self.use_select = use_select
+        # tasks made ready by other threads (see ready_threadsafe)
+        self._external = deque()
+        # self-pipe (read_fd, write_fd) used to interrupt select()
+        self._wakeup_fds = None
+        self._wakeup_pending = False
+        if use_select:
+            self._wakeup_fds = self._create_wakeup_pipe()
         if use_sigchld:
             self._register_sigchld()
 
 
+    @staticmethod
+    def _create_wakeup_pipe():
+        """create a non-blocking pipe that is not inherited by children"""
+        fds = os.pipe()
+        for fd in fds:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+        return fds
+
+
     def _register_sigchld(self):
         # create a task to identify terminated process tid
         def handle_child_terminate(signum, frame):
             self.add_task(PidTask(self))
         signal.signal(signal.SIGCHLD, handle_child_terminate)
+        # python handlers are executed between bytecodes, a signal received
+        # just before select() would not interrupt it. the wakeup fd is
+        # written by the C level handler (python >= 2.6)
+        if self._wakeup_fds is not None and hasattr(signal, 'set_wakeup_fd'):
+            signal.set_wakeup_fd(self._wakeup_fds[1])
+
+
+    def wakeup(self):
+        """interrupt the loop if it is waiting for events
+
+        safe to be called from signal handlers and other threads.
+        """
+        if self._wakeup_fds is None or self._wakeup_pending:
+            return
+        self._wakeup_pending = True
+        try:
+            os.write(self._wakeup_fds[1], '\0')
+        except OSError:
+            pass # pipe is full, loop will wake up anyway
 
 
     def add_task(self, task, delay=0):
@@ -347,21 +564,64 @@ class Scheduler(object):
             self.ready_task(task)
         elif task.scheduled:
             self.sleep_task(task)
+        self.wakeup()
 
 
     def ready_task(self, task):
-        ready_tid = [t.tid for t in self.ready]
-        if task.tid not in ready_tid:
-            self.ready.append(task)
-        else:
-            logging.warn("Tried to add task (%s) to ready queue twice. (%s)" %
-                         (task.tid, ready_tid))
+        if not self.ready.append(task):
+            logging.warn("Tried to add task (%s) to ready queue twice.",
+                         task.tid)
+
+    def ready_threadsafe(self, task):
+        """put a paused task on ready queue from another thread
+
+        the loop only wakes up right away when use_select is set.
+        """
+        # deque.append is atomic, ready queue is only touched by loop thread
+        self._external.append(task)
+        self.wakeup()
 
     def sleep_task(self, task):
         # can not be called by a task in ready queue
-        ready_tid = [t.tid for t in self.ready]
-        assert task.tid not in ready_tid
+        assert task not in self.ready
         heapq.heappush(self.waiting, task)
+        self._sleeping.add(task.tid)
+
+    def cancel_task(self, task):
+        """mark task as cancelled
+
+        A sleeping task is put on the ready queue so it finishes (and
+        releases its dependents) right away, its timer entry is discarded
+        lazily.
+        """
+        task.cancelled = True
+        if task.tid not in self._sleeping:
+            return
+        self._sleeping.remove(task.tid)
+        self._cancelled_timers += 1
+        self.ready_task(task)
+        # rebuild heap when it is mostly made of dead entries
+        if self._cancelled_timers * 2 > len(self.waiting):
+            self.waiting = [t for t in self.waiting if t.tid in self._sleeping]
+            heapq.heapify(self.waiting)
+            self._cancelled_timers = 0
+
+    def _pop_cancelled_timers(self):
+        """remove dead entries from top of the waiting heap"""
+        while self.waiting and self.waiting[0].tid not in self._sleeping:
+            heapq.heappop(self.waiting)
+            self._cancelled_timers -= 1
+
+
+    def watch_fds(self, task, fds):
+        """ready task when one of the fds is ready for reading"""
+        for fd in fds:
+            self.readers[fd] = task
+        self._task_fds[task.tid] = fds
+
+    def unwatch_fds(self, task):
+        for fd in self._task_fds.pop(task.tid, ()):
+            del self.readers[fd]
 
 
     def run_task(self, task):
@@ -371,13 +631,16 @@ class Scheduler(object):
             # locked can't execute now
             if task.lock in self.locks:
                 self.locks[task.lock].append(task)
-                logging.info("%s \t locked" % task)
+                logging.info("%s \t locked", task)
                 return
             # lock other and start
             self.locks[task.lock] = deque()
 
-        logging.info("%s \t running" % task)
+        logging.info("%s \t running", task)
 
+        # task is not waiting for I/O anymore
+        if task.tid in self._task_fds:
+            self.unwatch_fds(task)
         operations = task.run_iteration()
         # make sure return value is iterable
         if not hasattr(operations, '__iter__'):
@@ -397,8 +660,12 @@ class Scheduler(object):
                         self.ready_task(lock_list.popleft())
                     del self.locks[task.lock]
                 for dependent_tid in task.dependents:
-                    self.ready_task(self.tasks[dependent_tid])
+                    dependent = self.tasks[dependent_tid]
+                    # might depend on more than one task
+                    if dependent not in self.ready:
+                        self.ready_task(dependent)
                 del self.tasks[task.tid]
+                task._finished = True
             # sleep
             elif isinstance(op, TaskSleep):
                 reschedule = False
@@ -410,11 +677,12 @@ class Scheduler(object):
                 reschedule = False
                 if op.tid is not None:
                     self.tasks[op.tid].dependents.append(task.tid)
+                if op.fds:
+                    self.watch_fds(task, op.fds)
             # cancel
             elif isinstance(op, TaskCancel):
                 if op.tid in self.tasks:
-                    self.tasks[op.tid].cancelled = True
-                    #FIXME be more agressive when a task gets cancelled.
+                    self.cancel_task(self.tasks[op.tid])
             # do nothing
             elif op is not None:
                 raise Exception("returned invalid value %s" % op)
@@ -431,9 +699,19 @@ class Scheduler(object):
     def loop_iteration(self):
         now = time.time()
 
+        # add tasks made ready by other threads
+        while self._external:
+            task = self._external.popleft()
+            if task not in self.ready:
+                self.ready_task(task)
+
         # add scheduled tasks
+        self._pop_cancelled_timers()
         while self.waiting and (self.waiting[0].scheduled <= now):
-            self.ready_task(heapq.heappop(self.waiting))
+            task = heapq.heappop(self.waiting)
+            self._sleeping.remove(task.tid)
+            self.ready_task(task)
+            self._pop_cancelled_timers()
 
         # execute tasks that are ready to be executed
         if self.ready:
@@ -442,18 +720,59 @@ class Scheduler(object):
             return # just sleep if no task was run
 
         # wait for until next scheduled task is ready
-        # TODO pause if (not self.waiting) ?
-        interval = (self.waiting[0].scheduled - now) if self.waiting else 60
+        if self.waiting:
+            interval = self.waiting[0].scheduled - now
+        elif self.use_select:
+            interval = None # nothing scheduled, wait for an event
+        else:
+            interval = 60
         logging.debug("*** sleeping %s" % interval)
         logging.info(self.print_state())
-        time.sleep(interval)
+        self._wait(interval)
+
+
+    def _wait(self, interval):
+        """block until an event happens or interval (seconds) elapses
+        @param interval (float): None => no timeout (only with use_select)
+        """
+        if not (self.use_select or self.readers):
+            time.sleep(interval)
+            return
+
+        rlist = self.readers.keys()
+        if self.use_select:
+            wakeup_fd = self._wakeup_fds[0]
+            rlist.append(wakeup_fd)
+        try:
+            readable = select.select(rlist, [], [], interval)[0]
+        except select.error, exception:
+            # interrupted by a signal, its handler was already executed
+            if exception.args[0] != errno.EINTR:
+                raise
+            readable = []
+        for fd in readable:
+            task = self.readers.get(fd)
+            # task might be waiting on more than one fd
+            if task is not None and task not in self.ready:
+                self.ready_task(task)
+
+        if self.use_select:
+            # clear flag before draining, so a wakeup() from another thread
+            # during the drain is not lost
+            self._wakeup_pending = False
+            try:
+                while os.read(wakeup_fd, 512):
+                    pass
+            except OSError:
+                pass # EAGAIN, pipe is empty
 
     def print_state(self):
         out = "\n/--------------------------------\n"
         if self.waiting:
             out += "WAITING: \n"
             for wait in self.waiting:
-                #TODO do not display cancelled tasks
+                if wait.tid not in self._sleeping:
+                    continue # cancelled
                 out += "%s -> %ss\n" %(str(wait), wait.scheduled - time.time())
         if self.locks:
             for lock, values in self.locks.iteritems():
@@ -464,5 +783,4 @@ class Scheduler(object):
 # TODO
 #  RPC/webserver
 #  threaded task
-#  async db
 #  pause/resume
@@ -0,0 +1,156 @@
+"""create source trees for integrations reusing previous revision's tree
+
+Exporting the whole repository for every revision is slow on big trees.
+A Snapshot updates the VCS working copy to the revision and creates the tree
+copying only files that changed since the previous snapshot, all other files
+are hardlinked (or reflinked) from the previous snapshot.
+
+modes:
+ * hardlink: unchanged files share the inode with previous snapshot.
+             files must not be modified in-place by the integration
+             (they would be modified on previous snapshot too).
+ * reflink: copy-on-write clone of file (btrfs, xfs). falls back to a
+            normal copy if not supported by the file-system.
+"""
+
+import os
+import shutil
+import errno
+import fcntl
+
+# control directories from VCS's are not copied to snapshot
+VCS_DIRS = ('.hg', '.svn', '.bzr')
+
+# linux/fs.h _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """copy-on-write clone of a file, fallback to normal copy"""
+    src_file = open(src, 'rb')
+    try:
+        dst_file = open(dst, 'wb')
+        try:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        except IOError, exception:
+            if exception.errno not in (errno.EOPNOTSUPP, errno.ENOTTY,
+                                       errno.EXDEV, errno.EINVAL):
+                raise
+            shutil.copyfileobj(src_file, dst_file)
+        finally:
+            dst_file.close()
+    finally:
+        src_file.close()
+    shutil.copystat(src, dst)
+
+
+def hardlink(src, dst):
+    """hardlink a file, fallback to normal copy"""
+    try:
+        os.link(src, dst)
+    except OSError, exception:
+        # different file-system or too many links
+        if exception.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM):
+            raise
+        shutil.copy2(src, dst)
+
+
+class Snapshot(object):
+    """create snapshot trees of repository revisions
+
+    @ivar code: repository instance (see vcs.py)
+    @ivar mode (str): how unchanged files are reused, 'hardlink' or 'reflink'
+    @ivar last (tuple): (revision, path, files) from last snapshot created,
+                        files is a dict with relative path of regular files
+                        to their (size, mtime) as when snapshot was created
+    """
+    MODES = {'hardlink': hardlink, 'reflink': reflink}
+
+    def __init__(self, code, mode='hardlink'):
+        if mode not in self.MODES:
+            raise Exception("Invalid snapshot mode: %s" % mode)
+        self.code = code
+        self.mode = mode
+        self.last = None
+
+
+    def _get_reusable(self, rev_num):
+        """get last snapshot that can be used as a base for rev_num
+        @return (tuple): (path, files, changed) or None
+        """
+        if self.last is None:
+            return None
+        last_rev, last_path, files = self.last
+        if not os.path.isdir(last_path):
+            return None
+        changed = set(self.code.changed_paths(last_rev, rev_num))
+        return last_path, files, changed
+
+
+    def create(self, rev_num, dst_path):
+        """create a tree for revision rev_num on dst_path
+
+        # FIXME: if dst_path exists it will be completely removed
+        @param rev_num(str): revision
+        @param dst_path(str): destination path of snapshot
+        """
+        if os.path.exists(dst_path):
+            if self.last and self.last[1] == dst_path:
+                self.last = None
+            shutil.rmtree(dst_path)
+
+        self.code.update(rev_num)
+        base = self._get_reusable(rev_num)
+        link = self.MODES[self.mode]
+        src_root = self.code.work_path
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(src_root):
+            # os.path.relpath requires python 2.6
+            rel_dir = dirpath[len(src_root):].lstrip(os.sep)
+            os.mkdir(os.path.join(dst_path, rel_dir))
+            # symlinks to directories are not followed, just re-created
+            for name in dirnames[:]:
+                if (name in VCS_DIRS or
+                    os.path.islink(os.path.join(dirpath, name))):
+                    dirnames.remove(name)
+                    if name not in VCS_DIRS:
+                        filenames.append(name)
+
+            for name in filenames:
+                rel_path = os.path.join(rel_dir, name)
+                src = os.path.join(dirpath, name)
+                dst = os.path.join(dst_path, rel_path)
+                if os.path.islink(src):
+                    os.symlink(os.readlink(src), dst)
+                    continue
+                if not self._reuse(base, link, rel_path, dst):
+                    shutil.copy2(src, dst)
+                stat = os.stat(dst)
+                files[rel_path] = (stat.st_size, stat.st_mtime)
+
+        self.last = (rev_num, dst_path, files)
+
+
+    def _reuse(self, base, link, rel_path, dst):
+        """link file from base snapshot if it is unchanged
+        @return (bool): True if file was reused
+        """
+        if base is None:
+            return False
+        base_path, base_files, changed = base
+        if rel_path in changed or rel_path not in base_files:
+            return False
+        # file on snapshot might have been modified/removed by integration
+        src = os.path.join(base_path, rel_path)
+        try:
+            stat = os.stat(src)
+        except OSError:
+            return False
+        if base_files[rel_path] != (stat.st_size, stat.st_mtime):
+            return False
+        # base snapshot might be removed from pool while being used
+        try:
+            link(src, dst)
+        except (OSError, IOError):
+            return False
+        return True
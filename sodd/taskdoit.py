@@ -17,6 +17,11 @@ class BaseDoit(Task):
     @ivar doit_task (str): task name
     @ivar timeout (floats): maximum seconds job is allowed to take.
                             if it takes longer it is assumed that in hanged.
+    @ivar log_dir (str): path where output from doit process is saved
+    @ivar result_file (str): path of doit json result
+    @ivar db_file (str): path of doit dependency file
+    @ivar num_process (int): number of processes used by doit to execute
+                             tasks in parallel (doit run -n)
     @ivar final_result (dict): final result of the job, there 4 results
                                success, fail, unstable, hang
 
@@ -27,30 +32,43 @@ class BaseDoit(Task):
          - started (str)
          - elapsed (float)
     """
-    def __init__(self, dodo_path, doit_task, base_path=None, timeout=None):
+    def __init__(self, dodo_path, doit_task, base_path=None, timeout=None,
+                 log_dir=None, num_process=1):
         Task.__init__(self)
         self.dodo_path = dodo_path
         self.base_path = base_path if base_path else os.path.dirname(dodo_path)
         self.doit_task = doit_task
         self.timeout = timeout
+        self.log_dir = log_dir
+        self.num_process = num_process
         # key: task/job name
         # value: list of results (dict)
         self.final_result = {}
 
-        self.result_file = '%s/result.json' % self.base_path
+        # one result file and one dependency file per doit task,
+        # job groups might run in parallel
+        self.result_file = '%s/result-%s.json' % (self.base_path, doit_task)
+        self.db_file = '%s/.doit-%s.db' % (self.base_path, doit_task)
         self.run_options = [('--file', self.dodo_path),
+                            ('--db-file', self.db_file),
                             ('--reporter', 'json'),
                             ('--output-file', self.result_file),
                             ('--dir', self.base_path)]
+        if num_process > 1:
+            self.run_options.append(('-n', str(num_process)))
 
 
-    def create_doit_task(self):
+    def create_doit_task(self, targets=None):
+        """create ProcessTask to execute doit
+        @param targets (list - str): doit tasks to be executed,
+                                     default is self.doit_task
+        """
         # remove results from previous runs
         if os.path.exists(self.result_file):
             os.remove(self.result_file)
         run_cmd = (['doit', 'run'] + list(itertools.chain(*self.run_options)) +
-                   [self.doit_task])
-        return ProcessTask(run_cmd, self.timeout)
+                   (targets or [self.doit_task]))
+        return ProcessTask(run_cmd, self.timeout, log_dir=self.log_dir)
 
 
     def read_json_result(self, doit_run_task):
@@ -89,8 +107,10 @@ class BaseDoit(Task):
 
 class DoitStable(BaseDoit):
     """wrap doit integration"""
-    def __init__(self, dodo_path, doit_task, base_path=None, timeout=None):
-        BaseDoit.__init__(self, dodo_path, doit_task, base_path, timeout)
+    def __init__(self, dodo_path, doit_task, base_path=None, timeout=None,
+                 log_dir=None, num_process=1):
+        BaseDoit.__init__(self, dodo_path, doit_task, base_path, timeout,
+                          log_dir, num_process)
         self.run_options.append(('--continue',))
 
     def run(self):
@@ -105,6 +125,10 @@ class DoitStable(BaseDoit):
 class DoitUnstableNoContinue(BaseDoit):
     """wrap doit integration with some logic to deal with unstable tests
     Immediately stop on failure and restart tests from failure
+
+    Tasks that fail are executed again (only them, by name) to check if
+    they are unstable. Then the whole doit task is executed again ignoring
+    the tasks that were already re-executed.
     """
 
     def calculate_final_results(self, run_results):
@@ -118,7 +142,6 @@ class DoitUnstableNoContinue(BaseDoit):
         added_something = False
         to_ignore = []
         for res in run_results['tasks']:
-            # print "============>", res['name'], " +++> ", res['result']
             # ignore tasks that were not executed
             if res['result'] in ('up-to-date', 'ignore'):
                 continue
@@ -150,13 +173,24 @@ class DoitUnstableNoContinue(BaseDoit):
         return (added_something, to_ignore)
 
 
+    def _ignore_task(self, to_ignore):
+        """create ProcessTask to ignore (dont repeat) doit tasks"""
+        ignore_cmd = ["doit", "ignore", "--file", self.dodo_path,
+                      "--db-file", self.db_file]
+        return ProcessTask(ignore_cmd + sorted(to_ignore))
+
+
     def run(self):
         doit_failed = False # doit command failed (invalid json output)
+        # all tasks executed on first run (no need to restart from failure)
+        run_all = ('--continue',) in self.run_options
+        targets = None # None => whole doit task, else failed tasks
+        retried = set() # tasks that were re-executed
         while True:
             print "doit integration in %s" % self.base_path
 
             # run and get result
-            doit_run_task = self.create_doit_task()
+            doit_run_task = self.create_doit_task(targets)
             (yield (doit_run_task, TaskPause(doit_run_task.tid)))
 
             run_results = self.read_json_result(doit_run_task)
@@ -173,21 +207,40 @@ class DoitUnstableNoContinue(BaseDoit):
             # update results
             added_something, to_ignore = self.calculate_final_results(run_results)
 
-            # ignore (dont repeat) failing tasks
-            if to_ignore:
-                ignore_cmd = ["doit", "-f", self.dodo_path, "ignore"]
-                doit_ignore = ProcessTask(ignore_cmd + to_ignore)
-                (yield (doit_ignore, TaskPause(doit_ignore.tid)))
-
             # exit from loop if finished
             # successful returncode will be zero when all tasks have been run
             # added_something is necessary to get errors that unable tasks to run
-            if (doit_run_task.proc.returncode == 0) or (not added_something):
+            if targets is None and ((doit_run_task.proc.returncode == 0) or
+                                    (not added_something)):
                 break
 
+            # re-execute tasks that failed for the first time
+            failed = [res['name'] for res in run_results['tasks']
+                      if res['result'] == 'fail' and
+                      res['name'] not in to_ignore]
+            if failed:
+                targets = sorted(failed)
+                retried.update(failed)
+                continue
+
+            # failed tasks were re-executed
+            if targets is not None:
+                if run_all:
+                    break
+                # restart from failure, ignore tasks already re-executed
+                targets = None
+                to_ignore = retried
+                retried = set()
+
+            # ignore (dont repeat) failing tasks
+            if to_ignore:
+                doit_ignore = self._ignore_task(to_ignore)
+                (yield (doit_ignore, TaskPause(doit_ignore.tid)))
+
 
 class DoitUnstable(DoitUnstableNoContinue):
-    def __init__(self, dodo_path, doit_task, base_path=None, timeout=None):
+    def __init__(self, dodo_path, doit_task, base_path=None, timeout=None,
+                 log_dir=None, num_process=1):
         DoitUnstableNoContinue.__init__(self, dodo_path, doit_task, base_path,
-                                        timeout)
+                                        timeout, log_dir, num_process)
         self.run_options.append(('--continue',))
@@ -0,0 +1,70 @@
+"""benchmark scheduler overhead with many short tasks
+
+Usage (from project root)::
+
+ $ python -m sodd.tests.bench_scheduler [num_tasks]
+
+ * ready: tasks are added directly to the scheduler
+ * fan-out: one task creates all others, every task is executed twice
+ * timers: every task creates a watchdog timer and cancel it (like ProcessTask)
+"""
+
+import sys
+import time
+import logging
+
+from ..scheduler import Scheduler, Task, TaskCancel
+
+
+def noop():
+    pass
+
+def two_steps():
+    yield
+
+def fan_out(num_tasks):
+    def run():
+        for i in xrange(num_tasks):
+            yield Task(two_steps)
+    return run
+
+def with_watchdog():
+    watchdog = Task(noop, scheduled=time.time() + 3600)
+    yield watchdog
+    yield TaskCancel(watchdog.tid)
+
+
+def bench_ready(num_tasks):
+    sched = Scheduler(False)
+    for i in xrange(num_tasks):
+        sched.add_task(Task(noop))
+    return sched
+
+def bench_fan_out(num_tasks):
+    sched = Scheduler(False)
+    sched.add_task(Task(fan_out(num_tasks)))
+    return sched
+
+def bench_timers(num_tasks):
+    sched = Scheduler(False)
+    for i in xrange(num_tasks):
+        sched.add_task(Task(with_watchdog))
+    return sched
+
+
+def main(num_tasks):
+    # logging every task execution would dominate the benchmark
+    logging.getLogger().setLevel(logging.WARNING)
+    for name, setup in (('ready', bench_ready),
+                        ('fan-out', bench_fan_out),
+                        ('timers', bench_timers)):
+        start = time.time()
+        sched = setup(num_tasks)
+        sched.loop()
+        elapsed = time.time() - start
+        print "%-8s %d tasks in %.2fs (%d tasks/s)" % (
+            name, num_tasks, elapsed, num_tasks / elapsed)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
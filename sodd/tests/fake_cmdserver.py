@@ -0,0 +1,38 @@
+"""fake hg command server (hg serve --cmdserver pipe) used on tests
+
+commands:
+ * fail: return code 1
+ * input: ask for input, output what was received
+ * anything else: output command arguments
+"""
+import sys
+import struct
+
+def write(channel, data):
+    sys.stdout.write(struct.pack('>cI', channel, len(data)) + data)
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+    write('o', 'capabilities: getencoding runcommand\nencoding: UTF-8')
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        assert 'runcommand\n' == line
+        length = struct.unpack('>I', sys.stdin.read(4))[0]
+        args = sys.stdin.read(length).split('\0')
+        if args[0] == 'fail':
+            write('e', 'failed')
+            write('r', struct.pack('>i', 1))
+            continue
+        if args[0] == 'input':
+            sys.stdout.write(struct.pack('>cI', 'I', 4096))
+            sys.stdout.flush()
+            length = struct.unpack('>I', sys.stdin.read(4))[0]
+            write('o', 'input:%r' % sys.stdin.read(length))
+            write('r', struct.pack('>i', 0))
+            continue
+        write('e', 'some warning\n')
+        write('o', ' '.join(args))
+        write('o', '\n')
+        write('r', struct.pack('>i', 0))
@@ -0,0 +1,82 @@
+"""fake doit used on tests
+
+commands:
+ * run: for a task X, sub-task X:ok succeeds and X:fail fails (unless
+        it was ignored)
+ * ignore: save ignored tasks on the dependency file
+
+The dependency file is locked while a command is executed, a second
+process using the same file fails (like concurrent access to .doit.db).
+"""
+import os
+import sys
+import time
+
+import simplejson
+
+# options that take a value
+VALUE_OPTIONS = ('--file', '--db-file', '--reporter', '--output-file',
+                 '--dir', '-n')
+
+def parse(args):
+    options = {}
+    positional = []
+    args = iter(args)
+    for arg in args:
+        if arg in VALUE_OPTIONS:
+            options[arg] = args.next()
+        elif arg.startswith('-'):
+            options[arg] = True
+        else:
+            positional.append(arg)
+    return options, positional
+
+def get_ignored(db_file):
+    if not os.path.exists(db_file):
+        return []
+    return open(db_file).read().split()
+
+def run(options, targets):
+    ignored = get_ignored(options['--db-file'])
+    tasks = []
+    for target in targets:
+        names = [target] if ':' in target else [target + ':ok', target + ':fail']
+        for name in names:
+            if name in ignored:
+                result = 'ignore'
+            elif name.endswith(':fail'):
+                result = 'fail'
+            else:
+                result = 'success'
+            tasks.append({'name': name, 'result': result, 'out': '',
+                          'err': '', 'started': '', 'elapsed': 0})
+    output = open(options['--output-file'], 'w')
+    simplejson.dump({'tasks': tasks, 'out': '', 'err': ''}, output)
+    output.close()
+    if [t for t in tasks if t['result'] == 'fail']:
+        return 1
+    return 0
+
+def ignore(options, tasks):
+    db = open(options['--db-file'], 'a')
+    db.write(''.join('%s\n' % name for name in tasks))
+    db.close()
+    return 0
+
+if __name__ == '__main__':
+    command = sys.argv[1]
+    options, positional = parse(sys.argv[2:])
+    lock_path = options['--db-file'] + '.lock'
+    try:
+        lock = os.open(lock_path, os.O_CREAT | os.O_EXCL)
+    except OSError:
+        sys.stderr.write("dependency file in use\n")
+        sys.exit(3)
+    try:
+        time.sleep(0.2)
+        returncode = {'run': run, 'ignore': ignore}[command](options,
+                                                            positional)
+    finally:
+        os.close(lock)
+        os.remove(lock_path)
+    sys.exit(returncode)
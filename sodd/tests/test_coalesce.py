@@ -0,0 +1,58 @@
+import py.test
+
+from ..coalesce import Coalesce, bisect
+
+
+def revs(*nums):
+    return [{'revision': str(num)} for num in nums]
+
+def selected_nums(selected):
+    return [(rev['revision'], [s['revision'] for s in skipped])
+            for rev, skipped in selected]
+
+
+class TestCoalesce(object):
+    def test_invalid(self):
+        py.test.raises(Exception, Coalesce, 'xxx')
+        py.test.raises(Exception, Coalesce, 'every', 0)
+
+    def test_all(self):
+        selected = Coalesce().select(revs(1, 2, 3))
+        assert [('1', []), ('2', []), ('3', [])] == selected_nums(selected)
+
+    def test_tip(self):
+        selected = Coalesce('tip').select(revs(1, 2, 3))
+        assert [('3', ['1', '2'])] == selected_nums(selected)
+
+    def test_every(self):
+        selected = Coalesce('every', 3).select(revs(1, 2, 3, 4, 5, 6, 7, 8))
+        # newest is always selected
+        assert [('3', ['1', '2']), ('6', ['4', '5']), ('8', ['7'])] == \
+            selected_nums(selected)
+
+    def test_selects_from_all(self):
+        assert not Coalesce().selects_from_all()
+        assert Coalesce('tip').selects_from_all()
+        assert Coalesce('every', 3).selects_from_all()
+
+    def test_must_bisect(self):
+        coalesce = Coalesce('tip', bisect=True)
+        assert coalesce.must_bisect('fail', '5', revs(6))
+        assert not coalesce.must_bisect('success', '5', revs(6))
+        assert not coalesce.must_bisect('fail', '5', [])
+        # parent failed too, failure was not introduced by skipped revisions
+        coalesce.set_result('5', 'fail')
+        assert not coalesce.must_bisect('fail', '5', revs(6))
+        # revision from DB (int) is the same as from VCS (str)
+        assert not coalesce.must_bisect('fail', 5, revs(6))
+        coalesce.set_result(7, 'fail')
+        assert 'fail' == coalesce.results['7']
+        assert not Coalesce('tip').must_bisect('fail', '5', revs(6))
+
+
+def test_bisect():
+    middle, before, after = bisect(revs(1, 2, 3, 4))
+    assert '3' == middle['revision']
+    assert revs(1, 2) == before
+    assert revs(4) == after
+    assert (revs(1)[0], [], []) == bisect(revs(1))
@@ -0,0 +1,84 @@
+import sqlite3
+import Queue
+
+import py.test
+
+from ..scheduler import Scheduler, Task, TaskPause, TaskSleep
+from ..dbwriter import DbWriter, DbTask
+
+
+def insert(cursor, value, commit=True):
+    cursor.execute("INSERT INTO t (value) VALUES (?)", (value,))
+    if commit:
+        cursor.connection.commit()
+    return cursor.lastrowid
+
+def fail(cursor, commit=True):
+    raise Exception("fail")
+
+
+def pytest_funcarg__db_path(request):
+    tmpdir = request.getfuncargvalue('tmpdir')
+    db_path = str(tmpdir.join('test.db'))
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, value INTEGER)")
+    conn.close()
+    return db_path
+
+def get_values(db_path):
+    conn = sqlite3.connect(db_path)
+    values = [row[0] for row in conn.execute("SELECT value FROM t")]
+    conn.close()
+    return values
+
+
+class TestDbWriter(object):
+    def test_write(self, db_path):
+        sched = Scheduler(use_sigchld=False, use_select=True)
+        writer = DbWriter(sched, lambda: sqlite3.connect(db_path))
+        writer.start()
+        results = []
+        def save():
+            for value in (10, 20):
+                db_task = DbTask(writer, insert, value)
+                yield (db_task, TaskPause(db_task.tid))
+                results.append(db_task.result)
+        sched.add_task(Task(save))
+        sched.loop()
+        writer.stop()
+        assert [1, 2] == results
+        assert [10, 20] == get_values(db_path)
+
+    def test_batch(self, db_path):
+        sched = Scheduler(use_sigchld=False)
+        writer = DbWriter(sched, lambda: sqlite3.connect(db_path))
+        conn = sqlite3.connect(db_path)
+        batch = [DbTask(writer, insert, 1), DbTask(writer, fail),
+                 DbTask(writer, insert, 3)]
+        writer.write(conn, batch)
+        # only failing write is lost
+        assert [1, 3] == get_values(db_path)
+        assert batch[1].error
+        assert [None, batch[1].error, None] == [t.error for t in batch]
+        # all tasks are put back on the scheduler
+        assert 3 == len(sched._external)
+
+    def test_error(self, db_path):
+        sched = Scheduler(use_sigchld=False, use_select=True)
+        writer = DbWriter(sched, lambda: sqlite3.connect(db_path))
+        writer.start()
+        db_task = DbTask(writer, fail)
+        sched.add_task(db_task)
+        py.test.raises(Exception, sched.loop)
+        writer.stop()
+
+    def test_queue_full(self):
+        sched = Scheduler(use_sigchld=False)
+        writer = DbWriter(sched, None, max_queue=1)
+        task1 = DbTask(writer, insert, 1)
+        task2 = DbTask(writer, insert, 2)
+        assert isinstance(task1.run_iteration(), TaskPause)
+        # queue is full, try again later
+        assert isinstance(task2.run_iteration(), TaskSleep)
+        writer.queue.get()
+        assert isinstance(task2.run_iteration(), TaskPause)
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import zlib
+
+from .. import dbapiext
+from .. import litemodel
+from ..logfiles import LogFiles, log_file_path
+
+
+SCHEMA = """
+CREATE TABLE integration (id INTEGER PRIMARY KEY, version VARCHAR(20),
+    revision INTEGER, parent_revision INTEGER, state VARCHAR(10), result VARCHAR(20), owner VARCHAR(40),
+    comment VARCHAR(1024), source_tree_root_id INTEGER);
+CREATE TABLE job_group (id INTEGER PRIMARY KEY, started VARCHAR,
+    elapsed FLOAT, state VARCHAR(10), result VARCHAR(10), log TEXT,
+    integration_id INTEGER, sodd_instance_id INTEGER);
+CREATE TABLE job (id INTEGER PRIMARY KEY, name VARCHAR(100),
+    type VARCHAR(20), state VARCHAR(10), result VARCHAR(20), log TEXT,
+    log_hash VARCHAR(40), started VARCHAR, elapsed FLOAT, job_group_id INTEGER);
+CREATE TABLE log_store (hash VARCHAR(40) PRIMARY KEY, size INTEGER, data BLOB);
+CREATE TABLE skipped_revision (id INTEGER PRIMARY KEY, revision INTEGER,
+    covered_by INTEGER, source_tree_root_id INTEGER);
+"""
+
+def pytest_funcarg__conn(request):
+    dbapiext.set_paramstyle(sqlite3)
+    conn = sqlite3.connect(':memory:')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def job(name, result='success'):
+    return {'name': name, 'result': result, 'out': 'o', 'err': 'e',
+            'started': 's', 'elapsed': 1.5}
+
+
+def test_save_integration(conn):
+    assert 0 == litemodel.get_last_revision_id(conn.cursor())
+    id1 = litemodel.save_integration(conn.cursor(), '10', 'running',
+                                     'unknown', 'me', 'xxx', 1)
+    id2 = litemodel.save_integration(conn.cursor(), '9', 'running',
+                                     'unknown', 'me', 'xxx', 1, '8')
+    assert id1 + 1 == id2
+    # revision is compared as number
+    assert 10 == litemodel.get_last_revision_id(conn.cursor())
+    row = conn.execute("SELECT revision, parent_revision FROM integration "
+                       "WHERE id=?", (id2,)).fetchone()
+    assert (9, 8) == row
+
+
+def test_save_integration_not_numeric(conn):
+    # working copy identifier has no revision number
+    id_ = litemodel.save_integration(conn.cursor(), 'wc-1', 'running',
+                                     'unknown', 'me', 'xxx', 1, 'wc-0')
+    row = conn.execute("SELECT version, revision, parent_revision "
+                       "FROM integration WHERE id=?", (id_,)).fetchone()
+    assert ('wc-1', None, None) == row
+
+
+def test_save_job(conn):
+    group_id = litemodel.db_job_group_start(conn.cursor(), 's', None,
+                                            'running', 'unknown', '', 1, 1)
+    jobs = [job('j%d' % i) for i in range(1200)]
+    jobs[3]['result'] = 'fail'
+    cursor = conn.cursor()
+    litemodel.save_job(cursor, jobs, 'test', group_id, commit=False)
+    litemodel.db_job_group_finish(cursor, group_id, 2.0, 'fail', '')
+    cursor.execute("SELECT name, type, state, result, log, log_hash, "
+                   "job_group_id FROM job ORDER BY id")
+    rows = cursor.fetchall()
+    assert 1200 == len(rows)
+    assert ('j0', 'test', 'finished', 'success', '',
+            litemodel.get_log_hash('eo'), group_id) == rows[0]
+    # all jobs have the same log
+    cursor.execute("SELECT size, data FROM log_store")
+    log_rows = cursor.fetchall()
+    assert 1 == len(log_rows)
+    assert 2 == log_rows[0][0]
+    assert 'eo' == zlib.decompress(log_rows[0][1])
+    assert 'fail' == rows[3][3]
+    cursor.execute("SELECT state, result FROM job_group")
+    assert [('finished', 'fail')] == cursor.fetchall()
+
+
+def test_save_job_empty(conn):
+    litemodel.save_job(conn.cursor(), [], 'test', 1)
+    assert [(0,)] == conn.execute("SELECT count(*) FROM job").fetchall()
+
+
+def test_is_postgres(conn):
+    assert not litemodel.is_postgres(conn.cursor())
+
+
+def test_save_logs(conn):
+    hashes = litemodel.save_logs(conn.cursor(), ['a', 'b', 'a'])
+    assert hashes[0] == hashes[2]
+    # already saved logs are not saved again
+    assert hashes[1:] == litemodel.save_logs(conn.cursor(), ['b', 'a'])
+    rows = conn.execute("SELECT hash, size FROM log_store "
+                        "ORDER BY hash").fetchall()
+    assert sorted([(hashes[0], 1), (hashes[1], 1)]) == rows
+
+
+def test_save_logs_concurrent(conn):
+    # another process saves the same log between the SELECT and the INSERT
+    class ConcurrentSave(object):
+        def put(self, log_hash, log):
+            conn.execute("INSERT INTO log_store VALUES (?, ?, NULL)",
+                         (log_hash, len(log)))
+            return False
+    hashes = litemodel.save_logs(conn.cursor(), ['a'], ConcurrentSave())
+    rows = conn.execute("SELECT hash, size FROM log_store").fetchall()
+    assert [(hashes[0], 1)] == rows
+
+
+def test_save_job_empty_log(conn):
+    jobs = [job('j1')]
+    jobs[0]['out'] = jobs[0]['err'] = ''
+    litemodel.save_job(conn.cursor(), jobs, 'test', 1)
+    assert [('', None)] == conn.execute("SELECT log, log_hash "
+                                        "FROM job").fetchall()
+    assert [(0,)] == conn.execute("SELECT count(*) FROM log_store").fetchall()
+
+
+def test_save_job_log_files(conn, tmpdir):
+    log_files = LogFiles(str(tmpdir), min_size=10)
+    jobs = [job('small'), job('big')]
+    jobs[1]['out'] = 'x' * 100
+    litemodel.save_job(conn.cursor(), jobs, 'test', 1, log_files)
+    rows = conn.execute("SELECT job.name, job.log, log_store.size, "
+                        "log_store.data IS NULL FROM job JOIN log_store "
+                        "ON job.log_hash = log_store.hash "
+                        "ORDER BY job.id").fetchall()
+    assert ('small', '', 2, 0) == rows[0]
+    # big log saved on file
+    assert ('big', '', 101, 1) == rows[1]
+    big_hash = litemodel.get_log_hash('e' + 'x' * 100)
+    assert os.path.exists(log_file_path(str(tmpdir), big_hash))
+
+
+def test_skipped_revisions(conn):
+    litemodel.save_skipped_revisions(conn.cursor(), 1, [('4', '7'),
+                                                        ('5', '7'),
+                                                        ('6', '7')])
+    # 5 is integrated (bisect), it covers 4
+    litemodel.integrate_skipped_revision(conn.cursor(), 1, '5', ['4'])
+    rows = conn.execute("SELECT revision, covered_by, source_tree_root_id "
+                        "FROM skipped_revision ORDER BY revision").fetchall()
+    assert [(4, 5, 1), (6, 7, 1)] == rows
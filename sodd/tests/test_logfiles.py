@@ -0,0 +1,26 @@
+import os
+import gzip
+
+from ..logfiles import LogFiles, log_file_path
+
+
+class TestLogFiles(object):
+    def test_small_log(self, tmpdir):
+        log_files = LogFiles(str(tmpdir), min_size=10)
+        assert False == log_files.put('abc', 'small')
+        assert [] == os.listdir(str(tmpdir))
+
+    def test_big_log(self, tmpdir):
+        log_files = LogFiles(str(tmpdir), min_size=10)
+        log = 'x' * 1000
+        log_hash = 'abc123'
+        assert True == log_files.put(log_hash, log)
+        file_path = log_file_path(str(tmpdir), log_hash)
+        assert log == gzip.open(file_path).read()
+        assert os.path.getsize(file_path) < 1000
+        # same content is saved only once
+        mtime = os.path.getmtime(file_path)
+        assert True == log_files.put(log_hash, log)
+        assert mtime == os.path.getmtime(file_path)
+        assert [os.path.basename(file_path)] == \
+            os.listdir(os.path.dirname(file_path))
@@ -2,8 +2,12 @@
 import py.test
 from mock import Mock
 
-from ..scheduler import Task
-from ..main import VcsTask, IntegrationTask, JobGroupTask
+import os
+
+from ..scheduler import Task, PoolTask
+from ..dbwriter import DbTask
+from ..main import VcsTask, IntegrationTask, JobGroupTask, get_concurrency
+from ..coalesce import Coalesce
 
 
 class TestVcsTask(object):
@@ -14,6 +18,7 @@ class TestVcsTask(object):
             {'revision':'15', 'committer':'e','comment':''},]
         vcs_info = {'project': {},
                     'code': code,
+                    'pool': Mock(),
                     'source_tree_id': 1,
                     'instance_id': 1}
         task = VcsTask(Mock(),vcs_info)
@@ -24,11 +29,94 @@ class TestVcsTask(object):
         # get 2 new integration tasks
         integ1 = gen.next()
         assert isinstance(integ1, IntegrationTask)
+        assert '12' == integ1.parent_revision
         integ2 = gen.next()
         assert isinstance(integ2, IntegrationTask)
+        assert '13' == integ2.parent_revision
 
         py.test.raises(StopIteration, gen.next)
         assert '15' == task.parent.last_rev
+        assert (('12', 100), {}) == code.get_new_revisions.call_args
+
+    def test_run_pages(self):
+        code = Mock()
+        code.get_new_revisions.return_value = [
+            {'revision':'13', 'committer':'e','comment':''},
+            {'revision':'14', 'committer':'e','comment':''},]
+        code.iter_revisions.return_value = iter([
+            {'revision':'15', 'committer':'e','comment':''},])
+        vcs_info = {'project': {'revisions_page_size': 2},
+                    'code': code,
+                    'pool': Mock(),
+                    'source_tree_id': 1,
+                    'instance_id': 1}
+        task = VcsTask(Mock(),vcs_info)
+        task.parent = Mock()
+        task.parent.last_rev = '12'
+
+        gen = task.run()
+        # tasks for first page are created before reading next page
+        assert ['13', '14'] == [gen.next().revision, gen.next().revision]
+        assert not code.iter_revisions.called
+        revisions = [integ.revision for integ in gen]
+        assert ['15'] == revisions
+        # next page read from last revision of previous page
+        assert (('14', 2), {}) == code.iter_revisions.call_args
+        assert '15' == task.parent.last_rev
+
+
+    def test_run_coalesce(self):
+        code = Mock()
+        code.get_new_revisions.return_value = [
+            {'revision':'13', 'committer':'e','comment':''},
+            {'revision':'14', 'committer':'e','comment':''},
+            {'revision':'15', 'committer':'e','comment':''},]
+        vcs_info = {'project': {},
+                    'code': code,
+                    'pool': Mock(),
+                    'coalesce': Coalesce('tip'),
+                    'source_tree_id': 1,
+                    'instance_id': 1}
+        task = VcsTask(Mock(),vcs_info)
+        task.parent = Mock()
+        task.parent.last_rev = '12'
+
+        gen = task.run()
+        # save skipped revisions
+        (save, pause) = gen.next()
+        assert isinstance(save, DbTask)
+        assert (1, [('13', '15'), ('14', '15')]) == save.args
+        integ = gen.next()
+        assert '15' == integ.revision
+        assert '12' == integ.parent_revision
+        assert ['13', '14'] == [rev['revision'] for rev in integ.skipped]
+        py.test.raises(StopIteration, gen.next)
+        assert '15' == task.parent.last_rev
+
+    def test_run_coalesce_pages(self):
+        # revisions from all pages are selected together
+        code = Mock()
+        code.get_new_revisions.return_value = [
+            {'revision':'13', 'committer':'e','comment':''},
+            {'revision':'14', 'committer':'e','comment':''},]
+        code.iter_revisions.return_value = iter([
+            {'revision':'15', 'committer':'e','comment':''},])
+        vcs_info = {'project': {'revisions_page_size': 2},
+                    'code': code,
+                    'pool': Mock(),
+                    'coalesce': Coalesce('tip'),
+                    'source_tree_id': 1,
+                    'instance_id': 1}
+        task = VcsTask(Mock(),vcs_info)
+        task.parent = Mock()
+        task.parent.last_rev = '12'
+
+        gen = task.run()
+        (save, pause) = gen.next()
+        assert (1, [('13', '15'), ('14', '15')]) == save.args
+        integ = gen.next()
+        assert '15' == integ.revision
+        py.test.raises(StopIteration, gen.next)
 
 
 class TestIntegrationTask(object):
@@ -36,20 +124,129 @@ class TestIntegrationTask(object):
         code = Mock()
         vcs_info = {'project': {'pre-integration': [],
                                 'tasks': ['t1', 't2'],
-                                '_pool_path': ''},
+                                '_concurrency': 2},
                     'code': code,
+                    'pool': Mock(),
                     'source_tree_id': 1,
                     'instance_id': 1,
                     }
 
         intg = IntegrationTask(Mock(), vcs_info, '15', 'ed', '-')
         gen = intg.run()
+        # save integration on DB
+        (save, pause) = gen.next()
+        assert isinstance(save, DbTask)
+        save.result = 3
         # execute 2 job groups
-        (group1, pause1) = gen.next()
-        assert isinstance(group1, JobGroupTask)
-        (group2, pause2) = gen.next()
-        assert isinstance(group2, JobGroupTask)
+        (pool, pause) = gen.next()
+        assert isinstance(pool, PoolTask)
+        assert 2 == pool.max_tasks
+        assert 2 == len(pool.task_list)
+        for group in pool.task_list:
+            assert isinstance(group, JobGroupTask)
+            assert 3 == group.integration_id
         py.test.raises(StopIteration, gen.next)
+        assert code.archive.called
+        # integration directory is released when finished
+        assert (('15',), {}) == vcs_info['pool'].acquire.call_args
+        assert (('15',), {}) == vcs_info['pool'].release.call_args
+
+    def test_run_snapshot(self):
+        snapshot = Mock()
+        pool = Mock()
+        pool.acquire.return_value = 'pool/15'
+        vcs_info = {'project': {'pre-integration': [],
+                                'tasks': ['t1'],
+                                '_concurrency': 1},
+                    'code': Mock(),
+                    'pool': pool,
+                    'snapshot': snapshot,
+                    'source_tree_id': 1,
+                    'instance_id': 1,
+                    }
+        intg = IntegrationTask(Mock(), vcs_info, '15', 'ed', '-')
+        gen = intg.run()
+        gen.next() # save on DB
+        gen.next()
+        assert (('15', 'pool/15'), {}) == snapshot.create.call_args
+        assert not vcs_info['code'].archive.called
+
+    def run_bisect(self, intg, group_result):
+        """run integration task until it finishes, all job groups get
+        the given result
+        @return: value yielded after integration is done
+        """
+        gen = intg.run()
+        if intg.bisecting:
+            (update, pause) = gen.next()
+            assert isinstance(update, DbTask)
+            assert ((1, intg.revision,
+                     [rev['revision'] for rev in intg.skipped]) ==
+                    update.args)
+        gen.next() # save on DB
+        (pool, pause) = gen.next()
+        for group in pool.task_list:
+            group.group_result = group_result
+        try:
+            return gen.next()
+        except StopIteration:
+            return None
+
+    def test_bisect(self):
+        coalesce = Coalesce('tip', bisect=True)
+        vcs_info = {'project': {'pre-integration': [],
+                                'tasks': ['t1'],
+                                '_concurrency': 1},
+                    'code': Mock(),
+                    'pool': Mock(),
+                    'coalesce': coalesce,
+                    'source_tree_id': 1,
+                    'instance_id': 1,
+                    }
+        skipped = [{'revision': str(rev), 'committer': 'e', 'comment': ''}
+                   for rev in (11, 12, 13, 14)]
+        intg = IntegrationTask(Mock(), vcs_info, '15', 'ed', '-',
+                               lock='integration', parent_revision='10',
+                               skipped=skipped)
+        # 15 failed, test 13 (middle of skipped)
+        intg13 = self.run_bisect(intg, 'fail')
+        assert 'fail' == coalesce.results['15']
+        assert '13' == intg13.revision
+        assert '10' == intg13.parent_revision
+        assert 'integration' == intg13.lock
+        assert ['11', '12'] == [rev['revision'] for rev in intg13.skipped]
+        assert ['14'] == [rev['revision'] for rev in intg13.after]
+        # 13 is ok, test 14
+        intg14 = self.run_bisect(intg13, 'success')
+        assert '14' == intg14.revision
+        assert '13' == intg14.parent_revision
+        assert [] == intg14.skipped
+        assert [] == intg14.after
+        # 14 failed, nothing else to test
+        assert None == self.run_bisect(intg14, 'fail')
+
+    def test_no_bisect(self):
+        vcs_info = {'project': {'pre-integration': [],
+                                'tasks': ['t1'],
+                                '_concurrency': 1},
+                    'code': Mock(),
+                    'pool': Mock(),
+                    'coalesce': Coalesce('tip'),
+                    'source_tree_id': 1,
+                    'instance_id': 1,
+                    }
+        skipped = [{'revision': '14', 'committer': 'e', 'comment': ''}]
+        intg = IntegrationTask(Mock(), vcs_info, '15', 'ed', '-',
+                               parent_revision='13', skipped=skipped)
+        assert None == self.run_bisect(intg, 'fail')
+
+
+def test_get_concurrency():
+    cores = os.sysconf('SC_NPROCESSORS_ONLN')
+    assert 1 == get_concurrency(1)
+    assert cores == get_concurrency(0)
+    assert cores == get_concurrency(cores + 1)
+    py.test.raises(Exception, get_concurrency, -1)
 
 
 class TestJobGroupTask(object):
@@ -59,10 +256,27 @@ class TestJobGroupTask(object):
         assert 'success' == jg.get_result([{'result':'success'}])
         assert 'fail' == jg.get_result([{'result':'fail'}])
 
+    def test_task_config(self):
+        jg = JobGroupTask(Mock(), 'tx', 1, 'path/to/integration', 1, '1')
+        assert 'tx' == jg.task_name
+        assert 1 == jg.num_process
+        task = {'name': 'ty', 'num_process': 3}
+        jg2 = JobGroupTask(Mock(), task, 1, 'path/to/integration', 1, '1')
+        assert 'ty' == jg2.task_name
+        assert 3 == jg2.num_process
+
     def test_run(self):
         jg = JobGroupTask(Mock(), 'tx', 1, 'path/to/integration', 1, '1')
         gen = jg.run()
+        # save job_group on DB
+        (start, pause) = gen.next()
+        assert isinstance(start, DbTask)
+        start.result = 5
         # execute DoitUnstable on this group
         (do_task, pause) = gen.next()
         assert isinstance(do_task, Task)
+        # save result on DB
+        (finish, pause) = gen.next()
+        assert isinstance(finish, DbTask)
+        assert 5 == finish.args[0]
         py.test.raises(StopIteration, gen.next)
@@ -0,0 +1,96 @@
+import os
+
+import py.test
+
+from ..pool import Pool, measure
+
+
+def create_tree(path, num_files, size=4096):
+    os.mkdir(path)
+    for i in range(num_files):
+        open(os.path.join(path, str(i)), 'w').write('x' * size)
+
+def pytest_funcarg__pool(request):
+    tmpdir = request.getfuncargvalue('tmpdir')
+    pool = Pool(str(tmpdir.join('pool')))
+    pool.start()
+    request.addfinalizer(pool.stop)
+    return pool
+
+
+def test_measure(tmpdir):
+    create_tree(str(tmpdir.join('a')), 2)
+    size, inodes = measure(str(tmpdir.join('a')))
+    # 2 files + directory
+    assert 3 == inodes
+    assert size >= 2 * 4096
+    # hardlinked file is accounted half for each tree
+    os.link(str(tmpdir.join('a', '0')), str(tmpdir.join('a', 'link')))
+    assert 3 == measure(str(tmpdir.join('a')))[1]
+
+
+class TestPool(object):
+    def test_start_existing(self, tmpdir):
+        create_tree(str(tmpdir.join('pool')), 0)
+        create_tree(str(tmpdir.join('pool', '5')), 3)
+        create_tree(str(tmpdir.join('pool', '.trash')), 0)
+        create_tree(str(tmpdir.join('pool', '.trash', 'old')), 3)
+        pool = Pool(str(tmpdir.join('pool')))
+        pool.start()
+        pool.jobs.join()
+        assert ['5'] == pool.entries.keys()
+        assert 4 == pool.entries['5'].inodes
+        assert not tmpdir.join('pool', '.trash', 'old').check()
+        pool.stop()
+
+    def test_start_file(self, tmpdir):
+        tmpdir.join('pool').write('')
+        pool = Pool(str(tmpdir.join('pool')))
+        py.test.raises(Exception, pool.start)
+
+    def test_acquire_release(self, pool):
+        path = pool.acquire('1')
+        assert os.path.join(pool.path, '1') == path
+        assert pool.entries['1'].pinned
+        # can not be used twice
+        py.test.raises(Exception, pool.acquire, '1')
+        create_tree(path, 2)
+        pool.release('1')
+        pool.jobs.join()
+        assert not pool.entries['1'].pinned
+        assert 3 == pool.entries['1'].inodes
+
+    def test_acquire_existing(self, pool):
+        path = pool.acquire('1')
+        create_tree(path, 2)
+        pool.release('1')
+        # existing directory is moved out of the way
+        assert path == pool.acquire('1')
+        assert not os.path.exists(path)
+        pool.jobs.join()
+        assert [] == os.listdir(pool.trash_path)
+
+    def test_evict_lru(self, pool):
+        pool.max_inodes = 7
+        for name in ('1', '2', '3'):
+            create_tree(pool.acquire(name), 2)
+        # 2 used more recently than 1
+        pool.release('2')
+        pool.release('1')
+        pool.jobs.join()
+        assert ['1', '2', '3'] == sorted(pool.entries.keys())
+        # over quota, least recently used is removed
+        pool.release('3')
+        pool.jobs.join()
+        assert ['1', '3'] == sorted(pool.entries.keys())
+        assert not os.path.exists(os.path.join(pool.path, '2'))
+        assert [] == os.listdir(pool.trash_path)
+
+    def test_evict_not_pinned(self, pool):
+        pool.max_bytes = 1
+        create_tree(pool.acquire('1'), 2)
+        create_tree(pool.acquire('2'), 2)
+        pool.release('1')
+        pool.jobs.join()
+        assert ['2'] == pool.entries.keys()
+        assert os.path.exists(os.path.join(pool.path, '2'))
@@ -1,12 +1,15 @@
 import os
 import time
 import signal
+import select
 
 import py.test
 
 from ..scheduler import TaskFinished, TaskSleep, TaskPause, TaskCancel
-from ..scheduler import Scheduler, Task
+from ..scheduler import Scheduler, Task, ReadyQueue
 from ..scheduler import PeriodicTask, ProcessTask, PidTask, GroupTask
+from ..scheduler import PoolTask
+from ..scheduler import OutputBuffer
 
 
 THIS_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -106,10 +109,53 @@ class TestProcessTask(object):
         got = t1.run_iteration()
         assert isinstance(got[1], Task)
         assert got[1].scheduled == (time.time() + timeout)
+        while(t1.proc.poll() is None): time.sleep(0.02)
         # cancel timeout task
         got2 = t1.run_iteration()
         assert isinstance(got2, TaskCancel)
 
+    def test_read_while_running(self):
+        t1 = ProcessTask(['python', SAMPLE_PROC, '5'])
+        got = t1.run_iteration()
+        assert 2 == len(got[0].fds)
+        # process still running, wait for more output
+        got = t1.run_iteration()
+        assert isinstance(got, TaskPause)
+        assert 2 == len(got.fds)
+        t1.kill()
+        while(t1.proc.poll() is None): time.sleep(0.02)
+        assert isinstance(t1.run_iteration(), TaskFinished)
+
+    def test_large_output(self):
+        # output bigger than pipe buffer does not block the process
+        cmd = ['python', '-c', 'import sys; sys.stdout.write("x" * 500000)']
+        t1 = ProcessTask(cmd)
+        t1.outdata.tail_size = 1000
+        got = t1.run_iteration()[0]
+        while True:
+            assert isinstance(got, TaskPause)
+            if t1.proc.poll() is not None:
+                break
+            # wait for output (or process termination)
+            if got.fds:
+                select.select(got.fds, [], [], 5)
+            else:
+                time.sleep(0.02)
+            got = t1.run_iteration()
+        assert isinstance(t1.run_iteration(), TaskFinished)
+        assert 0 == t1.proc.returncode
+        assert 500000 == t1.outdata.size
+        assert t1.outdata.getvalue().endswith("]\n" + "x" * 1000)
+
+    def test_log_dir(self, tmpdir):
+        t1 = ProcessTask(['python', SAMPLE_PROC, '0'], log_dir=str(tmpdir))
+        t1.run_iteration()
+        while(t1.proc.poll() is None): time.sleep(0.02)
+        t1.run_iteration()
+        out_file = tmpdir.join('%s.out' % t1.tid)
+        assert "done\n" == out_file.read()
+        assert "" == tmpdir.join('%s.err' % t1.tid).read()
+
     def test_terminate(self):
         t1 = ProcessTask(['python', SAMPLE_PROC, '5'])
         t1.run_iteration()
@@ -182,6 +228,26 @@ class TestProcessTask(object):
         assert None == t1.get_returncode()
 
 
+class TestOutputBuffer(object):
+    def test_tail(self):
+        buff = OutputBuffer(tail_size=5)
+        buff.write('abc')
+        assert 'abc' == buff.getvalue()
+        buff.write('defg')
+        buff.write('hi')
+        assert 9 == buff.size
+        assert '[... 4 bytes truncated ...]\nefghi' == buff.getvalue()
+
+    def test_file(self, tmpdir):
+        path = str(tmpdir.join('out'))
+        buff = OutputBuffer(path, tail_size=2, max_size=5)
+        buff.write('abc')
+        buff.write('defg')
+        buff.close()
+        assert 'abcde' == open(path).read()
+        assert buff.getvalue().endswith("see %s ...]\nfg" % path)
+
+
 class TestPidTask(object):
     def pytest_funcarg__fake_sched(self, request):
         def fake_sched():
@@ -213,6 +279,33 @@ class TestPidTask(object):
         assert [fake_sched.tasks['2']] == t1.sched.ready
 
 
+class TestReadyQueue(object):
+    def test_fifo(self):
+        t1 = Task(lambda :None)
+        t2 = Task(lambda :None)
+        ready = ReadyQueue()
+        assert ready.append(t1)
+        assert ready.append(t2)
+        assert 2 == len(ready)
+        assert t1 == ready[0]
+        assert [t1, t2] == list(ready)
+        assert t1 == ready.popleft()
+        assert t2 == ready.popleft()
+        assert 0 == len(ready)
+
+    def test_membership(self):
+        t1 = Task(lambda :None)
+        ready = ReadyQueue()
+        assert t1 not in ready
+        ready.append(t1)
+        assert t1 in ready
+        assert not ready.append(t1)
+        assert 1 == len(ready)
+        ready.popleft()
+        assert t1 not in ready
+        assert ready.append(t1)
+
+
 class TestGroupTask(object):
     def test_run(self):
         t1 = Task(lambda :None)
@@ -234,6 +327,44 @@ class TestGroupTask(object):
 
 
 
+class TestPoolTask(object):
+    def test_run(self):
+        tasks = [Task(lambda :None) for i in range(3)]
+        pool = PoolTask(tasks, 2)
+        # start 2 tasks and wait for them
+        got = pool.run_iteration()
+        assert [tasks[0], tasks[1]] == got[0::2]
+        assert [tasks[0].tid, tasks[1].tid] == [p.tid for p in got[1::2]]
+        # none finished, wait again
+        got = pool.run_iteration()
+        assert 1 == len(got)
+        assert got[0].tid is None
+        # one finished, start next one
+        tasks[1]._finished = True
+        got = pool.run_iteration()
+        assert tasks[2] == got[0]
+        assert tasks[2].tid == got[1].tid
+        # done
+        tasks[0]._finished = True
+        tasks[2]._finished = True
+        assert isinstance(pool.run_iteration(), TaskFinished)
+
+    def test_sched(self):
+        sched = Scheduler(False)
+        running = []
+        max_running = []
+        def job():
+            running.append(1)
+            max_running.append(len(running))
+            yield TaskSleep(0.01)
+            running.pop()
+        tasks = [Task(job) for i in range(5)]
+        sched.add_task(PoolTask(tasks, 2))
+        sched.loop()
+        assert 5 == len(max_running)
+        assert 2 == max(max_running)
+
+
 # ################################# Scheduler
 
 def pytest_funcarg__sched(request):
@@ -383,6 +514,61 @@ class TestScheduler(object):
         assert 0 == len(sched.waiting)
         assert t1.cancelled
 
+    def test_run_task_Cancel_sleeping(self, sched):
+        t1 = Task(lambda :None)
+        t2 = Task(lambda : (yield TaskCancel(t1.tid)))
+        sched.add_task(t1, 30)
+        sched.add_task(t2)
+        assert 1 == len(sched.waiting)
+        sched.run_task(sched.ready.popleft()) # t2
+        assert t1.cancelled
+        # t1 is ready to be finished, entry removed from waiting
+        assert t1 in sched.ready
+        assert 0 == len(sched.waiting)
+        sched.run_task(sched.ready.popleft()) # t1
+        sched.run_task(sched.ready.popleft()) # t2
+        assert 0 == len(sched.tasks)
+
+    def test_cancel_lazy(self, sched, monkeypatch):
+        mytime = MockTime()
+        monkeypatch.setattr(time, 'time', mytime.time)
+        tasks = [Task(lambda :None) for i in range(4)]
+        for delay, task in enumerate(tasks):
+            sched.add_task(task, 10 + delay)
+        # dead entry is kept on heap
+        sched.cancel_task(tasks[0])
+        assert 4 == len(sched.waiting)
+        assert tasks[0] == sched.ready.popleft()
+        # and skipped when its time comes
+        mytime.current += 10.5
+        sched.loop_iteration()
+        assert 0 == len(sched.ready)
+        assert 3 == len(sched.waiting)
+        # heap is rebuilt when most entries are dead
+        sched.cancel_task(tasks[2])
+        sched.cancel_task(tasks[3])
+        assert [tasks[1]] == sched.waiting
+
+    def test_run_task_Pause_fds(self, sched):
+        read_fd, write_fd = os.pipe()
+        t1 = Task(lambda :(yield TaskPause(fds=[read_fd])))
+        sched.add_task(t1)
+        sched.run_task(sched.ready.popleft())
+        assert 0 == len(sched.ready)
+        assert t1 == sched.readers[read_fd]
+        # not ready
+        sched._wait(0)
+        assert 0 == len(sched.ready)
+        # ready for reading
+        os.write(write_fd, 'x')
+        sched._wait(0)
+        assert t1 == sched.ready[0]
+        # running task removes fd from readers
+        sched.run_task(sched.ready.popleft())
+        assert 0 == len(sched.readers)
+        os.close(read_fd)
+        os.close(write_fd)
+
     def test_run_task_Error(self, sched):
         # yield a class instead of instance
         t1 = Task(lambda : (yield TaskPause))
@@ -462,3 +648,63 @@ class TestSchedulerPool(object):
         sched.add_task(t2)
         sched.loop()
         assert 2 == len(count)
+
+
+class TestSchedulerSelect(object):
+    def test_wakeup(self):
+        sched = Scheduler(False, use_select=True)
+        sched.wakeup()
+        sched.wakeup() # only one byte is written
+        start = time.time()
+        sched._wait(5)
+        assert (time.time() - start) < 1
+        assert not sched._wakeup_pending
+
+    def test_add_task_wakeup(self):
+        sched = Scheduler(False, use_select=True)
+        sched.add_task(Task(lambda :None), -1)
+        start = time.time()
+        sched._wait(5)
+        assert (time.time() - start) < 1
+
+    def test_timer(self):
+        sched = Scheduler(False, use_select=True)
+        t1 = Task(lambda :None)
+        sched.add_task(t1, 0.2)
+        sched._wait(0) # clear wakeup from add_task
+        start = time.time()
+        sched.loop_iteration() # wait for timer
+        assert 0.1 < (time.time() - start) < 1
+        sched.loop_iteration() # execute t1
+        assert 0 == len(sched.tasks)
+
+    def test_ready_threadsafe(self):
+        sched = Scheduler(False, use_select=True)
+        t1 = Task(lambda :None)
+        sched.add_task(t1, -1)
+        sched._wait(0) # clear wakeup from add_task
+        sched.ready_threadsafe(t1)
+        assert sched._wakeup_pending
+        sched.loop_iteration() # execute t1
+        assert 0 == len(sched.tasks)
+
+    def test_child_terminate(self):
+        sched = Scheduler(use_select=True)
+        try:
+            t1 = ProcessTask(['python', SAMPLE_PROC, '0'])
+            sched.add_task(t1)
+            start = time.time()
+            sched.loop()
+            assert (time.time() - start) < 5
+            assert 0 == t1.proc.returncode
+        finally:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            signal.set_wakeup_fd(-1)
+
+    def test_signal_wakeup_fd(self):
+        # signals write to the self-pipe even before python handler runs
+        sched = Scheduler(use_select=True)
+        try:
+            assert sched._wakeup_fds[1] == signal.set_wakeup_fd(-1)
+        finally:
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
@@ -0,0 +1,98 @@
+import os
+
+import py.test
+
+from ..snapshot import Snapshot
+
+
+class FakeVcs(object):
+    """working copy where revisions are dicts of path -> content"""
+    def __init__(self, work_path, revisions):
+        self.work_path = work_path
+        self.revisions = revisions
+        self.current = None
+
+    def update(self, rev_num):
+        for path in self.revisions.get(self.current, {}):
+            os.remove(os.path.join(self.work_path, path))
+        for path, content in self.revisions[rev_num].iteritems():
+            full_path = os.path.join(self.work_path, path)
+            if not os.path.exists(os.path.dirname(full_path)):
+                os.makedirs(os.path.dirname(full_path))
+            open(full_path, 'w').write(content)
+        self.current = rev_num
+
+    def changed_paths(self, from_rev, to_rev):
+        old, new = self.revisions[from_rev], self.revisions[to_rev]
+        return [path for path in set(old) | set(new)
+                if old.get(path) != new.get(path)]
+
+
+REVISIONS = {'1': {'a': 'a1', 'sub/b': 'b1', 'c': 'c1'},
+             '2': {'a': 'a2', 'sub/b': 'b1', 'd': 'd2'},}
+
+def pytest_funcarg__code(request):
+    tmpdir = request.getfuncargvalue('tmpdir')
+    work_path = tmpdir.join('trunk')
+    work_path.mkdir()
+    work_path.join('.hg').mkdir()
+    return FakeVcs(str(work_path), REVISIONS)
+
+
+def read(path):
+    return open(path).read()
+
+
+class TestSnapshot(object):
+    def test_invalid_mode(self, code):
+        py.test.raises(Exception, Snapshot, code, 'xxx')
+
+    def test_first(self, code, tmpdir):
+        snap = Snapshot(code)
+        snap.create('1', str(tmpdir.join('1')))
+        assert 'a1' == read(str(tmpdir.join('1', 'a')))
+        assert 'b1' == read(str(tmpdir.join('1', 'sub', 'b')))
+        assert not tmpdir.join('1', '.hg').check()
+        # first snapshot is a copy
+        assert 1 == os.stat(str(tmpdir.join('1', 'a'))).st_nlink
+
+    def test_hardlink_unchanged(self, code, tmpdir):
+        snap = Snapshot(code, 'hardlink')
+        snap.create('1', str(tmpdir.join('1')))
+        snap.create('2', str(tmpdir.join('2')))
+        assert 'a2' == read(str(tmpdir.join('2', 'a')))
+        assert 'd2' == read(str(tmpdir.join('2', 'd')))
+        assert not tmpdir.join('2', 'c').check()
+        assert 'a1' == read(str(tmpdir.join('1', 'a')))
+        # unchanged file is shared
+        assert 2 == os.stat(str(tmpdir.join('2', 'sub', 'b'))).st_nlink
+        assert 1 == os.stat(str(tmpdir.join('2', 'a'))).st_nlink
+
+    def test_reflink(self, code, tmpdir):
+        snap = Snapshot(code, 'reflink')
+        snap.create('1', str(tmpdir.join('1')))
+        snap.create('2', str(tmpdir.join('2')))
+        assert 'b1' == read(str(tmpdir.join('2', 'sub', 'b')))
+        assert 1 == os.stat(str(tmpdir.join('2', 'sub', 'b'))).st_nlink
+
+    def test_modified_on_snapshot(self, code, tmpdir):
+        # files modified by the integration are not reused
+        snap = Snapshot(code)
+        snap.create('1', str(tmpdir.join('1')))
+        tmpdir.join('1', 'sub', 'b').write('modified by test')
+        snap.create('2', str(tmpdir.join('2')))
+        assert 'b1' == read(str(tmpdir.join('2', 'sub', 'b')))
+
+    def test_previous_removed(self, code, tmpdir):
+        snap = Snapshot(code)
+        snap.create('1', str(tmpdir.join('1')))
+        tmpdir.join('1').remove()
+        snap.create('2', str(tmpdir.join('2')))
+        assert 'b1' == read(str(tmpdir.join('2', 'sub', 'b')))
+
+    def test_same_path(self, code, tmpdir):
+        snap = Snapshot(code)
+        snap.create('1', str(tmpdir.join('x')))
+        snap.create('2', str(tmpdir.join('x')))
+        assert 'b1' == read(str(tmpdir.join('x', 'sub', 'b')))
+        assert 'a2' == read(str(tmpdir.join('x', 'a')))
@@ -1,17 +1,19 @@
 from __future__ import with_statement
 
 import os
+import signal
 
 import simplejson
 import py.test
 from mock import Mock
 
 from ..taskdoit import DoitStable, DoitUnstableNoContinue, DoitUnstable
-from ..scheduler import ProcessTask, TaskPause
+from ..scheduler import Scheduler, ProcessTask, TaskPause
 
 THIS_PATH = os.path.dirname(os.path.abspath(__file__))
 DODO_FILE = os.path.join(THIS_PATH, '__dodo__.py') # doesnt really exist
 DB_FILE = os.path.join(THIS_PATH, '.doit.db')
+FAKE_DOIT = os.path.join(THIS_PATH, 'fake_doit.py')
 SAMPLE_RESULT = {u'err': u'',
                  u'out': u'',
                  u'tasks': [{u'elapsed': 0.066853046417236328,
@@ -75,6 +77,12 @@ class TestDoitStable(object):
         py.test.raises(StopIteration, yi.next)
         assert 'fail' == job.final_result['t1']['result']
 
+    def test_num_process(self):
+        job = DoitStable(DODO_FILE, 't1', THIS_PATH, num_process=4)
+        proc = job.create_doit_task()
+        assert "--continue" in proc.cmd
+        assert "4" == proc.cmd[proc.cmd.index("-n") + 1]
+
 
 class TestDoitUnstableNoContinue(object):
     def test_final_results(self):
@@ -129,6 +137,26 @@ class TestDoitUnstableNoContinue(object):
         assert 'success' == job.final_result['res4']['result']
 
 
+    def test_final_results_any_order(self):
+        # results from parallel execution come in order of completion
+        batch1 = [{'name': 'res%d' % i, 'result': 'fail', 'out': '1'}
+                  for i in range(6)]
+        batch2 = [{'name': 'res%d' % i,
+                   'result': ('fail' if i % 2 else 'success'), 'out': '2'}
+                  for i in range(6)]
+        got = []
+        for reverse in (False, True):
+            job = DoitUnstableNoContinue('base_path', 'xxx')
+            job.calculate_final_results({'tasks': batch1})
+            batch = sorted(batch2, key=lambda res: res['name'],
+                           reverse=reverse)
+            added, to_ignore = job.calculate_final_results({'tasks': batch})
+            got.append((job.final_result, sorted(to_ignore)))
+        assert got[0] == got[1]
+        assert ['res1', 'res3', 'res5'] == got[0][1]
+        assert 'unstable' == got[0][0]['res0']['result']
+        assert 'fail' == got[0][0]['res1']['result']
+
     def test_run_with_failures(self, monkeypatch):
         job = DoitUnstableNoContinue(DODO_FILE, 't1', THIS_PATH)
         doit_result = SAMPLE_RESULT
@@ -154,6 +182,41 @@ class TestDoitUnstableNoContinue(object):
         # final result is fail
         assert 'fail' == job.final_result['t1']['result']
 
+    def test_run_restart_from_failure(self, monkeypatch):
+        job = DoitUnstableNoContinue(DODO_FILE, 'tx', THIS_PATH)
+        batch1 = {'tasks': [{'name': 'tx:a', 'result': 'success'},
+                            {'name': 'tx:b', 'result': 'fail'}]}
+        batch2 = {'tasks': [{'name': 'tx:b', 'result': 'success'}]}
+        batch3 = {'tasks': [{'name': 'tx:a', 'result': 'up-to-date'},
+                            {'name': 'tx:b', 'result': 'ignore'},
+                            {'name': 'tx:c', 'result': 'success'}]}
+        batch_list = [batch3, batch2, batch1]
+        monkeypatch.setattr(job, "read_json_result",
+                            lambda task: batch_list.pop())
+        failed_process = Mock()
+        failed_process.returncode = 1
+        ok_process = Mock()
+        ok_process.returncode = 0
+
+        yi = job.run()
+        (run1, pause1) = yi.next()
+        run1.proc = failed_process
+        # re-execute failed task
+        (run2, pause2) = yi.next()
+        assert 'tx:b' == run2.cmd[-1]
+        run2.proc = ok_process
+        # ignore re-executed task
+        (ignore, pause3) = yi.next()
+        assert 'ignore' in ignore.cmd
+        assert 'tx:b' == ignore.cmd[-1]
+        # restart whole task
+        (run3, pause4) = yi.next()
+        assert 'tx' == run3.cmd[-1]
+        run3.proc = ok_process
+        py.test.raises(StopIteration, yi.next)
+        assert 'unstable' == job.final_result['tx:b']['result']
+        assert 'success' == job.final_result['tx:c']['result']
+
     def test_run_success(self, monkeypatch):
         job = DoitUnstableNoContinue(DODO_FILE, 't1', THIS_PATH)
         doit_result = SAMPLE_RESULT
@@ -195,3 +258,68 @@ class TestDoitUnstable(object):
         job = DoitUnstable(DODO_FILE, 't1', THIS_PATH)
         proc = job.create_doit_task()
         assert "--continue" in proc.cmd
+        assert "-n" not in proc.cmd
+
+    def test_run_retry_failed(self, monkeypatch):
+        job = DoitUnstable(DODO_FILE, 'tx', THIS_PATH)
+        batch1 = {'tasks': [{'name': 'tx:a', 'result': 'fail'},
+                            {'name': 'tx:b', 'result': 'fail'},
+                            {'name': 'tx:c', 'result': 'success'}]}
+        batch2 = {'tasks': [{'name': 'tx:a', 'result': 'success'},
+                            {'name': 'tx:b', 'result': 'fail'}]}
+        batch_list = [batch2, batch1]
+        monkeypatch.setattr(job, "read_json_result",
+                            lambda task: batch_list.pop())
+        mock_process = Mock()
+        mock_process.returncode = 1
+
+        yi = job.run()
+        # 1) execute whole task
+        (run1, pause1) = yi.next()
+        assert 'tx' == run1.cmd[-1]
+        run1.proc = mock_process
+        # 2) execute only failed tasks
+        (run2, pause2) = yi.next()
+        assert ['tx:a', 'tx:b'] == run2.cmd[-2:]
+        run2.proc = mock_process
+        # all tasks were executed, no need to run again or ignore
+        py.test.raises(StopIteration, yi.next)
+        assert 'unstable' == job.final_result['tx:a']['result']
+        assert 'fail' == job.final_result['tx:b']['result']
+        assert 'success' == job.final_result['tx:c']['result']
+
+    def testNumProcess(self):
+        job = DoitUnstable(DODO_FILE, 't1', THIS_PATH, num_process=4)
+        proc = job.create_doit_task()
+        assert "--continue" in proc.cmd
+        assert "4" == proc.cmd[proc.cmd.index("-n") + 1]
+
+
+def test_parallel_groups(tmpdir, monkeypatch):
+    # "doit" executable on PATH is fake_doit.py
+    bin_dir = tmpdir.mkdir('bin')
+    doit_bin = bin_dir.join('doit')
+    doit_bin.write('#!/bin/sh\nexec python %s "$@"\n' % FAKE_DOIT)
+    doit_bin.chmod(0755)
+    monkeypatch.setitem(os.environ, 'PATH',
+                        '%s:%s' % (bin_dir, os.environ['PATH']))
+    dodo_file = str(tmpdir.join('dodo.py'))
+    jobs = [DoitUnstableNoContinue(dodo_file, 'ga'),
+            DoitUnstableNoContinue(dodo_file, 'gb')]
+    assert jobs[0].result_file != jobs[1].result_file
+    assert jobs[0].db_file != jobs[1].db_file
+
+    sched = Scheduler()
+    try:
+        for job in jobs:
+            sched.add_task(job)
+        sched.loop()
+    finally:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+
+    for job in jobs:
+        name = job.doit_task
+        assert 'success' == job.final_result[name + ':ok']['result']
+        assert 'fail' == job.final_result[name + ':fail']['result']
+        # ignored task was saved on the group dependency file only
+        assert [name + ':fail'] == open(job.db_file).read().split()
@@ -1,6 +1,7 @@
 import os
 import shutil
 import subprocess
+import sys
 
 import py.test
 
@@ -132,3 +133,141 @@ class TestVcs(object):
         new_revs2 = clone.get_new_revisions(str(2 + repo.rev_zero))
         assert 0 == len(new_revs2)
 
+        # limit
+        new_revs3 = clone.get_new_revisions(str(0 + repo.rev_zero), 1)
+        assert [str(1 + repo.rev_zero)] == [r['revision'] for r in new_revs3]
+        new_revs4 = list(clone.iter_revisions(str(1 + repo.rev_zero), 1))
+        assert [str(2 + repo.rev_zero)] == [r['revision'] for r in new_revs4]
+
+
+
+    def test_update_changed_paths(self, testbin, repo):
+        rev0, rev1 = str(0 + repo.rev_zero), str(1 + repo.rev_zero)
+        assert ['file2'] == repo.changed_paths(rev0, rev1)
+        repo.update(rev0)
+        assert not os.path.exists(repo.work_path + '/file2')
+        repo.update(rev1)
+        assert os.path.exists(repo.work_path + '/file2')
+
+
+class TestRunner(object):
+    def test_run(self):
+        runner = vcs.Runner()
+        assert "hi\n" == runner.run(['echo', 'hi'])
+        assert 1 == runner.stats['echo hi'].calls
+
+    def test_stream(self):
+        runner = vcs.Runner()
+        assert "hi\n" == "".join(runner.stream(['echo', 'hi']))
+        assert 1 == runner.stats['echo hi'].calls
+        py.test.raises(Exception, list, runner.stream(['false']))
+
+    def test_stream_stop(self):
+        runner = vcs.Runner()
+        output = runner.stream(['yes'])
+        assert output.next().startswith('y\n')
+        # process is killed
+        output.close()
+        assert 1 == runner.stats['yes'].calls
+
+    def test_retry(self, monkeypatch):
+        delays = []
+        monkeypatch.setattr(vcs.time, 'sleep', delays.append)
+        runner = vcs.Runner(max_try=3, retry_delay=1)
+        py.test.raises(Exception, runner.run, ['false'])
+        assert 3 == runner.stats['false'].calls
+        # exponential backoff
+        assert [1, 2] == delays
+
+
+class TestHgCmdServer(object):
+    def pytest_funcarg__runner(self, request):
+        runner = vcs.HgCmdServer('repo_path', retry_delay=0)
+        fake = os.path.join(os.path.dirname(__file__), 'fake_cmdserver.py')
+        runner.server_cmd = [sys.executable, fake]
+        request.addfinalizer(runner.close)
+        return runner
+
+    def test_run(self, runner):
+        assert "log -r 1\n" == runner.run(['hg', 'log', '-r', '1'])
+        server = runner.server
+        # same server process is used
+        assert "tip\n" == runner.run(['hg', 'tip'])
+        assert server is runner.server
+        assert 1 == runner.stats['hg tip'].calls
+
+    def test_stream(self, runner):
+        assert "log -r 1\n" == "".join(runner.stream(['hg', 'log', '-r', '1']))
+        py.test.raises(Exception, list, runner.stream(['hg', 'fail']))
+        # server is not locked while consumer holds the output
+        output = runner.stream(['hg', 'log'])
+        assert "log\n" == output.next()
+        assert not runner.lock.locked()
+        assert "tip\n" == runner.run(['hg', 'tip'])
+        output.close()
+
+    def test_input(self, runner):
+        assert "input:''" == runner.run(['hg', 'input'])
+
+    def test_fail(self, runner):
+        py.test.raises(Exception, runner.run, ['hg', 'fail'])
+        assert 3 == runner.stats['hg fail'].calls
+        # server still usable
+        assert "tip\n" == runner.run(['hg', 'tip'])
+
+    def test_restart(self, runner):
+        runner.run(['hg', 'tip'])
+        runner.server.kill()
+        runner.server.wait()
+        assert "tip\n" == runner.run(['hg', 'tip'])
+        assert 3 == runner.stats['hg tip'].calls
+
+    def test_no_server(self, runner):
+        # clone is executed in a new process
+        runner.server_cmd = None
+        py.test.raises(Exception, runner.run, ['false', 'clone'])
+        assert runner.server is None
+
+
+def test_parse_log_entries():
+    xml = ('<log><logentry revision="3"><author>ed</author>'
+           '<msg>line1\nline2</msg></logentry>'
+           '<logentry revision="4"><author>ana</author><msg></msg>'
+           '</logentry></log>')
+    chunks = [xml[i:i+10] for i in range(0, len(xml), 10)]
+    fed = []
+    def feed():
+        for chunk in chunks:
+            fed.append(chunk)
+            yield chunk
+    entries = vcs.parse_log_entries(feed())
+    first = entries.next()
+    assert {'revision': '3', 'committer': 'ed',
+            'comment': 'line1\nline2'} == first
+    # entry available before whole document is read
+    assert len(fed) < len(chunks)
+    assert [{'revision': '4', 'committer': 'ana', 'comment': ''}] == \
+        list(entries)
+
+
+def test_revisions_after():
+    revs = [{'revision': str(num)} for num in (9, 10, 11, 12)]
+    assert ['11', '12'] == [r['revision'] for r in
+                            vcs.revisions_after(iter(revs), '10')]
+    assert ['10'] == [r['revision'] for r in
+                      vcs.revisions_after(iter(revs), '9', 1)]
+
+
+def test_hg_iter_revisions():
+    class FakeRunner(object):
+        def stream(self, cmd):
+            self.cmd = cmd
+            yield ('<logentry revision="5"><author>a</author><msg>m</msg>'
+                   '</logentry>\n<logentry revision="6">')
+            yield '<author>b &amp; c</author><msg>n</msg></logentry>\n'
+    runner = FakeRunner()
+    repo = vcs.HG('src', 'path', runner)
+    revs = list(repo.iter_revisions('5', 10))
+    assert [{'revision': '6', 'committer': 'b & c', 'comment': 'n'}] == revs
+    # from_rev is included on log
+    assert ['--limit', '11'] == runner.cmd[-2:]
@@ -5,25 +5,323 @@ tests make sure all implementations follow the same API.
 """
 
 import os
+import time
+import signal
 import shutil
+import struct
+import logging
 import subprocess
 import threading
+import itertools
+from collections import deque
+from xml import sax
 from xml.dom import minidom
 
-def check_call_get(cmd):
-    """Run command and return stdout, raise Exception if cmd fails"""
-    MAX_TRY = 3
-    # FIXME
-    # It is very common that SVN commands just fail sometimes.
-    # by just just retry it... should handle in a way that process does not
-    # stop because of SVN not being available.
-    for x_try in range(MAX_TRY):
+
+# max number of bytes read at once from a streamed command
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class CallStats(object):
+    """timing of calls of a VCS command
+    @ivar calls (int): number of calls
+    @ivar total (float): total time in seconds
+    @ivar max (float): slowest call in seconds
+    """
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed):
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+
+class Runner(object):
+    """execute VCS commands, one process per command
+
+    It is very common that SVN commands just fail sometimes (i.e. network).
+    Failed commands are retried with an exponential backoff.
+
+    @ivar max_try (int): number of times a command is executed before failing
+    @ivar retry_delay (float): seconds to wait before first retry,
+                               doubled on every retry
+    @ivar stats (dict): command (i.e. 'hg log') => CallStats
+    """
+    def __init__(self, max_try=3, retry_delay=1):
+        self.max_try = max_try
+        self.retry_delay = retry_delay
+        self.stats = {}
+
+
+    def _execute(self, cmd):
+        """@return tuple(int, str): returncode, stdout"""
         proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
         out = proc.communicate()[0]
-        if not proc.returncode:
-            return out
-        print "ERROR VCS: %s try cmd:(%s) got %s" % (x_try, cmd, proc.returncode)
-    raise Exception(proc.returncode, cmd)
+        return proc.returncode, out
+
+
+    def _record(self, cmd, elapsed):
+        name = " ".join(cmd[:2])
+        if name not in self.stats:
+            self.stats[name] = CallStats()
+        self.stats[name].add(elapsed)
+        logging.debug("VCS %s: %.3fs" % (name, elapsed))
+
+
+    def run(self, cmd):
+        """Run command and return stdout, raise Exception if cmd fails"""
+        for x_try in range(self.max_try):
+            if x_try:
+                time.sleep(self.retry_delay * 2 ** (x_try - 1))
+            started = time.time()
+            returncode, out = self._execute(cmd)
+            self._record(cmd, time.time() - started)
+            if not returncode:
+                return out
+            logging.warning("ERROR VCS: %s try cmd:(%s) got %s" %
+                            (x_try, cmd, returncode))
+        raise Exception(returncode, cmd)
+
+
+    def stream(self, cmd):
+        """Run command and iterate over its stdout as it is produced.
+        Commands are not retried (output was already consumed).
+        @return (generator - str): chunks of output
+        """
+        started = time.time()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+        try:
+            while True:
+                chunk = os.read(proc.stdout.fileno(), STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            proc.stdout.close()
+            if proc.wait():
+                raise Exception(proc.returncode, cmd)
+        finally:
+            # consumer might stop before output is over
+            if proc.poll() is None:
+                # Popen.kill() requires python 2.6
+                os.kill(proc.pid, signal.SIGKILL)
+                proc.wait()
+            proc.stdout.close()
+            self._record(cmd, time.time() - started)
+
+
+    def close(self):
+        """release resources used by runner"""
+        pass
+
+
+class HgCmdServer(Runner):
+    """execute hg commands on a long-lived command server
+    (hg serve --cmdserver pipe), avoids process start-up on every command.
+
+    see http://mercurial.selenic.com/wiki/CommandServer
+    Commands that do not work on a existing repository (clone, init) are
+    executed on a new process.
+
+    @ivar work_path (str): repository used by the server
+    @ivar server (Popen): server process, started on first command
+    """
+    # commands not executed by the server
+    NO_SERVER = ('clone', 'init')
+
+    def __init__(self, work_path, max_try=3, retry_delay=1, bin='hg'):
+        Runner.__init__(self, max_try, retry_delay)
+        self.work_path = work_path
+        self.server_cmd = [bin, 'serve', '--cmdserver', 'pipe',
+                           '--config', 'ui.interactive=False',
+                           '--repository', work_path]
+        self.server = None
+        self.lock = threading.Lock()
+
+
+    def _start(self):
+        env = os.environ.copy()
+        # output not affected by user config
+        env['HGPLAIN'] = '1'
+        self.server = subprocess.Popen(self.server_cmd, env=env,
+                                       stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE)
+        channel, hello = self._read_channel()
+        if channel != 'o' or 'runcommand' not in hello:
+            self.close()
+            raise Exception("hg command server not supported: %r" % hello)
+
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.stdin.close()
+            self.server.wait()
+        except (IOError, OSError):
+            pass
+        self.server = None
+
+
+    def _read_channel(self):
+        """@return tuple(str, str): channel, data
+        for input channels ('I', 'L') data is the requested size
+        """
+        header = self.server.stdout.read(5)
+        if len(header) < 5:
+            raise IOError("hg command server closed")
+        channel, length = struct.unpack('>cI', header)
+        if channel in ('I', 'L'):
+            return channel, length
+        return channel, self.server.stdout.read(length)
+
+
+    def _write_block(self, data):
+        self.server.stdin.write(struct.pack('>I', len(data)) + data)
+        self.server.stdin.flush()
+
+
+    def _runcommand(self, args):
+        """send command and iterate over server messages
+        @return (generator - tuple): ('o', <output>) ... ('r', <returncode>)
+        """
+        self.server.stdin.write('runcommand\n')
+        self._write_block('\0'.join(args))
+        while True:
+            channel, data = self._read_channel()
+            if channel == 'o':
+                yield channel, data
+            elif channel == 'e':
+                logging.debug("VCS %s: %s" % (args[0], data.rstrip()))
+            elif channel == 'r':
+                yield channel, struct.unpack('>i', data)[0]
+                return
+            elif channel in ('I', 'L'):
+                # no input available
+                self._write_block('')
+            elif channel.isupper():
+                # required channel not supported
+                raise IOError("hg command server unknown channel %s" %
+                              channel)
+
+
+    def _execute(self, cmd):
+        if cmd[1] in self.NO_SERVER:
+            return Runner._execute(self, cmd)
+        self.lock.acquire()
+        try:
+            try:
+                if self.server is None:
+                    self._start()
+                out = []
+                for channel, data in self._runcommand(cmd[1:]):
+                    if channel == 'r':
+                        return data, ''.join(out)
+                    out.append(data)
+            except (IOError, OSError), exception:
+                # server is restarted on next call
+                logging.warning("hg command server error: %s" % exception)
+                self.close()
+                return -1, ''
+        finally:
+            self.lock.release()
+
+
+    def stream(self, cmd):
+        """the whole output is read holding the server lock and only
+        yielded after releasing it, a slow consumer (or one that stops
+        before the output is over) does not block other commands
+        """
+        if cmd[1] in self.NO_SERVER:
+            for chunk in Runner.stream(self, cmd):
+                yield chunk
+            return
+        started = time.time()
+        returncode, out = self._execute(cmd)
+        self._record(cmd, time.time() - started)
+        if returncode:
+            raise Exception(returncode, cmd)
+        yield out
+
+
+class LogEntryHandler(sax.ContentHandler):
+    """SAX handler for log entries in the format:
+    <logentry revision="N"><author>...</author><msg>...</msg></logentry>
+    (same as "svn log --xml")
+
+    @ivar entries (deque - dict): parsed entries not consumed yet
+    """
+    def __init__(self):
+        sax.ContentHandler.__init__(self)
+        self.entries = deque()
+        self._entry = None
+        self._text = None
+
+    def startElement(self, name, attrs):
+        if name == 'logentry':
+            self._entry = {'revision': attrs.get('revision'),
+                           'committer': u'',
+                           'comment': u''}
+        elif name in ('author', 'msg') and self._entry is not None:
+            self._text = []
+
+    def characters(self, content):
+        if self._text is not None:
+            self._text.append(content)
+
+    def endElement(self, name):
+        if name == 'logentry':
+            self.entries.append(self._entry)
+            self._entry = None
+        elif name in ('author', 'msg') and self._text is not None:
+            key = 'committer' if name == 'author' else 'comment'
+            self._entry[key] = u''.join(self._text)
+            self._text = None
+
+
+def parse_log_entries(chunks):
+    """parse log entries as the XML document is read, entries are
+    available before the whole document is parsed.
+    @param chunks (iterable - str): XML document
+    @return (generator - dict): {'revision', 'committer', 'comment'}
+    """
+    handler = LogEntryHandler()
+    parser = sax.make_parser()
+    parser.setContentHandler(handler)
+    for chunk in chunks:
+        parser.feed(chunk)
+        while handler.entries:
+            yield handler.entries.popleft()
+    parser.close()
+    while handler.entries:
+        yield handler.entries.popleft()
+
+
+def revisions_after(revs, from_rev, limit=None):
+    """@return (iterator - dict): revisions after from_rev (up to limit)"""
+    revs = itertools.dropwhile(
+        lambda rev: int(rev['revision']) <= int(from_rev), revs)
+    if limit:
+        return itertools.islice(revs, limit)
+    return revs
+
+
+def _wrap(chunks, head, tail):
+    yield head
+    for chunk in chunks:
+        yield chunk
+    yield tail
+
+
+# used by operations that do not belong to a working copy
+default_runner = Runner()
+
+def check_call_get(cmd):
+    """Run command and return stdout, raise Exception if cmd fails"""
+    return default_runner.run(cmd)
+
 
 # tested with hg 1.3.1
 class HG(object):
@@ -34,9 +332,10 @@ class HG(object):
     """
     rev_zero = 0 # number of first revision
     bin = 'hg'
-    def __init__(self, source, work_path):
+    def __init__(self, source, work_path, runner=None):
         self.source = source
         self.work_path = work_path
+        self.runner = runner if runner else Runner()
 
 
     @staticmethod
@@ -60,13 +359,13 @@ class HG(object):
 
     def add(self, file_path):
         """add specified file on the next commit"""
-        check_call_get(['hg','add', '--repository', self.work_path, file_path])
+        self.runner.run(['hg','add', '--repository', self.work_path, file_path])
 
 
     def commit(self, message):
         """commit all outstanding changes"""
-        check_call_get(['hg', 'commit', '--repository', self.work_path,
-                        '--message', message])
+        self.runner.run(['hg', 'commit', '--repository', self.work_path,
+                             '--message', message])
 
 
     def clone(self):
@@ -78,7 +377,7 @@ class HG(object):
         if os.path.exists(self.work_path):
             msg = "Can not clone to an existing path: %s"
             raise Exception(msg % self.work_path)
-        check_call_get(['hg', 'clone', self.source, self.work_path])
+        self.runner.run(['hg', 'clone', self.source, self.work_path])
 
 
     def archive(self, rev_num, dst_path):
@@ -92,7 +391,7 @@ class HG(object):
             shutil.rmtree(dst_path)
         cmd = ['hg', 'archive', '--repository', self.work_path,
                '--rev', rev_num, dst_path]
-        check_call_get(cmd)
+        self.runner.run(cmd)
 
 
     def tip(self):
@@ -101,24 +400,38 @@ class HG(object):
         """
         cmd = ['hg', 'tip', '--template', '{rev}\n',
                '--repository', self.work_path]
-        return check_call_get(cmd).strip()
+        return self.runner.run(cmd).strip()
 
 
     def pull(self):
         """pull changes from source"""
-        check_call_get(['hg', 'pull', '--repository', self.work_path])
+        self.runner.run(['hg', 'pull', '--repository', self.work_path])
 
 
-    def get_new_revisions(self, from_rev):
-        """return list of revisions from (from_rev:tip]
-        - exclude from_rev, include tip. empty list if from_rev==tip
+    def update(self, rev_num):
+        """update working copy to given revision (discard local changes)"""
+        self.runner.run(['hg', 'update', '--clean', '--rev', rev_num,
+                             '--repository', self.work_path])
+
+
+    def changed_paths(self, from_rev, to_rev):
+        """paths added, modified or removed between two revisions
+        @return (list - str): paths relative to repository root
+        """
+        cmd = ['hg', 'status', '--modified', '--added', '--removed',
+               '--no-status', '--rev', from_rev, '--rev', to_rev,
+               '--repository', self.work_path]
+        return self.runner.run(cmd).splitlines()
+
+
+    def iter_revisions(self, from_rev, limit=None):
+        """iterate over revisions from (from_rev:tip] in order,
+        revisions are parsed while log is being read.
+        (only revisions already on the working copy, see get_new_revisions)
         @param from_rev (str)
-        @return (list of dict): { 'revision': '174'
-                                  'committer': 'somebody'
-                                  'comment': 'commit message'}
+        @param limit (int): max number of revisions
+        @return (iterator - dict): same as get_new_revisions
         """
-        # first update working copy
-        self.pull()
         template = """<logentry revision="{rev}">
                       <author>{author|escape}</author>
                       <msg>{desc|escape}</msg>
@@ -126,25 +439,35 @@ class HG(object):
         cmd = ['hg', 'log', '--rev', '%s:' % from_rev,
                '--repository', self.work_path,
                '--template', template]
-        out = check_call_get(cmd)
-        revs = []
-        dom = minidom.parseString("<root>%s</root>" % out)
-        for logentry in dom.getElementsByTagName('logentry'):
-            author = logentry.getElementsByTagName('author')[0].firstChild.data
-            msg = logentry.getElementsByTagName('msg')[0].firstChild.data
-            revs.append({'revision': logentry.getAttribute('revision'),
-                         'committer': author,
-                         'comment': msg})
-        return sorted(revs, key=lambda k: int(k['revision']))[1:]
+        if limit:
+            # log includes from_rev
+            cmd.extend(['--limit', str(limit + 1)])
+        chunks = _wrap(self.runner.stream(cmd), '<root>', '</root>')
+        return revisions_after(parse_log_entries(chunks), from_rev, limit)
+
+
+    def get_new_revisions(self, from_rev, limit=None):
+        """return list of revisions from (from_rev:tip]
+        - exclude from_rev, include tip. empty list if from_rev==tip
+        @param from_rev (str)
+        @param limit (int): max number of revisions (first ones)
+        @return (list of dict): { 'revision': '174'
+                                  'committer': 'somebody'
+                                  'comment': 'commit message'}
+        """
+        # first update working copy
+        self.pull()
+        return list(self.iter_revisions(from_rev, limit))
 
 
 # tested with svn 1.6.5
 class SVN(object):
     rev_zero = 1 # number of first revision
     bin = 'svn'
-    def __init__(self, source, work_path):
+    def __init__(self, source, work_path, runner=None):
         self.source = source
         self.work_path = work_path
+        self.runner = runner if runner else Runner()
 
 
     @staticmethod
@@ -172,13 +495,13 @@ class SVN(object):
 
     def add(self, file_path):
         """add specified file on the next commit"""
-        check_call_get(['svn','add', file_path])
+        self.runner.run(['svn','add', file_path])
 
 
     def commit(self, message):
         """commit all outstanding changes"""
-        check_call_get(['svn', 'commit', '--message', message,
-                        self.work_path])
+        self.runner.run(['svn', 'commit', '--message', message,
+                             self.work_path])
 
 
     def clone(self):
@@ -192,7 +515,7 @@ class SVN(object):
         if os.path.exists(self.work_path):
             msg = "Can not clone to an existing path: %s"
             raise Exception(msg % self.work_path)
-        check_call_get(['svn', 'checkout', self.source, self.work_path])
+        self.runner.run(['svn', 'checkout', self.source, self.work_path])
 
 
     def archive(self, rev_num, dst_path):
@@ -206,16 +529,16 @@ class SVN(object):
             shutil.rmtree(dst_path)
         cmd = ['svn', 'export', '--force', '--revision', rev_num,
                          self.work_path, dst_path]
-        check_call_get(cmd)
+        self.runner.run(cmd)
 
 
     def tip(self):
         """show the tip revision
         @return (str): revision number
         """
-        check_call_get(['svn', 'up'])
+        self.runner.run(['svn', 'up'])
         cmd = ['svn', 'log', '--limit', '1', '--quiet', self.work_path]
-        out = check_call_get(cmd)
+        out = self.runner.run(cmd)
         for line in out.splitlines():
             if line[0] != 'r':
                 continue
@@ -225,31 +548,59 @@ class SVN(object):
 
     def pull(self):
         """pull changes from source"""
-        check_call_get(['svn', 'update', self.work_path])
+        self.runner.run(['svn', 'update', self.work_path])
+
+
+    def update(self, rev_num):
+        """update working copy to given revision"""
+        self.runner.run(['svn', 'update', '--revision', rev_num,
+                             self.work_path])
+
+
+    def changed_paths(self, from_rev, to_rev):
+        """paths added, modified or removed between two revisions
+        @return (list - str): paths relative to working copy root
+        """
+        cmd = ['svn', 'diff', '--summarize', '--xml',
+               '--revision', '%s:%s' % (from_rev, to_rev), self.work_path]
+        out = self.runner.run(cmd)
+        paths = []
+        dom = minidom.parseString(out)
+        for path_elem in dom.getElementsByTagName('path'):
+            path = path_elem.firstChild.data
+            for prefix in (self.work_path, self.source):
+                if path.startswith(prefix):
+                    path = path[len(prefix):].lstrip('/')
+                    break
+            paths.append(path)
+        return paths
+
+
+    def iter_revisions(self, from_rev, limit=None):
+        """iterate over revisions from (from_rev:tip] in order
+        (see HG.iter_revisions)
+        """
+        cmd = ['svn', 'log', '--xml', '--revision', '%s:HEAD' % from_rev,
+               self.work_path]
+        if limit:
+            # log includes from_rev
+            cmd.extend(['--limit', str(limit + 1)])
+        revs = parse_log_entries(self.runner.stream(cmd))
+        return revisions_after(revs, from_rev, limit)
 
 
-    def get_new_revisions(self, from_rev):
+    def get_new_revisions(self, from_rev, limit=None):
         """return list of revisions from (from_rev:tip]
         - exclude from_rev, include tip. empty list if from_rev==tip
         @param from_rev (str)
+        @param limit (int): max number of revisions (first ones)
         @return (list of dict): { 'revision': '174'
                                   'committer': 'somebody'
                                   'comment': 'commit message'}
         """
         # first update working copy
         self.pull()
-        cmd = ['svn', 'log', '--xml', '--revision', '%s:HEAD' % from_rev,
-               self.work_path]
-        out = check_call_get(cmd)
-        revs = []
-        dom = minidom.parseString(out)
-        for logentry in dom.getElementsByTagName('logentry'):
-            author = logentry.getElementsByTagName('author')[0].firstChild.data
-            msg = logentry.getElementsByTagName('msg')[0].firstChild.data
-            revs.append({'revision': logentry.getAttribute('revision'),
-                         'committer': author,
-                         'comment': msg})
-        return sorted(revs, key=lambda k: int(k['revision']))[1:]
+        return list(self.iter_revisions(from_rev, limit))
 
 
 class SVN_NoExport(SVN):
@@ -264,18 +615,18 @@ class SVN_NoExport(SVN):
             shutil.rmtree(dst_path)
         try:
             self.lock.acquire()
-            check_call_get(['svn', 'update', '--revision', rev_num,
-                            self.work_path])
+            self.runner.run(['svn', 'update', '--revision', rev_num,
+                                 self.work_path])
             check_call_get(['cp', '-r', self.work_path, dst_path])
             os.system('find %s -name ".svn" -exec rm -rf {} \;' % dst_path)
 
         finally:
             self.lock.release()
 
-    def get_new_revisions(self, from_rev):
+    def get_new_revisions(self, from_rev, limit=None):
         try:
             self.lock.acquire()
-            return SVN.get_new_revisions(self, from_rev)
+            return SVN.get_new_revisions(self, from_rev, limit)
         finally:
             self.lock.release()
 
@@ -286,9 +637,10 @@ class BZR(object):
     """interface to BZR (bazaar)"""
     rev_zero = 1 # number of first revision
     bin = 'bzr'
-    def __init__(self, source, work_path):
+    def __init__(self, source, work_path, runner=None):
         self.source = source
         self.work_path = work_path
+        self.runner = runner if runner else Runner()
 
 
     @staticmethod
@@ -312,12 +664,12 @@ class BZR(object):
 
     def add(self, file_path):
         """add specified file on the next commit"""
-        check_call_get(['bzr','add', file_path])
+        self.runner.run(['bzr','add', file_path])
 
 
     def commit(self, message):
         """commit all outstanding changes"""
-        check_call_get(['bzr', 'commit', '--message', message, self.work_path])
+        self.runner.run(['bzr', 'commit', '--message', message, self.work_path])
 
     def clone(self):
         """make a copy of an existing repository
@@ -328,7 +680,7 @@ class BZR(object):
         if os.path.exists(self.work_path):
             msg = "Can not clone to an existing path: %s"
             raise Exception(msg % self.work_path)
-        check_call_get(['bzr', 'branch', self.source, self.work_path])
+        self.runner.run(['bzr', 'branch', self.source, self.work_path])
 
 
     def archive(self, rev_num, dst_path):
@@ -341,7 +693,7 @@ class BZR(object):
         if os.path.exists(dst_path):
             shutil.rmtree(dst_path)
         cmd = ['bzr','export', '--revision', rev_num, dst_path, self.work_path]
-        check_call_get(cmd)
+        self.runner.run(cmd)
 
 
     def tip(self):
@@ -350,51 +702,96 @@ class BZR(object):
         """
         cmd = ['bzr', 'version-info', '--custom', '--template', '{revno}\n',
                self.work_path]
-        return check_call_get(cmd).strip()
+        return self.runner.run(cmd).strip()
 
 
     def pull(self):
         """pull changes from source"""
-        check_call_get(['bzr', 'pull', '--directory', self.work_path])
+        self.runner.run(['bzr', 'pull', '--directory', self.work_path])
+
+
+    def update(self, rev_num):
+        """update working copy to given revision"""
+        self.runner.run(['bzr', 'update', '--revision', rev_num,
+                             self.work_path])
 
 
-    def get_new_revisions(self, from_rev):
+    def changed_paths(self, from_rev, to_rev):
+        """paths added, modified or removed between two revisions
+        @return (list - str): paths relative to branch root
+        """
+        cmd = ['bzr', 'status', '--short',
+               '--revision', '%s..%s' % (from_rev, to_rev), self.work_path]
+        paths = []
+        for line in self.runner.run(cmd).splitlines():
+            # +N  file_name / R   old_name => new_name
+            paths.extend(line[4:].split(' => '))
+        return paths
+
+
+    def _parse_log(self, chunks):
+        """parse output from "bzr log --short" as it is read
+        @return (generator - dict)
+        """
+        first = True
+        msg = []
+        pending = ''
+        for chunk in chunks:
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                if first:
+                    # 2 Eduardo Schettino 2008-02-27
+                    revision, commiter = \
+                        line.rsplit(None,1)[0].split(None,1)
+                    first = False
+                    continue
+                if line:
+                    msg.append(line.strip())
+                else:
+                    yield {'revision': revision,
+                           'committer': commiter,
+                           'comment': "\n".join(msg)}
+                    first = True
+                    msg = []
+
+
+    def iter_revisions(self, from_rev, limit=None):
+        """iterate over revisions from (from_rev:tip] in order
+        (see HG.iter_revisions)
+        """
+        cmd = ['bzr', 'log', '--revision=%s..' % from_rev,
+               '--forward', '--short', self.work_path]
+        revs = self._parse_log(self.runner.stream(cmd))
+        return revisions_after(revs, from_rev, limit)
+
+
+    def get_new_revisions(self, from_rev, limit=None):
         """return list of revisions from (from_rev:tip]
         - exclude from_rev, include tip. empty list if from_rev==tip
         @param from_rev (str)
+        @param limit (int): max number of revisions (first ones)
         @return (list of dict): { 'revision': '174'
                                   'committer': 'somebody'
                                   'comment': 'commit message'}
         """
         # first update working copy
         self.pull()
-        cmd = ['bzr', 'log', '--revision=%s..' % from_rev,
-               '--forward', '--short', self.work_path]
-        out = check_call_get(cmd)
-        revs = []
-        first = True
-        msg = []
-        for line in out.splitlines():
-            if first:
-                # 2 Eduardo Schettino 2008-02-27
-                revision, commiter = line.rsplit(None,1)[0].split(None,1)
-                first = False
-                continue
-            if line:
-                msg.append(line.strip())
-            else:
-                revs.append({'revision': revision,
-                             'committer': commiter,
-                             'comment': "\n".join(msg)})
-                first = True
-                msg = []
-        return revs[1:]
+        return list(self.iter_revisions(from_rev, limit))
 
 
 
-def get_vcs(vcs_name, url, work_path):
-    """return a VCS object"""
+def get_vcs(vcs_name, url, work_path, cmdserver=False):
+    """return a VCS object
+    @param cmdserver (bool): execute commands on a long-lived command server
+                             (only hg supports it)
+    """
     vcs_map = {'svn': SVN_NoExport,
                'bzr': BZR,
                'hg': HG}
-    return vcs_map[vcs_name](url, work_path)
+    runner = None
+    if cmdserver:
+        if vcs_name != 'hg':
+            raise Exception("VCS %s has no command server" % vcs_name)
+        runner = HgCmdServer(work_path)
+    return vcs_map[vcs_name](url, work_path, runner)
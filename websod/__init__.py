@@ -5,6 +5,7 @@ import yaml
 from flask import Flask
 
 from websod import database
+from websod.cache import PageCache
 
 
 # required by Flask framework
@@ -25,6 +26,9 @@ def setup_app(flask_app, config):
     db_uri = database.get_sa_db_uri(**config['db'])
     flask_app.db = database.DB(db_uri)
 
+    # rendered pages from finished integrations
+    flask_app.page_cache = PageCache(config.get('page_cache_size', 1000))
+
 
 ##################################
 
@@ -0,0 +1,87 @@
+"""cache of rendered pages
+
+Pages from finished integrations (and its jobs) do not change,
+they are rendered once and kept in memory (LRU).
+Responses have ETag and Last-Modified so browsers can do conditional
+requests and get a "304 Not Modified".
+
+The cache is per process, entries are invalidated by group_finished.
+"""
+
+import time
+import threading
+import itertools
+from hashlib import md5
+from datetime import datetime
+
+
+class Page(object):
+    """a rendered page
+    @ivar body (str)
+    @ivar etag (str): hash of body
+    @ivar last_modified (datetime): when page was rendered
+    @ivar tags (tuple): pages with a tag can be invalidated together
+    """
+    def __init__(self, body, tags=()):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.body = body
+        self.tags = tags
+        self.etag = md5(body).hexdigest()
+        # HTTP dates have a resolution of seconds
+        self.last_modified = datetime.utcfromtimestamp(int(time.time()))
+        self.last_used = None
+
+
+class PageCache(object):
+    """LRU cache of rendered pages
+
+    @ivar max_size (int): max number of pages in the cache
+    @ivar pages (dict): key => Page. key is tuple (<page-type>, <id>)
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.pages = {}
+        self.lock = threading.Lock()
+        self._counter = itertools.count()
+
+    def get(self, key):
+        """@return (Page): None if not in cache"""
+        self.lock.acquire()
+        try:
+            page = self.pages.get(key)
+            if page is not None:
+                page.last_used = self._counter.next()
+            return page
+        finally:
+            self.lock.release()
+
+    def set(self, key, body, tags=()):
+        """add page to cache, remove least recently used if cache is full
+        @return (Page)
+        """
+        page = Page(body, tags)
+        self.lock.acquire()
+        try:
+            page.last_used = self._counter.next()
+            self.pages[key] = page
+            if len(self.pages) > self.max_size:
+                lru = min(self.pages, key=lambda k: self.pages[k].last_used)
+                del self.pages[lru]
+        finally:
+            self.lock.release()
+        return page
+
+    def invalidate(self, key=None, tags=()):
+        """remove a page, and pages with any of the given tags"""
+        tags = set(tags)
+        self.lock.acquire()
+        try:
+            if key is not None:
+                self.pages.pop(key, None)
+            if tags:
+                for cache_key, page in self.pages.items():
+                    if tags.intersection(page.tags):
+                        del self.pages[cache_key]
+        finally:
+            self.lock.release()
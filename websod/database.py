@@ -28,6 +28,9 @@ class DB(object):
         self.session = scoped_session(
             sessionmaker(autocommit=False,
                          autoflush=False,
+                         # session is used by a single request, do not
+                         # reload all objects after a commit
+                         expire_on_commit=False,
                          bind=self.engine))
 
     def init_database(self):
@@ -1,89 +1,157 @@
+from sqlalchemy.sql import select, and_
+
 from websod import app
-from websod.models import Integration, Job, IntegrationResult
+from websod.models import Integration, IntegrationResult
+from websod.models import job_table, job_group_table
+from websod.models import IntegrationResultJob
 
 def integrations_view(integrations):
-    """process integrations adding necessary info to be used on templates"""
-    # calculate integration result
+    """process integrations adding necessary info to be used on templates
+    (read only, results are calculated when integration finishes)
+    """
     for integration in integrations:
-        try:
-            calculate_result(integration)
-        except Integration.IntegrationException:
-            pass # not finished or  already calculated, go on
-
         # get elapsed time
         # FIXME - add elapsed time to integration result...
         if integration.state == 'finished':
             integration.elapsed_time = '%.2f' % (integration.getElapsedTime() / 60.0)
-            calculate_diff(integration)
         else:
             integration.elapsed_time = ""
 
     # put diff values into integration object
-    for integration in integrations:
-        get_diff(integration)
-    app.db.session.commit()
+    get_diffs(integrations)
+
 
-def _compare_integration_failures(new_integ, old_integ):
+def calculate_integration(integration):
+    """calculate result and diff of a finished integration.
+    can be called many times, only missing values are calculated.
+    @return (bool): True if anything was calculated
+    @raise Integration.NotFinished
+    """
+    calculated = False
+    try:
+        calculate_result(integration)
+        calculated = True
+    except Integration.AlreadyCalculated:
+        pass
+    if not getattr(integration, 'integration_result', None):
+        calculate_diff(integration)
+        calculated = True
+    return calculated
+
+
+def calculate_pending():
+    """calculate all integrations that finished but were not calculated
+    (i.e. websod was not running when sodd notified it)
+    @return (list - Integration): calculated integrations
+    """
+    session = app.db.session
+    integrations = session.query(Integration).outerjoin(
+        Integration.integration_result).filter(
+        IntegrationResult.id == None).order_by(Integration.id).all()
+    calculated = []
+    for integration in integrations:
+        try:
+            if calculate_integration(integration):
+                calculated.append(integration)
+        except Integration.NotFinished:
+            continue
+        # diff of next integration depends on this one
+        session.commit()
+    return calculated
+
+# max number of values in a SQL "IN" clause (sqlite limit is 999)
+MAX_IN_IDS = 500
+
+def get_job_results(integration_id, names=None):
+    """get result of jobs from an integration (plain rows, no ORM objects)
+    @param names (list - str): get only jobs with these names.
+                               default: all jobs that did not succeed.
+    @return (dict): job identity (name, type) => (job_id, result)
+    """
+    columns = [job_table.c.id, job_table.c.name, job_table.c.type,
+               job_table.c.result]
+    from_obj = [job_table.join(job_group_table)]
+    in_integration = job_group_table.c.integration_id == integration_id
+    if names is None:
+        queries = [select(columns, and_(in_integration,
+                                        job_table.c.result != 'success'),
+                          from_obj=from_obj)]
+    else:
+        queries = [select(columns, and_(in_integration, job_table.c.name.in_(
+                        names[start:start + MAX_IN_IDS])), from_obj=from_obj)
+                   for start in range(0, len(names), MAX_IN_IDS)]
+    jobs = {}
+    for query in queries:
+        for id_, name, type_, result in app.db.session.execute(query):
+            jobs[(name, type_)] = (id_, result)
+    return jobs
+
+
+def diff_job_results(new_jobs, old_jobs):
+    """compare job results of an integration with its parent
+    @param new_jobs (dict): as returned by get_job_results,
+                            must include successful jobs that failed on old
+    @param old_jobs (dict): as returned by get_job_results,
+                            jobs missing are successful or did not exist.
+    @return (dict): category => list of job ids (see IntegrationResultJob)
+    """
     # job.log is not included in comparsion since the error log contain
     # file path which is different between revisions.
-    _get_job_info = lambda job: (job.name, job.type, job.state)
-
-    new_failure_ids = []
-    fixed_failure_ids = []
-
-    old_jobs = {}
-    for job in old_integ.getJobs():
-        old_jobs[_get_job_info(job)] = job
-
-    for new_job in new_integ.getJobs():
-        job_info = _get_job_info(new_job)
-        if job_info in old_jobs:
-            old_job = old_jobs.pop(job_info)
-            # compare
-            if new_job.result == 'fail' and old_job.result == 'success':
-                new_failure_ids.append(new_job.id)
-            elif new_job.result == 'success' and old_job.result == 'fail':
-                fixed_failure_ids.append(old_job.id)
-        elif new_job.result == 'fail':
-            # for new added jobs, check 'failures'
-            new_failure_ids.append(new_job.id)
-
-    return new_failure_ids, fixed_failure_ids
-
+    diff = dict((category, []) for category in IntegrationResultJob.CATEGORIES)
+    for key, (job_id, result) in new_jobs.iteritems():
+        old_id, old_result = old_jobs.get(key, (None, None))
+        if result == 'fail':
+            # failed now and passed before (or a new job)
+            if old_id is None:
+                diff['new_failure'].append(job_id)
+            else:
+                diff['failure'].append(job_id)
+        elif result == 'unstable':
+            diff['unstable'].append(job_id)
+        elif result == 'success' and old_result == 'fail':
+            diff['fixed'].append(old_id)
+    for job_ids in diff.itervalues():
+        job_ids.sort()
+    return diff
+
+
+def get_parent(integration):
+    """finished integration of the parent revision from the same repository
+    @return (int): parent integration id or None
+    """
+    if integration.parent_revision is None:
+        return None
+    parent = app.db.session.query(Integration.id).\
+        filter(Integration.source_tree_root_id ==
+               integration.source_tree_root_id).\
+        filter(Integration.revision == integration.parent_revision).\
+        filter(Integration.state == 'finished').\
+        order_by(Integration.id.desc()).first()
+    return parent and parent[0]
 
 
 def calculate_diff(integration):
     """Calcualte diff from integration
     results is save on integration_result table
     """
-    # TODO this logic can not handle integrations with a higher revision
-    # number being executed before a previous revision
-
     # check if calculated already
     if getattr(integration, 'integration_result', None):
         return
 
-    # classify jobs by result
-    unstables = integration.getJobsByResult("unstable")
-    failures = integration.getJobsByResult('fail')
-    failure_ids = [failure.id for failure in failures]
-    unstable_ids = [unstable.id for unstable in unstables]
-    # calculate diff
-    parent = app.db.session.query(Integration).order_by(Integration.id.desc()).\
-        filter("id < %d" % integration.id).first()
-    if parent is None:
-        # nothing to compare on first ever integration
-        new_failure_ids = failure_ids
-        fix_failure_ids = []
-    else:
-        new_failure_ids, fix_failure_ids = _compare_integration_failures(
-            integration, parent)
+    # nothing to compare on first ever integration
+    parent_id = get_parent(integration)
+    old_jobs = get_job_results(parent_id) if parent_id else {}
+    new_jobs = get_job_results(integration.id)
+    # jobs that failed on parent might be fixed now
+    fixed = [name for (name, type_), (id_, result) in old_jobs.iteritems()
+             if result == 'fail' and (name, type_) not in new_jobs]
+    if fixed:
+        new_jobs.update(get_job_results(integration.id, sorted(set(fixed))))
+    diff = diff_job_results(new_jobs, old_jobs)
+
     # put into DB
-    integration.integration_result = IntegrationResult(
-        new_failures=','.join(map(str, new_failure_ids)),
-        all_failures=','.join(map(str, failure_ids)),
-        fixed_failures=','.join(map(str, fix_failure_ids)),
-        unstables=','.join(map(str, unstable_ids)))
+    integration.integration_result = IntegrationResult()
+    IntegrationResultJob.save_many(app.db.session, integration.id, diff)
 
 
 def get_diff(integration):
@@ -93,38 +161,43 @@ def get_diff(integration):
       * fixed_failures
       * unstables
     """
-    # skip diff calculation if integration not finished
-    if integration.state != 'finished':
-        # no need calculate for running tasks since the results are not live.
+    get_diffs([integration])
+
+
+def get_diffs(integrations):
+    """get_diff for many integrations, all jobs fetched at once"""
+    diffs = {}
+    for integration in integrations:
+        # TODO put results in a dict instead of using integration object
         integration.unstables = []
         integration.failures = []
         integration.fixed_failures = []
-        return
-
-    result = integration.integration_result
-
-    # ids are stored in DB as comma separated string
-    new_failure_ids = result.new_failures.split(',')
-    fix_failure_ids = result.fixed_failures.split(',')
-    unstable_ids = result.unstables.split(',')
-    failure_ids = result.all_failures.split(',')
-
-    # convert the string to a list of integers
-    new_failure_ids = [] if new_failure_ids == [''] else map(int, new_failure_ids)
-    fix_failure_ids = [] if fix_failure_ids == [''] else map(int, fix_failure_ids)
-    unstable_ids = [] if unstable_ids == [''] else map(int, unstable_ids)
-    failure_ids = [] if failure_ids == [''] else map(int, failure_ids)
-
-    def job(job_id):
-        return app.db.session.query(Job).get(job_id)
-
-    # TODO put results in a dict instead of using integration object
-    integration.failures = [job(id_) for id_ in failure_ids]
-    integration.unstables = [job(id_) for id_ in unstable_ids]
-    integration.fixed_failures = [job(id_) for id_ in fix_failure_ids]
-    # mark new failures
-    for failure in integration.failures:
-        failure.new_failure = failure.id in new_failure_ids
+        # skip diff calculation if integration not finished
+        # no need calculate for running tasks since the results are not live.
+        if integration.state == 'finished':
+            diffs[integration.id] = integration
+
+    session = app.db.session
+    ids = diffs.keys()
+    for start in range(0, len(ids), MAX_IN_IDS):
+        query = session.query(IntegrationResultJob).filter(
+            IntegrationResultJob.integration_id.in_(ids[start:start + MAX_IN_IDS]))
+        for result_job in query:
+            integration = diffs[result_job.integration_id]
+            job = result_job.job
+            if result_job.category in ('failure', 'new_failure'):
+                # mark new failures
+                job.new_failure = (result_job.category == 'new_failure')
+                integration.failures.append(job)
+            elif result_job.category == 'fixed':
+                integration.fixed_failures.append(job)
+            else:
+                integration.unstables.append(job)
+
+    for integration in diffs.itervalues():
+        for jobs in (integration.failures, integration.fixed_failures,
+                     integration.unstables):
+            jobs.sort(key=lambda job: job.id)
 
 
 def calculate_result(integration):
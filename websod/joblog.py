@@ -0,0 +1,157 @@
+"""read job logs in chunks, without loading whole log into memory
+
+A job log is saved (zlib compressed) on the log_store table referenced by
+job.log_hash or, when it is big, on a compressed file outside the DB
+(see sodd/logfiles.py). Logs from old versions are on the job.log column.
+
+Logs on the job.log column are read with SQL substr(). Positions are in
+characters (same as bytes for ASCII logs).
+"""
+
+import os
+import zlib
+import gzip
+import struct
+
+from sqlalchemy import select, func
+
+from websod.models import job_table, log_store_table
+
+
+# size of chunks read from DB or file
+CHUNK_SIZE = 64 * 1024
+
+
+def log_file_path(path, log_hash):
+    """@return (str): path of compressed log file (same as sodd)"""
+    return os.path.join(path, log_hash[:2], log_hash + '.gz')
+
+
+class JobLog(object):
+    """log from a job
+
+    @ivar engine: SQLAlchemy engine. a new connection is used to read the log
+                  so it can be streamed after the request session is closed
+    @ivar job_id (int)
+    @ivar log_hash (str): key on log_store, None if log is on job table
+    @ivar on_file (bool): log_store data is on a file
+    @ivar size (int): log size
+    @ivar log_path (str): path where log files are saved
+    """
+    def __init__(self, engine, job_id, log_hash, on_file, size,
+                 log_path=None):
+        self.engine = engine
+        self.job_id = job_id
+        self.log_hash = log_hash
+        self.on_file = on_file
+        self.size = size
+        self.log_path = log_path
+
+    @classmethod
+    def get(cls, engine, job_id, log_path=None):
+        """@return (JobLog): None if job does not exist"""
+        join = job_table.outerjoin(log_store_table)
+        query = select([job_table.c.log_hash,
+                        func.length(job_table.c.log),
+                        log_store_table.c.size,
+                        log_store_table.c.data == None],
+                       job_table.c.id == job_id, from_obj=[join])
+        row = engine.execute(query).fetchone()
+        if row is None:
+            return None
+        log_hash, job_log_size, size, on_file = row
+        if not log_hash:
+            return cls(engine, job_id, None, False, job_log_size or 0)
+        on_file = bool(on_file)
+        if on_file:
+            if not log_path:
+                raise Exception("Job %s log is on a file but log_files path "
+                                "is not configured" % job_id)
+            # size not known for files saved before log_store existed
+            if size is None:
+                size = cls._file_size(log_file_path(log_path, log_hash))
+        return cls(engine, job_id, log_hash, on_file, size, log_path)
+
+    @staticmethod
+    def _file_size(file_path):
+        """uncompressed size from gzip trailer"""
+        gz_file = open(file_path, 'rb')
+        try:
+            gz_file.seek(-4, os.SEEK_END)
+            return struct.unpack('<I', gz_file.read(4))[0]
+        finally:
+            gz_file.close()
+
+
+    def read(self, start=0, stop=None):
+        """iterate over log content from start to stop (exclusive)
+        @return (generator - str): utf-8 encoded chunks
+        """
+        if stop is None or stop > self.size:
+            stop = self.size
+        if self.on_file:
+            return self._read_file(start, stop)
+        if self.log_hash:
+            return self._read_store(start, stop)
+        return self._read_job(start, stop)
+
+    def _read_job(self, start, stop):
+        conn = self.engine.connect()
+        try:
+            for pos in xrange(start, stop, CHUNK_SIZE):
+                length = min(CHUNK_SIZE, stop - pos)
+                # SQL strings are 1-indexed
+                query = select([func.substr(job_table.c.log, pos + 1, length)],
+                               job_table.c.id == self.job_id)
+                chunk = conn.execute(query).scalar()
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode('utf-8')
+                yield chunk
+        finally:
+            conn.close()
+
+    def _read_store(self, start, stop):
+        query = select([log_store_table.c.data],
+                       log_store_table.c.hash == self.log_hash)
+        data = str(self.engine.execute(query).scalar())
+        decompressor = zlib.decompressobj()
+        pos = 0
+        while pos < stop:
+            chunk = decompressor.decompress(data, CHUNK_SIZE)
+            data = decompressor.unconsumed_tail
+            if not chunk:
+                break
+            chunk_start = pos
+            pos += len(chunk)
+            if pos > start:
+                yield chunk[max(0, start - chunk_start):stop - chunk_start]
+
+    def _read_file(self, start, stop):
+        gz_file = gzip.open(log_file_path(self.log_path, self.log_hash), 'rb')
+        try:
+            gz_file.seek(start)
+            pos = start
+            while pos < stop:
+                chunk = gz_file.read(min(CHUNK_SIZE, stop - pos))
+                if not chunk:
+                    break
+                pos += len(chunk)
+                yield chunk
+        finally:
+            gz_file.close()
+
+
+    def tail(self, size):
+        """@return (str): last size characters of log.
+        logs on log_store or files are cut by byte position, the tail
+        starts on the next UTF-8 character boundary
+        """
+        start = max(0, self.size - size)
+        tail = ''.join(self.read(start))
+        if start and (self.log_hash or self.on_file):
+            skip = 0
+            # skip UTF-8 continuation bytes (10xxxxxx)
+            while skip < min(3, len(tail)) and 0x80 <= ord(tail[skip]) < 0xC0:
+                skip += 1
+            tail = tail[skip:]
+        return tail
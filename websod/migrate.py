@@ -0,0 +1,250 @@
+"""versioned schema migrations for the DB shared by websod and sodd
+
+The schema version of a DB is saved on the schema_version table.
+A migration is a function that takes a connection, migrations are executed
+in order, each one in a transaction. They must be safe to be executed on a
+DB that was (partially) migrated already.
+
+New databases (initdb) are created with the latest schema and
+stamped with the latest version.
+"""
+
+import zlib
+import hashlib
+
+from sqlalchemy import Table, Column, Integer
+from sqlalchemy.sql import text
+
+from websod.database import metadata
+from websod.models import integration_result_job_table, log_store_table
+from websod.models import skipped_revision_table, revision_number
+
+
+schema_version_table = Table(
+    'schema_version', metadata,
+    Column('version', Integer, nullable=False),
+    )
+
+
+def index_exists(conn, name):
+    """check if an index with the given name exists"""
+    if conn.dialect.name == 'sqlite':
+        query = text("SELECT name FROM sqlite_master "
+                     "WHERE type='index' AND name=:name")
+    elif conn.dialect.name in ('postgres', 'postgresql'):
+        query = text("SELECT indexname FROM pg_indexes WHERE indexname=:name")
+    else:
+        raise Exception("Sorry DB %s not supported" % conn.dialect.name)
+    return conn.execute(query, name=name).fetchone() is not None
+
+
+def column_exists(conn, table, column):
+    """check if table has a column with the given name"""
+    if conn.dialect.name == 'sqlite':
+        rows = conn.execute('PRAGMA table_info(%s)' % table).fetchall()
+        return column in [row[1] for row in rows]
+    query = text("SELECT column_name FROM information_schema.columns "
+                 "WHERE table_name=:table AND column_name=:column")
+    return conn.execute(query, table=table, column=column).fetchone() is not None
+
+
+def add_column(conn, table, column, type_):
+    if not column_exists(conn, table, column):
+        conn.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table, column, type_))
+
+
+def create_index(conn, table, column, unique=False):
+    """create index on table.column if it does not exist
+    (same name as created by SQLAlchemy for index=True columns)
+    """
+    name = 'ix_%s_%s' % (table, column)
+    if not index_exists(conn, name):
+        conn.execute('CREATE %sINDEX %s ON %s (%s)' %
+                     ('UNIQUE ' if unique else '', name, table, column))
+
+
+def add_indexes(conn):
+    for table, column in (('integration', 'version'),
+                          ('integration', 'state'),
+                          ('integration', 'source_tree_root_id'),
+                          ('integration_result', 'integration_id'),
+                          ('job_group', 'integration_id'),
+                          ('job_group', 'sodd_instance_id'),
+                          ('job', 'name'),
+                          ('job', 'job_group_id')):
+        create_index(conn, table, column)
+
+
+def add_integer_revision(conn):
+    add_column(conn, 'integration', 'revision', 'INTEGER')
+    add_column(conn, 'integration', 'parent_revision', 'INTEGER')
+    # non numeric versions (working copy identifiers) have no revision
+    rows = conn.execute('SELECT id, version FROM integration').fetchall()
+    for id_, version in rows:
+        conn.execute(text('UPDATE integration SET revision=:revision '
+                          'WHERE id=:id'),
+                     revision=revision_number(version), id=id_)
+    # parent is the previous integrated revision from same repository
+    conn.execute('''
+        UPDATE integration SET parent_revision = (
+            SELECT MAX(prev.revision) FROM integration prev
+            WHERE prev.revision < integration.revision AND
+                  prev.source_tree_root_id = integration.source_tree_root_id)
+        ''')
+    create_index(conn, 'integration', 'revision')
+
+
+def _split_ids(ids_str):
+    """ids used to be saved as comma separated string"""
+    if not ids_str:
+        return set()
+    return set(map(int, ids_str.split(',')))
+
+
+def add_integration_result_job(conn):
+    integration_result_job_table.create(bind=conn, checkfirst=True)
+    create_index(conn, 'integration_result_job', 'job_id')
+    if not column_exists(conn, 'integration_result', 'all_failures'):
+        return
+    # convert comma separated ids into rows. an integration might have
+    # more than one (duplicated) result, see unique_integration_result
+    rows = set()
+    old_results = conn.execute('''
+        SELECT integration_id, new_failures, all_failures, fixed_failures,
+               unstables FROM integration_result''')
+    for integration_id, new, all_, fixed, unstable in old_results:
+        new = _split_ids(new)
+        categories = (('new_failure', new),
+                      ('failure', _split_ids(all_) - new),
+                      ('fixed', _split_ids(fixed)),
+                      ('unstable', _split_ids(unstable)))
+        for category, job_ids in categories:
+            for job_id in job_ids:
+                rows.add((integration_id, job_id, category))
+    conn.execute(integration_result_job_table.delete())
+    if rows:
+        conn.execute(integration_result_job_table.insert(),
+                     [{'integration_id': integration_id, 'job_id': job_id,
+                       'category': category}
+                      for integration_id, job_id, category in sorted(rows)])
+
+
+def add_job_log_hash(conn):
+    add_column(conn, 'job', 'log_hash', 'VARCHAR(40)')
+
+
+def add_log_store(conn):
+    log_store_table.create(bind=conn, checkfirst=True)
+    saved = set(row[0] for row in conn.execute(
+            'SELECT hash FROM log_store'))
+    # logs saved as files by sodd (size is unknown)
+    for (log_hash,) in conn.execute('SELECT DISTINCT log_hash FROM job '
+                                    'WHERE log_hash IS NOT NULL').fetchall():
+        if log_hash not in saved:
+            conn.execute(log_store_table.insert(), hash=log_hash)
+            saved.add(log_hash)
+    # move logs from job table into log_store, a batch at a time
+    query = text("SELECT id, log FROM job WHERE id > :last_id AND "
+                 "log_hash IS NULL AND log != '' ORDER BY id LIMIT 500")
+    last_id = 0
+    while True:
+        rows = conn.execute(query, last_id=last_id).fetchall()
+        if not rows:
+            break
+        for job_id, log in rows:
+            if isinstance(log, unicode):
+                log = log.encode('utf-8')
+            log_hash = hashlib.sha1(log).hexdigest()
+            if log_hash not in saved:
+                conn.execute(log_store_table.insert(), hash=log_hash,
+                             size=len(log), data=zlib.compress(log, 9))
+                saved.add(log_hash)
+            conn.execute(text("UPDATE job SET log='', log_hash=:log_hash "
+                              "WHERE id=:id"), log_hash=log_hash, id=job_id)
+        last_id = rows[-1][0]
+
+
+def add_skipped_revision(conn):
+    skipped_revision_table.create(bind=conn, checkfirst=True)
+    create_index(conn, 'skipped_revision', 'covered_by')
+
+
+def unique_integration_result(conn):
+    # concurrent calculations might have saved more than one result
+    conn.execute('''
+        DELETE FROM integration_result WHERE id NOT IN (
+            SELECT MIN(id) FROM integration_result GROUP BY integration_id)
+        ''')
+    # replace non-unique index
+    if index_exists(conn, 'ix_integration_result_integration_id'):
+        conn.execute('DROP INDEX ix_integration_result_integration_id')
+    create_index(conn, 'integration_result', 'integration_id', unique=True)
+
+
+# list of (version, description, function)
+MIGRATIONS = [
+    (1, 'indexes on foreign keys, job name, integration version/state',
+     add_indexes),
+    (2, 'integration revision and parent_revision as integer',
+     add_integer_revision),
+    (3, 'integration_result_job table instead of comma separated ids',
+     add_integration_result_job),
+    (4, 'job log_hash, big logs saved as files', add_job_log_hash),
+    (5, 'log_store table, job logs compressed and saved only once',
+     add_log_store),
+    (6, 'skipped_revision table (coalesced revisions)', add_skipped_revision),
+    (7, 'integration_result unique per integration',
+     unique_integration_result),
+    ]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """@return (int): schema version of DB, 0 if never migrated"""
+    schema_version_table.create(bind=conn, checkfirst=True)
+    version = conn.execute(schema_version_table.select()).scalar()
+    if version is None:
+        conn.execute(schema_version_table.insert(), version=0)
+        return 0
+    return version
+
+
+def set_version(conn, version):
+    conn.execute(schema_version_table.update(), version=version)
+
+
+def stamp(engine):
+    """mark DB as using the latest schema (DB created by create_all)"""
+    conn = engine.connect()
+    try:
+        get_version(conn)
+        set_version(conn, LATEST_VERSION)
+    finally:
+        conn.close()
+
+
+def migrate(engine):
+    """execute pending migrations
+    @return (list - int): versions of executed migrations
+    """
+    conn = engine.connect()
+    executed = []
+    try:
+        current = get_version(conn)
+        for version, description, function in MIGRATIONS:
+            if version <= current:
+                continue
+            print "migration %s: %s" % (version, description)
+            trans = conn.begin()
+            try:
+                function(conn)
+                set_version(conn, version)
+                trans.commit()
+            except:
+                trans.rollback()
+                raise
+            executed.append(version)
+    finally:
+        conn.close()
+    return executed
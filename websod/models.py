@@ -1,7 +1,8 @@
 from sqlalchemy import Table, Column, ForeignKey
 from sqlalchemy import String, Integer, Text, DateTime, Float, Boolean
-from sqlalchemy.orm import mapper, relation, backref
-from sqlalchemy.sql import functions
+from sqlalchemy import Binary
+from sqlalchemy.orm import mapper, relation, backref, deferred
+from sqlalchemy.sql import functions, select, and_
 
 from websod.database import metadata
 
@@ -16,25 +17,50 @@ integration_table = Table(
     'integration', metadata,
     Column('id', Integer, primary_key=True),
     # VCS revision number or working copy identifier
-    Column('version', String(20)),
+    Column('version', String(20), index=True),
+    # VCS revision number (as integer) and revision of previous integration,
+    # NULL if version is not a number
+    Column('revision', Integer, index=True),
+    Column('parent_revision', Integer),
     # running/waiting/finished
-    Column('state', String(10)),
+    Column('state', String(10), index=True),
     Column('result', String(20)),
     # the person who created this revision or working copy owner
     Column('owner', String(40)),
     # the commit comment for the revision, length should be considered
     Column('comment', String(1024)),
+    Column('source_tree_root_id', Integer, ForeignKey('source_tree_root.id'),
+           index=True),
+    )
+
+# revisions not integrated by sodd (coalesce policy)
+skipped_revision_table = Table(
+    'skipped_revision', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('revision', Integer),
+    # revision of integration that includes the changes from this revision
+    Column('covered_by', Integer, index=True),
     Column('source_tree_root_id', Integer, ForeignKey('source_tree_root.id')),
     )
 
+# an integration has a row when its result and diff were calculated
 integration_result_table = Table(
     'integration_result', metadata,
     Column('id', Integer, primary_key=True),
-    Column('integration_id', Integer, ForeignKey('integration.id')),
-    Column('new_failures', Text()),
-    Column('all_failures', Text()),
-    Column('fixed_failures', Text()),
-    Column('unstables', Text()),
+    Column('integration_id', Integer, ForeignKey('integration.id'),
+           index=True, unique=True),
+    )
+
+# jobs from the integration diff
+integration_result_job_table = Table(
+    'integration_result_job', metadata,
+    Column('integration_id', Integer, ForeignKey('integration.id'),
+           primary_key=True),
+    Column('job_id', Integer, ForeignKey('job.id'), primary_key=True,
+           index=True),
+    # failure/new_failure/fixed/unstable
+    # (fixed jobs are from the parent integration)
+    Column('category', String(20), primary_key=True),
     )
 
 sodd_instance_table = Table(
@@ -54,25 +80,39 @@ job_group_table = Table(
     Column('result', String(10)),
     # if no tests can be executed, a log is generated about it
     Column('log', Text()),
-    Column('integration_id', Integer, ForeignKey('integration.id')),
-    Column('sodd_instance_id', Integer, ForeignKey('sodd_instance.id')),
+    Column('integration_id', Integer, ForeignKey('integration.id'),
+           index=True),
+    Column('sodd_instance_id', Integer, ForeignKey('sodd_instance.id'),
+           index=True),
     )
 
 job_table = Table(
     'job', metadata,
     Column('id', Integer, primary_key=True),
-    Column('name', String(100)),
+    Column('name', String(100), index=True),
     Column('type', String(20)),
     Column('state', String(10)), # running/waiting/finished
     # FIXME websod does not handle errors!
     Column('result', String(20)), # success/fail/unstable/error
+    # log used to be saved here, new logs are saved on log_store
     Column('log', Text()),
+    Column('log_hash', String(40), ForeignKey('log_store.hash')),
     Column('started', String()),
     Column('elapsed', Float()), # time in seconds
-    Column('job_group_id', Integer, ForeignKey('job_group.id')),
+    Column('job_group_id', Integer, ForeignKey('job_group.id'), index=True),
     )
 
 
+# job logs, each distinct log is saved once (see websod.joblog)
+log_store_table = Table(
+    'log_store', metadata,
+    # sha1 of log content
+    Column('hash', String(40), primary_key=True),
+    Column('size', Integer), # uncompressed size
+    # zlib compressed log. NULL if saved as a file (sodd log_files)
+    Column('data', Binary()),
+    )
+
 
 ######## models  #########
 
@@ -85,6 +125,16 @@ class SourceTreeRoot(object):
         self.source_location = source_location
 
 
+def revision_number(version):
+    """@return (int): revision as number, None if it is not numeric
+                     (i.e. working copy identifier)
+    """
+    try:
+        return int(version)
+    except (TypeError, ValueError):
+        return None
+
+
 class Integration(object):
 
     class IntegrationException(Exception): pass
@@ -92,9 +142,10 @@ class Integration(object):
     class AlreadyCalculated(IntegrationException): pass
 
     def __init__(self, version='', state='', result='',
-                 owner='', comment=''):
-        self.version = version #TODO rename as "revision" type int
-        # FIXME add a column to save integration parent revision
+                 owner='', comment='', parent_revision=None):
+        self.version = version
+        self.revision = revision_number(version)
+        self.parent_revision = parent_revision
         self.state = state
         self.result = result # FIXME move this to IntegrationResult table
         self.owner = owner
@@ -119,6 +170,26 @@ class Integration(object):
         return filter(lambda job: job.result == result_str,
                       self.getJobs())
 
+    def get_skipped_revisions(self, session):
+        """@return (list - int): revisions that were not integrated,
+                                 covered by this integration
+        """
+        table = skipped_revision_table
+        query = select([table.c.revision],
+                       and_(table.c.covered_by == self.revision,
+                            table.c.source_tree_root_id ==
+                            self.source_tree_root_id)).\
+                       order_by(table.c.revision)
+        return [row[0] for row in session.execute(query)]
+
+    def get_job_names(self, session):
+        """@return (list - str): names of jobs from this integration"""
+        query = select([job_table.c.name],
+                       job_group_table.c.integration_id == self.id,
+                       from_obj=[job_table.join(job_group_table)],
+                       distinct=True)
+        return [row[0] for row in session.execute(query)]
+
     def getElapsedTime(self):
         total = 0.0
         for jg in self.jobgroups:
@@ -130,43 +201,57 @@ class Integration(object):
 
     @staticmethod
     def get_elapsed_history(session):
-        #the last integrations
-        #TODO add limit(NO_OF_HISTORY_LAST_VALUES
-        res = session.query(Integration).order_by(Integration.version.desc()).all()
-
-#         #FIXME use SQL to calculate this
-#         res = session.query(Integration).filter(Integration.version<self.version).\
-#                  order_by(Integration.version.desc()).limit(NO_OF_HISTORY_LAST_VALUES)
-#         #calculate the sum of all jobs for every integration
-#         sum_array = []
-#         for an_integration in res:
-#             sum_value = session.query(functions.sum(Job.elapsed)).join(JobGroup).join(Integration).filter(Integration.id==an_integration.id).scalar()
-#             print sum_value
-#             sum_array.append([int(an_integration.version), sum_value])
-#         return sum_array
-
-        result = []
-        for rev in res:
-            if rev.state != 'finished' or rev.result != 'success':
-                continue
-            total = rev.getElapsedTime()
-            result.append([int(rev.version), total/60.0])
+        """total elapsed time of the last successful integrations
+        @return (list): [revision (int), elapsed in minutes (float)]
+                        ordered by revision
+        """
+        res = session.query(Integration.revision,
+                            functions.sum(JobGroup.elapsed)).\
+            join(Integration.jobgroups).\
+            filter(Integration.state == 'finished').\
+            filter(Integration.result == 'success').\
+            group_by(Integration.id, Integration.revision).\
+            order_by(Integration.id.desc()).\
+            limit(NO_OF_HISTORY_LAST_VALUES)
+        result = [[revision, (total or 0) / 60.0] for revision, total in res]
+        result.sort()
         return result
 
 
 
 class IntegrationResult(object):
 
-    def __init__(self, new_failures=None, all_failures=None,
-                 fixed_failures=None, unstables=None):
-        self.new_failures = new_failures
-        self.all_failures = all_failures
-        self.fixed_failures = fixed_failures
-        self.unstables = unstables
-
     def __repr__(self):
         return '<IntegrationResult %s>' % (self.integration_id)
 
+
+class IntegrationResultJob(object):
+    """a job on integration diff"""
+    CATEGORIES = ('failure', 'new_failure', 'fixed', 'unstable')
+
+    def __init__(self, integration_id, job_id, category):
+        self.integration_id = integration_id
+        self.job_id = job_id
+        self.category = category
+
+    def __repr__(self):
+        return '<IntegrationResultJob %s %s:%s>' % (
+            self.integration_id, self.category, self.job_id)
+
+    @staticmethod
+    def save_many(session, integration_id, jobs_by_category):
+        """insert all jobs from an integration diff at once
+        @param jobs_by_category (dict): category => list of job ids
+        """
+        rows = []
+        for category, job_ids in jobs_by_category.iteritems():
+            for job_id in job_ids:
+                rows.append({'integration_id': integration_id,
+                             'job_id': job_id,
+                             'category': category})
+        if rows:
+            session.execute(integration_result_job_table.insert(), rows)
+
 class SoddInstance(object):
     """A machine/configuration where the integration is executed"""
     def __init__(self, name='', machine=''):
@@ -206,10 +291,19 @@ class Job(object):
         return '<Job %s>' % self.name
 
     def get_elapsed_history(self, session):
-        #res = session.query(Job).join(JobGroup).join(Integration).filter(Job.name==self.name).filter(Integration.version<self.job_group.integration.version).order_by(Integration.version.desc()).limit(NO_OF_HISTORY_LAST_VALUES)
-        # FIXME do not show all integrations
-        res = session.query(Job).filter_by(name=self.name).order_by(Job.id)
-        return [[int(i.job_group.integration.version), i.elapsed] for i in res if i.elapsed]
+        """elapsed time of this job on the last integrations
+        @return (list): [revision (int), elapsed (float)] in execution order
+        """
+        res = session.query(Integration.revision, Job.elapsed).\
+            join(Integration.jobgroups, JobGroup.jobs).\
+            filter(Job.name == self.name).\
+            filter(Job.elapsed != None).\
+            order_by(Job.id.desc()).\
+            limit(NO_OF_HISTORY_LAST_VALUES)
+        result = [[revision, elapsed] for revision, elapsed in res
+                  if elapsed]
+        result.reverse()
+        return result
 
 
 
@@ -223,13 +317,22 @@ mapper(Integration, integration_table, properties={
         'source_tree_root': relation(SourceTreeRoot, backref='integrations')
         })
 
+# logs can be big, they are loaded only when accessed (see websod.joblog)
 mapper(JobGroup, job_group_table, properties={
-        'integration': relation(Integration, backref='jobgroups'),
+        'log': deferred(job_group_table.c.log),
+        'integration': relation(Integration, backref=backref(
+                'jobgroups', order_by=job_group_table.c.id)),
         'sodd_instance': relation(SoddInstance, backref='jobgroups')
         })
 
 mapper(Job, job_table, properties={
-        'job_group': relation(JobGroup, backref='jobs')
+        'log': deferred(job_table.c.log),
+        'job_group': relation(JobGroup, backref=backref(
+                'jobs', order_by=job_table.c.id))
+        })
+
+mapper(IntegrationResultJob, integration_result_job_table, properties={
+        'job': relation(Job, lazy=False)
         })
 
 mapper(IntegrationResult, integration_result_table, properties={
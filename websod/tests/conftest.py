@@ -0,0 +1,14 @@
+import websod
+
+
+def pytest_funcarg__app(request):
+    """websod app using a new sqlite DB"""
+    tmpdir = request.getfuncargvalue('tmpdir')
+    config = {'db': {'driver': 'sqlite',
+                     'database': str(tmpdir.join('websod.db'))},
+              'tasks': ['t1'],
+              'post-integration': []}
+    websod.setup_app(websod.app, config)
+    websod.app.db.init_database()
+    request.addfinalizer(websod.app.db.session.remove)
+    return websod.app
@@ -0,0 +1,23 @@
+"""create sample data on websod tests"""
+
+from websod.models import Integration, JobGroup, Job
+
+
+def add_integration(session, version, jobs=(), state='finished',
+                    parent_revision=None, source_tree_root_id=None):
+    """add integration with a single job group
+    @param jobs (list - tuple): (name, result) of each job
+    @return (Integration)
+    """
+    integration = Integration(version, state, 'unknown', 'me', 'comment',
+                              parent_revision)
+    integration.source_tree_root_id = source_tree_root_id
+    session.add(integration)
+    group = JobGroup('2010-01-01', 1.0, state, 'success')
+    group.integration = integration
+    for name, result in jobs:
+        job = Job(name, 'test', result, '', '2010-01-01', 1.0, state)
+        job.job_group = group
+        session.add(job)
+    session.commit()
+    return integration
@@ -0,0 +1,44 @@
+from websod.cache import Page, PageCache
+
+
+def test_page():
+    page = Page(u'\xe9')
+    assert '\xc3\xa9' == page.body
+    assert page.etag == Page('\xc3\xa9').etag
+    assert page.etag != Page('x').etag
+
+
+class TestPageCache(object):
+    def test_get_set(self):
+        cache = PageCache()
+        assert None == cache.get(('job', 1))
+        page = cache.set(('job', 1), 'body')
+        assert page is cache.get(('job', 1))
+        assert 'body' == page.body
+
+    def test_lru(self):
+        cache = PageCache(max_size=2)
+        cache.set(('job', 1), '1')
+        cache.set(('job', 2), '2')
+        # 1 is used, 2 is the least recently used
+        cache.get(('job', 1))
+        cache.set(('job', 3), '3')
+        assert [('job', 1), ('job', 3)] == sorted(cache.pages)
+
+    def test_invalidate_key(self):
+        cache = PageCache()
+        cache.set(('job', 1), '1')
+        cache.set(('job', 2), '2')
+        cache.invalidate(('job', 1))
+        cache.invalidate(('job', 5)) # not in cache
+        assert [('job', 2)] == cache.pages.keys()
+
+    def test_invalidate_tags(self):
+        cache = PageCache()
+        cache.set(('job', 1), '1', tags=[('job-name', 'a')])
+        cache.set(('job', 2), '2', tags=[('job-name', 'b')])
+        cache.set(('job', 3), '3', tags=[('job-name', 'a')])
+        cache.set(('integration', 1), 'i')
+        cache.invalidate(('integration', 1), [('job-name', 'a'),
+                                              ('job-name', 'x')])
+        assert [('job', 2)] == cache.pages.keys()
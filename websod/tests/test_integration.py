@@ -0,0 +1,80 @@
+from websod.models import IntegrationResultJob
+from websod.integration import diff_job_results, get_parent, calculate_diff
+
+from .sample import add_integration
+
+
+def test_diff_job_results():
+    # job identity => (job_id, result)
+    old_jobs = {('still', 'test'): (1, 'fail'),
+                ('fixed', 'test'): (2, 'fail'),
+                ('flaky', 'test'): (3, 'unstable')}
+    new_jobs = {('still', 'test'): (11, 'fail'),
+                ('fixed', 'test'): (12, 'success'),
+                ('flaky', 'test'): (13, 'unstable'),
+                ('new', 'test'): (14, 'fail'),
+                # same name, different type is a different job
+                ('still', 'lint'): (15, 'fail')}
+    diff = diff_job_results(new_jobs, old_jobs)
+    assert [11] == diff['failure']
+    assert [14, 15] == diff['new_failure']
+    # fixed jobs are from the parent integration
+    assert [2] == diff['fixed']
+    assert [13] == diff['unstable']
+
+
+def test_diff_job_results_no_parent():
+    new_jobs = {('a', 'test'): (1, 'fail'), ('b', 'test'): (2, 'unstable')}
+    diff = diff_job_results(new_jobs, {})
+    assert {'failure': [], 'new_failure': [1], 'fixed': [],
+            'unstable': [2]} == diff
+
+
+class TestGetParent(object):
+    def test_parent(self, app):
+        session = app.db.session
+        parent = add_integration(session, '10', source_tree_root_id=1)
+        # not the parent, integrated after (bisect)
+        add_integration(session, '11', parent_revision=10,
+                        source_tree_root_id=1)
+        intg = add_integration(session, '12', parent_revision=10,
+                               source_tree_root_id=1)
+        assert parent.id == get_parent(intg)
+
+    def test_no_parent(self, app):
+        intg = add_integration(app.db.session, '10', source_tree_root_id=1)
+        assert None == get_parent(intg)
+
+    def test_parent_not_finished(self, app):
+        session = app.db.session
+        add_integration(session, '10', state='running', source_tree_root_id=1)
+        intg = add_integration(session, '12', parent_revision=10,
+                               source_tree_root_id=1)
+        assert None == get_parent(intg)
+
+    def test_other_source_tree(self, app):
+        session = app.db.session
+        add_integration(session, '10', source_tree_root_id=2)
+        intg = add_integration(session, '12', parent_revision=10,
+                               source_tree_root_id=1)
+        assert None == get_parent(intg)
+
+
+def test_calculate_diff(app):
+    session = app.db.session
+    parent = add_integration(session, '10', [('a', 'fail'), ('b', 'fail'),
+                                             ('c', 'success')],
+                             source_tree_root_id=1)
+    intg = add_integration(session, '11', [('a', 'success'), ('b', 'fail'),
+                                           ('c', 'fail')],
+                           parent_revision=10, source_tree_root_id=1)
+    calculate_diff(intg)
+    session.commit()
+    jobs = dict((job.name, job.id) for job in intg.jobgroups[0].jobs)
+    parent_jobs = dict((job.name, job.id) for job in parent.jobgroups[0].jobs)
+    rows = session.query(IntegrationResultJob).filter(
+        IntegrationResultJob.integration_id == intg.id).all()
+    got = sorted((row.category, row.job_id) for row in rows)
+    assert sorted([('fixed', parent_jobs['a']), ('failure', jobs['b']),
+                   ('new_failure', jobs['c'])]) == got
+    assert intg.integration_result is not None
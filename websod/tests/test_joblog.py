@@ -0,0 +1,145 @@
+import os
+import zlib
+import gzip
+import hashlib
+
+from websod.models import job_table, log_store_table
+from websod.joblog import JobLog, log_file_path
+from websod.views import LOG_TAIL_SIZE
+
+from .sample import add_integration
+
+# log bigger than the tail shown on job page, with 2 bytes characters
+UNICODE_LOG = u'\xe9' * 40000 + u'x'
+
+
+def save_store_log(app, job_id, log):
+    """save log on log_store (as done by sodd)"""
+    log_hash = hashlib.sha1(log).hexdigest()
+    app.db.engine.execute(log_store_table.insert(), hash=log_hash,
+                          size=len(log), data=zlib.compress(log))
+    app.db.engine.execute(job_table.update(job_table.c.id == job_id),
+                          log='', log_hash=log_hash)
+
+
+def save_file_log(app, job_id, log, path):
+    """save log as a file (sodd log_files)"""
+    log_hash = hashlib.sha1(log).hexdigest()
+    file_path = log_file_path(path, log_hash)
+    os.makedirs(os.path.dirname(file_path))
+    log_file = gzip.open(file_path, 'wb')
+    log_file.write(log)
+    log_file.close()
+    app.db.engine.execute(log_store_table.insert(), hash=log_hash,
+                          size=len(log), data=None)
+    app.db.engine.execute(job_table.update(job_table.c.id == job_id),
+                          log='', log_hash=log_hash)
+
+
+def add_job(app):
+    """@return (int): id of a job from a finished integration"""
+    integration = add_integration(app.db.session, '1', [('j1', 'success')])
+    return integration.jobgroups[0].jobs[0].id
+
+
+# log with more than one chunk
+BIG_LOG = ''.join('line %d\n' % i for i in range(20000))
+
+
+class TestRead(object):
+    def check_read(self, log):
+        assert len(BIG_LOG) == log.size
+        assert BIG_LOG == ''.join(log.read())
+        assert BIG_LOG[10:100000] == ''.join(log.read(10, 100000))
+        assert BIG_LOG[-5:] == ''.join(log.read(log.size - 5, log.size + 10))
+        assert '' == ''.join(log.read(5, 5))
+
+    def test_job_column(self, app):
+        job_id = add_job(app)
+        app.db.engine.execute(job_table.update(job_table.c.id == job_id),
+                              log=BIG_LOG)
+        log = JobLog.get(app.db.engine, job_id)
+        assert None == log.log_hash
+        self.check_read(log)
+
+    def test_store(self, app):
+        job_id = add_job(app)
+        save_store_log(app, job_id, BIG_LOG)
+        log = JobLog.get(app.db.engine, job_id)
+        assert not log.on_file
+        self.check_read(log)
+
+    def test_file(self, app, tmpdir):
+        job_id = add_job(app)
+        save_file_log(app, job_id, BIG_LOG, str(tmpdir))
+        log = JobLog.get(app.db.engine, job_id, str(tmpdir))
+        assert log.on_file
+        self.check_read(log)
+
+    def test_not_found(self, app):
+        assert None == JobLog.get(app.db.engine, 999)
+
+
+class TestJobLogView(object):
+    def test_full(self, app):
+        job_id = add_job(app)
+        save_store_log(app, job_id, BIG_LOG)
+        response = app.test_client().get('/job/%d/log' % job_id)
+        assert 200 == response.status_code
+        assert BIG_LOG == response.data
+        assert 'bytes' == response.headers['Accept-Ranges']
+
+    def test_range(self, app):
+        job_id = add_job(app)
+        save_store_log(app, job_id, BIG_LOG)
+        client = app.test_client()
+        response = client.get('/job/%d/log' % job_id,
+                              headers={'Range': 'bytes=7-12'})
+        assert 206 == response.status_code
+        assert BIG_LOG[7:13] == response.data
+        assert ('bytes 7-12/%d' % len(BIG_LOG) ==
+                response.headers['Content-Range'])
+        # end of log
+        response = client.get('/job/%d/log' % job_id,
+                              headers={'Range': 'bytes=-20'})
+        assert 206 == response.status_code
+        assert BIG_LOG[-20:] == response.data
+
+    def test_range_not_satisfiable(self, app):
+        job_id = add_job(app)
+        save_store_log(app, job_id, 'small log')
+        response = app.test_client().get('/job/%d/log' % job_id,
+                                         headers={'Range': 'bytes=100-200'})
+        assert 416 == response.status_code
+        assert 'bytes */9' == response.headers['Content-Range']
+
+    def test_not_found(self, app):
+        assert 404 == app.test_client().get('/job/999/log').status_code
+
+
+class TestTail(object):
+    def test_store_utf8_boundary(self, app):
+        job_id = add_job(app)
+        save_store_log(app, job_id, UNICODE_LOG.encode('utf-8'))
+        log = JobLog.get(app.db.engine, job_id)
+        # cut would be in the middle of a character
+        assert (log.size - LOG_TAIL_SIZE) % 2
+        tail = log.tail(LOG_TAIL_SIZE).decode('utf-8')
+        assert UNICODE_LOG.endswith(tail)
+        assert LOG_TAIL_SIZE - 1 == len(tail.encode('utf-8'))
+
+    def test_job_column(self, app):
+        job_id = add_job(app)
+        app.db.engine.execute(job_table.update(job_table.c.id == job_id),
+                              log=UNICODE_LOG)
+        log = JobLog.get(app.db.engine, job_id)
+        # positions are characters
+        assert u'\xe9x' == log.tail(2).decode('utf-8')
+
+
+def test_job_page_unicode_log(app):
+    job_id = add_job(app)
+    save_store_log(app, job_id, UNICODE_LOG.encode('utf-8'))
+    response = app.test_client().get('/job/%d' % job_id)
+    assert 200 == response.status_code
+    assert (u'\xe9' * 100).encode('utf-8') in response.data
@@ -0,0 +1,111 @@
+import zlib
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+import py.test
+
+from websod import migrate
+
+
+# schema before any migration
+BASELINE_SCHEMA = """
+CREATE TABLE source_tree_root (id INTEGER PRIMARY KEY,
+    source_location VARCHAR(60));
+CREATE TABLE integration (id INTEGER PRIMARY KEY, version VARCHAR(20),
+    state VARCHAR(10), result VARCHAR(20), owner VARCHAR(40),
+    comment VARCHAR(1024), source_tree_root_id INTEGER);
+CREATE TABLE integration_result (id INTEGER PRIMARY KEY,
+    integration_id INTEGER, new_failures TEXT, all_failures TEXT,
+    fixed_failures TEXT, unstables TEXT);
+CREATE TABLE sodd_instance (id INTEGER PRIMARY KEY, name VARCHAR(30),
+    machine VARCHAR(40));
+CREATE TABLE job_group (id INTEGER PRIMARY KEY, started VARCHAR,
+    elapsed FLOAT, state VARCHAR(10), result VARCHAR(10), log TEXT,
+    integration_id INTEGER, sodd_instance_id INTEGER);
+CREATE TABLE job (id INTEGER PRIMARY KEY, name VARCHAR(100),
+    type VARCHAR(20), state VARCHAR(10), result VARCHAR(20), log TEXT,
+    started VARCHAR, elapsed FLOAT, job_group_id INTEGER);
+"""
+
+BASELINE_DATA = """
+INSERT INTO source_tree_root VALUES (1, 'repo1');
+INSERT INTO source_tree_root VALUES (2, 'repo2');
+INSERT INTO integration VALUES (1, '10', 'finished', 'fail', 'me', '', 1);
+INSERT INTO integration VALUES (2, '11', 'finished', 'fail', 'me', '', 1);
+INSERT INTO integration VALUES (3, '12', 'finished', 'fail', 'me', '', 2);
+INSERT INTO integration VALUES (4, 'wc-1', 'finished', 'fail', 'me', '', 1);
+INSERT INTO integration_result VALUES (1, 2, '5', '5,6', '3', '');
+INSERT INTO integration_result VALUES (2, 2, '5', '5,6', '3', '');
+INSERT INTO integration_result VALUES (3, 1, '', '', '', '7');
+INSERT INTO job_group VALUES (1, '', 1.0, 'finished', 'fail', '', 2, NULL);
+INSERT INTO job VALUES (5, 'a', 't', 'finished', 'fail', 'same', '', 1.0, 1);
+INSERT INTO job VALUES (6, 'b', 't', 'finished', 'fail', 'same', '', 1.0, 1);
+INSERT INTO job VALUES (8, 'c', 't', 'finished', 'success', 'other', '', 1.0, 1);
+INSERT INTO job VALUES (9, 'd', 't', 'finished', 'success', '', '', 1.0, 1);
+"""
+
+
+def pytest_funcarg__engine(request):
+    tmpdir = request.getfuncargvalue('tmpdir')
+    engine = create_engine('sqlite:///%s' % tmpdir.join('old.db'))
+    conn = engine.raw_connection()
+    conn.executescript(BASELINE_SCHEMA + BASELINE_DATA)
+    conn.close()
+    return engine
+
+
+def get_data(engine):
+    """all migrated data"""
+    tables = (('integration', 'id, version, revision, parent_revision'),
+              ('integration_result', 'id, integration_id'),
+              ('integration_result_job', 'integration_id, job_id, category'),
+              ('job', 'id, log, log_hash'),
+              ('log_store', 'hash, size, data'))
+    data = {}
+    for table, columns in tables:
+        query = 'SELECT %s FROM %s ORDER BY 1, 2' % (columns, table)
+        data[table] = [tuple(row) for row in engine.execute(query)]
+    return data
+
+
+def test_migrate(engine):
+    executed = migrate.migrate(engine)
+    assert [version for version, d, f in migrate.MIGRATIONS] == executed
+    data = get_data(engine)
+
+    # revision and parent from same repository, None if not numeric
+    assert [(1, '10', 10, None), (2, '11', 11, 10), (3, '12', 12, None),
+            (4, 'wc-1', None, None)] == data['integration']
+
+    # comma separated ids converted to rows
+    assert [(1, 7, 'unstable'), (2, 3, 'fixed'), (2, 5, 'new_failure'),
+            (2, 6, 'failure')] == sorted(data['integration_result_job'])
+    # duplicated result removed, only one result per integration
+    assert [(1, 2), (3, 1)] == data['integration_result']
+    py.test.raises(IntegrityError, engine.execute,
+                   "INSERT INTO integration_result (integration_id) "
+                   "VALUES (2)")
+
+    # logs moved to log_store, same log saved once
+    jobs = data['job']
+    assert [5, 6, 8, 9] == [job[0] for job in jobs]
+    assert ['', '', '', ''] == [job[1] for job in jobs]
+    assert jobs[0][2] == jobs[1][2]
+    assert None == jobs[3][2]
+    store = dict((row[0], row) for row in data['log_store'])
+    assert 2 == len(store)
+    assert ('same', 4) == (zlib.decompress(store[jobs[0][2]][2]),
+                           store[jobs[0][2]][1])
+    assert 'other' == zlib.decompress(store[jobs[2][2]][2])
+
+
+def test_migrate_again(engine):
+    migrate.migrate(engine)
+    data = get_data(engine)
+    # nothing to do
+    assert [] == migrate.migrate(engine)
+    assert data == get_data(engine)
+    # migrations are safe to be executed again on a migrated DB
+    engine.execute('UPDATE schema_version SET version=0')
+    assert len(migrate.MIGRATIONS) == len(migrate.migrate(engine))
+    assert data == get_data(engine)
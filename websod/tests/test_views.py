@@ -0,0 +1,86 @@
+import re
+
+from websod.models import skipped_revision_table
+
+from .sample import add_integration
+
+
+def test_bisect_invalidates_covering_integration(app):
+    session = app.db.session
+    intg15 = add_integration(session, '15', [('j1', 'fail')],
+                             parent_revision=12, source_tree_root_id=1)
+    for revision in (13, 14):
+        app.db.engine.execute(skipped_revision_table.insert(),
+                              revision=revision, covered_by=15,
+                              source_tree_root_id=1)
+    client = app.test_client()
+    assert 'revisions: 13, 14' in client.get('/integration/%d' % intg15.id).data
+    assert ('integration', intg15.id) in app.page_cache.pages
+
+    # sodd integrates revision 13 (bisect)
+    app.db.engine.execute(skipped_revision_table.delete(
+            skipped_revision_table.c.revision == 13))
+    intg13 = add_integration(session, '13', [('j1', 'success')],
+                             parent_revision=12, source_tree_root_id=1)
+    client.get('/group_finished/%d' % intg13.id)
+    assert ('integration', intg15.id) not in app.page_cache.pages
+    assert 'revisions: 14 ' in client.get('/integration/%d' % intg15.id).data
+
+
+class TestPageResponse(object):
+    def test_etag(self, app):
+        intg = add_integration(app.db.session, '10', [('j1', 'success')])
+        client = app.test_client()
+        url = '/integration/%d' % intg.id
+        response = client.get(url)
+        assert 200 == response.status_code
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        assert app.page_cache.get(('integration', intg.id)).etag in etag
+        # client has the page
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert 304 == response.status_code
+        assert '' == response.data
+        response = client.get(url,
+                              headers={'If-Modified-Since': last_modified})
+        assert 304 == response.status_code
+        # page changed
+        response = client.get(url, headers={'If-None-Match': '"xxx"'})
+        assert 200 == response.status_code
+
+    def test_not_finished(self, app):
+        intg = add_integration(app.db.session, '10', state='running')
+        response = app.test_client().get('/integration/%d' % intg.id)
+        assert 200 == response.status_code
+        assert 'ETag' not in response.headers
+        assert {} == app.page_cache.pages
+
+
+class TestIntegrationList(object):
+    def get_page(self, client, query=''):
+        """@return (list - int, str, str): integration ids on page,
+                                          newer and older page urls
+        """
+        data = client.get('/integration/' + query).data
+        ids = [int(id_) for id_ in re.findall(r'/integration/(\d+)"', data)]
+        newer = re.search(r'href="([^"]*after=\d+)"', data)
+        older = re.search(r'href="([^"]*before=\d+)"', data)
+        return (ids, newer and newer.group(1).replace('&amp;', '&'),
+                older and older.group(1).replace('&amp;', '&'))
+
+    def test_pages(self, app):
+        app.config['page_size'] = 2
+        ids = [add_integration(app.db.session, str(rev)).id
+               for rev in range(10, 15)]
+        client = app.test_client()
+        # newest first
+        page1, newer, older = self.get_page(client)
+        assert ids[:2:-1] == page1
+        assert None == newer
+        page2, newer, older = self.get_page(client, older.split('/')[-1])
+        assert [ids[2], ids[1]] == page2
+        page3, newer3, older3 = self.get_page(client, older.split('/')[-1])
+        assert [ids[0]] == page3
+        assert None == older3
+        # back to newer pages
+        assert page2 == self.get_page(client, newer3.split('/')[-1])[0]
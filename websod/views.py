@@ -1,8 +1,12 @@
-from flask import render_template, request
+from flask import render_template, request, url_for, abort
+from werkzeug.datastructures import ContentRange
+from sqlalchemy.orm import eagerload
+from sqlalchemy.exc import IntegrityError
 
 from websod import app
 from websod.models import Integration, Job
-from websod.integration import integrations_view, calculate_result, calculate_diff, get_diff
+from websod.joblog import JobLog
+from websod.integration import integrations_view, calculate_integration, get_diff
 
 
 @app.route('/debug')
@@ -11,12 +15,21 @@ def debug():
     return "<pre>" + pformat(dict(app.config)) + "</pre>"
 
 
+def query_integrations(session):
+    """query integrations loading all data used by integrations_view
+    (jobs are not used, diff jobs are loaded by get_diffs)
+    """
+    return session.query(Integration).options(
+        eagerload('jobgroups'), eagerload('integration_result'))
+
+
 @app.route('/')
 def home():
     """shows integrations time graph and latest integrations with diff """
     session = app.db.session
     limit = request.args.get('limit', 50, int)
-    integrations = session.query(Integration).order_by(Integration.id.desc()).limit(limit).all()
+    integrations = query_integrations(session).order_by(
+        Integration.id.desc()).limit(limit).all()
     integrations_view(integrations)
     return render_template('integration_list.html', integrations=integrations,
                            history=Integration.get_elapsed_history(session))
@@ -24,37 +37,151 @@ def home():
 
 @app.route('/integration/')
 def integration_list():
-    """shows all integrations with diff """
+    """shows integrations with diff, one page at a time
+
+    pages are selected by integration id (keyset pagination):
+      * before: integrations older than given id
+      * after: integrations newer than given id
+    """
     session = app.db.session
-    integrations = session.query(Integration).order_by(Integration.id.desc()).all()
+    page_size = app.config.get('page_size', 50)
+    before = request.args.get('before', None, int)
+    after = request.args.get('after', None, int)
+    query = query_integrations(session)
+    if after is not None:
+        query = query.filter(Integration.id > after).order_by(
+            Integration.id.asc())
+    else:
+        if before is not None:
+            query = query.filter(Integration.id < before)
+        query = query.order_by(Integration.id.desc())
+    # get one more to check if there are more pages
+    integrations = query.limit(page_size + 1).all()
+    has_more = len(integrations) > page_size
+    integrations = integrations[:page_size]
+    if after is not None:
+        integrations.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = before is not None, has_more
     integrations_view(integrations)
+
+    newer_url = older_url = None
+    if integrations and has_newer:
+        newer_url = url_for('integration_list', after=integrations[0].id)
+    if integrations and has_older:
+        older_url = url_for('integration_list', before=integrations[-1].id)
     return render_template('integration_list.html',
                            integrations=integrations,
-                           history='')
+                           history='',
+                           newer_url=newer_url, older_url=older_url)
+
+
+def page_response(page):
+    """response for a cached page, "304 Not Modified" if client has it"""
+    response = app.response_class(page.body, mimetype='text/html')
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    return response.make_conditional(request)
 
 
 @app.route('/integration/<int:id_>')
 def integration(id_):
     """integration page just show list of jobs with their result"""
+    page = app.page_cache.get(('integration', id_))
+    if page:
+        return page_response(page)
+
     integration = app.db.session.query(Integration).get(id_)
     # collect the failed jobs
     failed_jobs = integration.getJobsByResult("fail")
     unstable_jobs = integration.getJobsByResult("unstable")
     success_jobs = integration.getJobsByResult("success")
 
+    skipped = integration.get_skipped_revisions(app.db.session)
     tpl_data = {'integration': integration,
                 'failed_jobs': sorted(failed_jobs, key=lambda k: k.name),
                 'unstable_jobs': sorted(unstable_jobs, key=lambda k: k.name),
-                'success_jobs': sorted(success_jobs, key=lambda k: k.name)}
-    return render_template('integration.html', **tpl_data)
+                'success_jobs': sorted(success_jobs, key=lambda k: k.name),
+                'skipped': skipped}
+    body = render_template('integration.html', **tpl_data)
+    # finished integrations do not change,
+    # except for skipped revisions that are integrated later (bisect)
+    if integration.state != 'finished':
+        return body
+    tags = [skipped_tag(integration.source_tree_root_id, revision)
+            for revision in skipped]
+    page = app.page_cache.set(('integration', id_), body, tags=tags)
+    return page_response(page)
+
+
+def skipped_tag(source_tree_root_id, revision):
+    """cache tag of integration pages listing a skipped revision"""
+    return ('skipped-revision', source_tree_root_id, revision)
 
 
 @app.route('/job/<int:id_>')
 def job(id_):
+    page = app.page_cache.get(('job', id_))
+    if page:
+        return page_response(page)
+
     session = app.db.session
     the_job = session.query(Job).get(id_)
     elapsed_history = the_job.get_elapsed_history(session)
-    return render_template('job.html', job=the_job, history=elapsed_history)
+    log = get_job_log(id_)
+    # logs are not guaranteed to be valid UTF-8
+    log_tail = log.tail(LOG_TAIL_SIZE).decode('utf-8', 'replace')
+    body = render_template('job.html', job=the_job, history=elapsed_history,
+                           log_tail=log_tail,
+                           log_size=log.size, log_tail_size=LOG_TAIL_SIZE)
+    # job pages include elapsed history, that changes only when
+    # an integration with a job of the same name finishes
+    if the_job.job_group.integration.state != 'finished':
+        return body
+    page = app.page_cache.set(('job', id_), body,
+                              tags=[('job-name', the_job.name)])
+    return page_response(page)
+
+
+# job page shows only the end of the log
+LOG_TAIL_SIZE = 64 * 1024
+
+def get_job_log(job_id):
+    """@return (JobLog)"""
+    log_path = app.config.get('log_files', {}).get('path')
+    log = JobLog.get(app.db.engine, job_id, log_path)
+    if log is None:
+        abort(404)
+    return log
+
+
+@app.route('/job/<int:id_>/log')
+def job_log(id_):
+    """job log as plain text, streamed in chunks.
+
+    supports (single) Range requests, i.e. to get only the end of the log
+    "Range: bytes=-1000"
+    """
+    log = get_job_log(id_)
+    start, stop = 0, log.size
+    status = 200
+    if request.range:
+        log_range = request.range.range_for_length(log.size)
+        if log_range is None:
+            response = app.response_class(status=416)
+            response.content_range = ContentRange('bytes', None, None,
+                                                  log.size)
+            return response
+        start, stop = log_range
+        status = 206
+    response = app.response_class(log.read(start, stop), status=status,
+                                  mimetype='text/plain')
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.content_length = stop - start
+    if status == 206:
+        response.content_range = ContentRange('bytes', start, stop, log.size)
+    return response
 
 
 # this is supposed to be called by sodd's to notify when a job_group is done
@@ -62,14 +189,26 @@ def job(id_):
 def group_finished(integration_id):
     session = app.db.session
     integration = session.query(Integration).get(integration_id)
-
-    # calcualte
+    # new result on integration page and new value on the history of
+    # jobs with same name. if the revision was skipped before (bisect),
+    # the integration that covered it does not list it anymore.
+    tags = [('job-name', name) for name in
+            integration.get_job_names(session)]
+    tags.append(skipped_tag(integration.source_tree_root_id,
+                            integration.revision))
+    app.page_cache.invalidate(('integration', integration_id), tags)
+
+    # calcualte (results are saved only once)
     try:
-        calculate_result(integration)
-        calculate_diff(integration)
-    except Integration.IntegrationException, exception:
+        if not calculate_integration(integration):
+            return "Already calcualted integration id:%s" % integration.id
+        session.commit()
+    except Integration.NotFinished, exception:
         return str(exception)
-    session.commit()
+    except IntegrityError:
+        session.rollback()
+        return ("Integration id:%s calculated by concurrent request" %
+                integration.id)
 
     # post integration
     get_diff(integration)